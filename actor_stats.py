@@ -0,0 +1,158 @@
+'''
+In-memory actor leaderboard and per-actor film rental counts.
+
+Per-film rental counts are kept per day, so "top films of an actor" can be answered
+all-time or for a trailing window (e.g. the last 30 days) from the actor's own film
+list instead of joining actor -> film -> inventory -> rental on every request.
+
+New rentals are folded in incrementally: every sync reads only rental rows with an id
+above the last seen watermark, minus a window of lookback ids that is re-read every
+time. A rental whose transaction committed after a higher id was already folded in is
+found in that window; the ids folded in within it are remembered, so no rental is
+counted twice. Anything later than that is picked up by the full rebuild every
+rebuild_interval. A sync runs before a read when the counters are older
+than sync_interval, or right away after this process wrote rentals (mark_dirty), so
+rentals made by other worker processes are picked up as well. Names, titles and
+film lists come from the in-memory catalog snapshot (catalog.py) and are re-read when
+it swaps in a new one.
+'''
+import heapq
+import threading
+import time
+from datetime import date, timedelta
+
+
+class ActorStats:
+    def __init__(self, fetch_all, catalog, sync_interval=5, rebuild_interval=3600, lookback=1000):
+        self.fetch_all = fetch_all
+        self.catalog = catalog
+        self.sync_interval = sync_interval
+        self.rebuild_interval = rebuild_interval
+        self.lookback = lookback
+
+        self._actors = {}         # actor_id -> (first_name, last_name)
+        self._actor_films = {}    # actor_id -> [film_id]
+        self._titles = {}         # film_id -> title
+        self._leaderboard = []    # [(actor_id, film_count)] most films first
+        self._film_total = {}     # film_id -> all-time rental count
+        self._film_daily = {}     # film_id -> {date: rental count}
+        self._watermark = 0
+        self._recent = set()      # rental ids folded in that are still inside the lookback window
+        self._changes = 0         # bumped by every build and every rental folded in, part of version()
+        self._snapshot = None     # catalog snapshot the names and film lists come from
+
+        self._synced_at = 0.0
+        self._built_at = 0.0
+        self._dirty = False
+        self._built = False
+        self._lock = threading.RLock()
+
+    def build(self):
+        with self._lock:
+            self._load_catalog()
+            latest = self.fetch_all("""select coalesce(max(rental_id), 0) from sakila.rental;""")[0][0]
+            # Rentals below the lookback window are counted per film and day; the window is
+            # read row by row, as a sync reads it, so the next sync knows which ids it has
+            floor = max(latest - self.lookback, 0)
+            rows = self.fetch_all("""select i.film_id, date(r.rental_date), count(*)
+                                     from sakila.rental r
+                                     join sakila.inventory i on r.inventory_id = i.inventory_id
+                                     where r.rental_id <= %s
+                                     group by i.film_id, date(r.rental_date);""", (floor,))
+            self._film_total = {}
+            self._film_daily = {}
+            for film_id, day, count in rows:
+                self._add(film_id, day, int(count))
+            self._watermark = floor
+            self._recent = set()
+            self._changes += 1
+            self._fold(floor)
+            self._synced_at = self._built_at = time.monotonic()
+            self._built = True
+
+    def _load_catalog(self):
+        snapshot = self.catalog.snapshot()
+        self._snapshot = snapshot
+        self._actors = snapshot.actors()
+        self._titles = snapshot.titles()
+        actor_films = snapshot.actor_film_ids()
+        self._actor_films = actor_films
+        self._leaderboard = sorted(((actor_id, len(films)) for actor_id, films in actor_films.items()),
+                                   key=lambda item: (-item[1], item[0]))
+
+    def _add(self, film_id, day, count):
+        self._film_total[film_id] = self._film_total.get(film_id, 0) + count
+        daily = self._film_daily.setdefault(film_id, {})
+        daily[day] = daily.get(day, 0) + count
+
+    def mark_dirty(self):
+        # Called after this process inserted rentals; the next read syncs immediately
+        self._dirty = True
+
+    def sync(self, force=False):
+        with self._lock:
+            if not self._built:
+                self.build()
+                return
+            now = time.monotonic()
+            if self.catalog.snapshot() is not self._snapshot:
+                self._load_catalog()
+            if not (force or self._dirty or now - self._synced_at >= self.sync_interval):
+                return
+            self._dirty = False
+            if now - self._built_at >= self.rebuild_interval:
+                self.build()
+                return
+            self._fold(max(self._watermark - self.lookback, 0))
+            self._synced_at = now
+
+    def _fold(self, since):
+        # Called with the lock held; adds the rentals above since that are not counted yet
+        rows = self.fetch_all("""select r.rental_id, i.film_id, date(r.rental_date)
+                                 from sakila.rental r
+                                 join sakila.inventory i on r.inventory_id = i.inventory_id
+                                 where r.rental_id > %s
+                                 order by r.rental_id;""", (since,))
+        for rental_id, film_id, day in rows:
+            if rental_id in self._recent:
+                continue
+            self._recent.add(rental_id)
+            self._add(film_id, day, 1)
+            self._changes += 1
+            self._watermark = max(self._watermark, rental_id)
+        floor = self._watermark - self.lookback
+        self._recent = {rental_id for rental_id in self._recent if rental_id > floor}
+
+    def version(self):
+        # Catalog fingerprint and rental counters behind the current answers, used for ETags;
+        # a late rental below the watermark changes the answers but not the watermark
+        self.sync()
+        with self._lock:
+            return self._snapshot.fingerprint, self._watermark, self._changes
+
+    def top_actors(self, n=5):
+        # [(actor_id, first_name, last_name, film_count)]
+        self.sync()
+        with self._lock:
+            return [(actor_id, *self._actors.get(actor_id, ('', '')), film_count)
+                    for actor_id, film_count in self._leaderboard[:n]]
+
+    def top_films(self, actor_id, n=5, window_days=None):
+        # [(film_id, title, rental_count)] for the actor's most rented films, all-time or
+        # over the trailing window_days; films without rentals in the period are left out
+        self.sync()
+        with self._lock:
+            films = self._actor_films.get(actor_id, [])
+            if window_days is None:
+                counts = ((film_id, self._film_total.get(film_id, 0)) for film_id in films)
+            else:
+                since = date.today() - timedelta(days=window_days)
+                counts = ((film_id, sum(count for day, count in self._film_daily.get(film_id, {}).items()
+                                        if day is not None and day >= since))
+                          for film_id in films)
+            top = heapq.nlargest(n, ((count, -film_id) for film_id, count in counts if count > 0))
+            return [(-negative_id, self._titles.get(-negative_id), count) for count, negative_id in top]
+
+    def actor_name(self, actor_id):
+        self.sync()
+        return self._actors.get(actor_id)
@@ -0,0 +1,159 @@
+'''
+Admission control in front of the routes, so overload is turned away at the door
+instead of reaching MySQL as "Too many connections".
+
+Two checks run before a request is handled:
+
+* Rate limit: one token bucket per client, refilled at rate tokens per second up to
+  burst. A client with an empty bucket gets 429 and a Retry-After of the seconds
+  until its next token.
+* Concurrency limit per route class (cheap reads, expensive aggregates, writes): at
+  most limit requests of a class run at once. Up to queue_size more wait at most
+  queue_timeout seconds for a slot; a request that finds the queue full, or is still
+  waiting when the timeout runs out, gets 503 with a Retry-After.
+
+Both answers are produced without touching the database, and every rejection is
+counted per route class and reason.
+'''
+import math
+import threading
+import time
+from collections import OrderedDict
+
+
+class Rejected(Exception):
+    def __init__(self, status, reason, retry_after):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after  # whole seconds, at least 1
+
+
+class TokenBuckets:
+    # One bucket per client key. At most max_clients buckets are kept; the least
+    # recently seen client is dropped first, which at worst hands it a full bucket again.
+    def __init__(self, rate, burst, max_clients=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()  # key -> (tokens, refilled_at), most recently seen last
+        self._lock = threading.Lock()
+
+    def take(self, key, now=None):
+        # 0 if a token was taken, otherwise the seconds until one is available
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, refilled_at = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - refilled_at) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / self.rate
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class ConcurrencyLimit:
+    def __init__(self, limit, queue_size=16, queue_timeout=0.5):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+
+        self._active = 0
+        self._waiting = 0
+        self._lock = threading.Lock()
+        self._released = threading.Condition(self._lock)
+
+        self._stats = {
+            'admitted': 0,
+            'queued': 0,
+            'queue_time': 0.0,
+            'rejected_queue_full': 0,
+            'rejected_queue_timeout': 0,
+        }
+
+    def acquire(self):
+        # None once a slot is taken, otherwise the reason it was refused
+        with self._lock:
+            if self._active >= self.limit:
+                if self._waiting >= self.queue_size:
+                    self._stats['rejected_queue_full'] += 1
+                    return 'queue_full'
+                started = time.monotonic()
+                deadline = started + self.queue_timeout
+                self._waiting += 1
+                self._stats['queued'] += 1
+                try:
+                    while self._active >= self.limit:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._stats['rejected_queue_timeout'] += 1
+                            return 'queue_timeout'
+                        self._released.wait(remaining)
+                finally:
+                    self._waiting -= 1
+                    self._stats['queue_time'] += time.monotonic() - started
+            self._active += 1
+            self._stats['admitted'] += 1
+        return None
+
+    def release(self):
+        with self._lock:
+            self._active -= 1
+            self._released.notify()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                'limit': self.limit,
+                'queue_size': self.queue_size,
+                'active': self._active,
+                'waiting': self._waiting,
+            })
+        stats['queue_time'] = round(stats['queue_time'], 6)
+        return stats
+
+
+class Admission:
+    def __init__(self, limits, rate=0, burst=None, max_clients=10000):
+        self.limits = limits  # route class -> ConcurrencyLimit
+        # rate <= 0 turns the per-client limit off
+        self.buckets = TokenBuckets(rate, burst or max(1, int(rate * 2)), max_clients) if rate > 0 else None
+        self._rate_limited = {route_class: 0 for route_class in limits}
+        self._lock = threading.Lock()
+
+    def admit(self, client, route_class):
+        # Takes a slot for the request or raises Rejected; pair with release(route_class)
+        if self.buckets is not None:
+            wait = self.buckets.take(client)
+            if wait:
+                with self._lock:
+                    self._rate_limited[route_class] += 1
+                raise Rejected(429, 'rate_limited', max(1, math.ceil(wait)))
+        reason = self.limits[route_class].acquire()
+        if reason is not None:
+            raise Rejected(503, reason, max(1, math.ceil(self.limits[route_class].queue_timeout)))
+
+    def release(self, route_class):
+        self.limits[route_class].release()
+
+    def stats(self):
+        with self._lock:
+            rate_limited = dict(self._rate_limited)
+        classes = {}
+        for route_class, limit in self.limits.items():
+            classes[route_class] = limit.stats()
+            classes[route_class]['rejected_rate_limited'] = rate_limited[route_class]
+        return {
+            'classes': classes,
+            'rate': self.buckets.rate if self.buckets is not None else None,
+            'burst': self.buckets.burst if self.buckets is not None else None,
+            'clients': len(self.buckets) if self.buckets is not None else 0,
+        }
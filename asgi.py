@@ -0,0 +1,214 @@
+'''
+ASGI entry point.
+
+    uvicorn asgi:asgi_app --port 5000 --workers 4
+
+/api/get_customerdetails is answered on the event loop from an asyncio connection pool
+(async_db.py). The customer row with its rental counts, the newest active rentals and
+the newest past rentals are independent queries and run side by side, and a worker
+holds as many of these requests in flight as its pool has connections, without a
+thread for each. The answer is the Flask route's: same JSON, ETag / Last-Modified and
+304s, compression, CORS headers and admission control. It reads from the primary.
+
+Every other route is the Flask app, run by a2wsgi's WSGIMiddleware on a pool of
+ASGI_THREADS threads. ASYNC_POOL_SIZE and ASYNC_POOL_MAX_OVERFLOW size the asyncio
+pool of each worker, next to the threaded pool of main.py.
+
+warm_up() runs on the server's lifespan startup and shut_down() on its shutdown, so
+importing this module does not touch the database.
+'''
+import asyncio
+import os
+import time
+from urllib.parse import parse_qsl
+
+import mysql.connector.aio
+from a2wsgi import WSGIMiddleware
+from flask import Response
+from werkzeug.datastructures import Headers, MultiDict
+
+import main
+import statements
+from admission import Rejected
+from async_db import AsyncConnectionPool
+from http_cache import cache_key, compress, validate
+from serializers import dumps, json_response
+
+
+async def create_async_connection(host="localhost", port=3306):
+    return await mysql.connector.aio.connect(
+        host=host,
+        user="root",
+        password=os.getenv('MYSQL_DB_PASSWORD'),
+        database="sakila",
+        port=port,
+        ssl_disabled=True,
+        autocommit=True,
+        connection_timeout=10
+    )
+
+
+async_pool = AsyncConnectionPool(
+    create_async_connection,
+    pool_size=int(os.getenv('ASYNC_POOL_SIZE', 10)),
+    max_overflow=int(os.getenv('ASYNC_POOL_MAX_OVERFLOW', 20)),
+    pool_timeout=float(os.getenv('MYSQL_POOL_TIMEOUT', 10))
+)
+
+#Customer details as independent statements: the customer row with both rental counts, and one
+#page of active or past rentals (newest first, optionally below before_rental_id) per history part
+CUSTOMER_SUMMARY_QUERY = statements.register('customerdetails_summary', f"""select {main.CUSTOMER_COLUMNS},
+           (select count(*) from sakila.rental r where r.customer_id = c.customer_id and r.return_date is null),
+           (select count(*) from sakila.rental r where r.customer_id = c.customer_id and r.return_date is not null)
+    from sakila.customer c
+    where c.customer_id = %s;""")
+HISTORY_PAGE_QUERIES = {
+    (part, keyset): statements.register(
+        f'customerdetails_page_{part}' + ('_keyset' if keyset else ''),
+        f"""select r.rental_id, i.film_id, f.title, r.rental_date, r.return_date
+            from sakila.rental r
+            join sakila.inventory i on r.inventory_id = i.inventory_id
+            join sakila.film f on i.film_id = f.film_id
+            where r.customer_id = %s {main.HISTORY_FILTERS[part]}{' and r.rental_id < %s' if keyset else ''}
+            order by r.rental_id desc
+            limit %s;""")
+    for part in ('active', 'past') for keyset in (False, True)
+}
+
+
+def error_response(message, status, headers=None):
+    return json_response(dumps({'error': message}), status, headers)
+
+
+async def customer_details(args):
+    try:
+        customer_id, history, limit, before_rental_id = main.customer_details_args(args)
+    except ValueError as e:
+        return error_response(str(e), 400)
+
+    keyset = (before_rental_id,) if before_rental_id else ()
+    parts = (('active', 'past') if history == 'all' else (history,)) if limit else ()
+    summary, *pages = await async_pool.fetch_many(
+        (CUSTOMER_SUMMARY_QUERY, (customer_id,)),
+        *((HISTORY_PAGE_QUERIES[part, bool(keyset)], (customer_id, *keyset, limit)) for part in parts))
+    if not summary:
+        return error_response('Customer not found', 404)
+
+    #"all" merges the newest active and the newest past rentals into one page
+    history_rows = sorted((row for page in pages for row in page), key=lambda row: row[0], reverse=True)[:limit]
+    row = summary[0]
+    return json_response(main.customer_details_body(row[:9], row[9], row[10], history_rows, limit))
+
+
+#path -> (coroutine taking the query arguments, data version tags behind its ETag)
+NATIVE_ROUTES = {
+    '/api/get_customerdetails': (customer_details, ('customers', 'rentals')),
+}
+
+
+async def admit(scope, headers):
+    # The route class taken, or a 429/503 response when admission control turns the request away
+    if main.admission is None:
+        return None, None
+    address = scope['client'][0] if scope.get('client') else ''
+    client = (headers.get('X-Client-Id') or address) if main.rate_limit_key == 'client' else address
+    try:
+        #A queued request waits on a threading.Condition, so it waits off the event loop
+        await asyncio.to_thread(main.admission.admit, client, 'read')
+    except Rejected as e:
+        message = 'Too many requests.' if e.status == 429 else 'The server is busy. Please retry shortly.'
+        return None, error_response(message, e.status, {'Retry-After': str(e.retry_after)})
+    return 'read', None
+
+
+async def serve_native(scope, send, handler, tags):
+    started = time.perf_counter()
+    headers = Headers([(name.decode('latin-1'), value.decode('latin-1')) for name, value in scope['headers']])
+    args = MultiDict(parse_qsl(scope['query_string'].decode('latin-1'), keep_blank_values=True))
+
+    admitted, response = await admit(scope, headers)
+    try:
+        if response is None:
+            #Versions are fingerprint queries on the threaded pool, re-run at most every DATA_VERSION_CHECK_SECONDS
+            validators, not_modified = await asyncio.to_thread(
+                validate, main.data_versions, cache_key(scope['path'], args), tags,
+                headers.get('If-None-Match'), headers.get('If-Modified-Since'))
+            if not_modified:
+                response = Response(status=304, headers=validators)
+            else:
+                response = await handler(args)
+                if response.status_code == 200:
+                    response.headers.update(validators)
+    except main.DATABASE_UNAVAILABLE:
+        response = error_response('The database is busy. Please retry shortly.', 503, {'Retry-After': '1'})
+    finally:
+        if admitted is not None:
+            main.admission.release(admitted)
+
+    #As flask_cors answers for CORS(app)
+    origin = headers.get('Origin')
+    response.headers['Access-Control-Allow-Origin'] = origin or '*'
+    if origin:
+        response.vary.add('Origin')
+    if main.compression_enabled:
+        original_length = response.calculate_content_length()
+        compress(response, headers.get('Accept-Encoding'), main.compress_min_bytes, main.compress_level)
+        encoding = response.headers.get('Content-Encoding')
+        if main.metrics_enabled and encoding and original_length is not None:
+            main.compressed_bytes.inc(encoding, 'in', amount=original_length)
+            main.compressed_bytes.inc(encoding, 'out', amount=response.calculate_content_length())
+
+    await send({
+        'type': 'http.response.start',
+        'status': response.status_code,
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in response.headers.items()],
+    })
+    await send({'type': 'http.response.body', 'body': b'' if scope['method'] == 'HEAD' else response.get_data()})
+    if main.metrics_enabled:
+        main.request_seconds.observe(time.perf_counter() - started, scope['path'], scope['method'],
+                                     str(response.status_code))
+
+
+class AsyncApp:
+    def __init__(self, wsgi_application, threads=32):
+        self.wsgi = WSGIMiddleware(wsgi_application, workers=threads)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        route = NATIVE_ROUTES.get(scope['path']) if scope['type'] == 'http' else None
+        if route is None or scope['method'] not in ('GET', 'HEAD'):
+            await self.wsgi(scope, receive, send)
+            return
+        await serve_native(scope, send, *route)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await asyncio.to_thread(main.warm_up)
+                    await async_pool.prefill()
+                except Exception as e:
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await async_pool.close_all()
+                await asyncio.to_thread(main.shut_down)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+def collect_async_pool_stats():
+    samples = []
+    for name, value in async_pool.stats().items():
+        kind = 'gauge' if name in ('pool_size', 'max_overflow', 'open', 'idle', 'checked_out', 'overflow') else 'counter'
+        metric = f'db_async_pool_{name}' if kind == 'gauge' else f'db_async_pool_{name}_total'
+        samples.append((metric, kind, f'asyncio connection pool {name}', [({}, value)]))
+    return samples
+
+main.metrics_registry.collector(collect_async_pool_stats)
+
+asgi_app = AsyncApp(main.app, threads=int(os.getenv('ASGI_THREADS', 32)))
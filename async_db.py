@@ -0,0 +1,174 @@
+'''
+asyncio counterpart of db_pool.ConnectionPool, for the routes asgi.py answers on the
+event loop instead of a worker thread.
+
+Connections come from mysql.connector.aio and are opened with autocommit, so every
+read sees the latest committed data. At most pool_size + max_overflow are open; a
+coroutine that finds none free waits up to pool_timeout and then gets db_pool's
+PoolTimeout, which routes answer with 503 like the threaded pool's.
+
+A read that fails with a connection error (server restarted, failover) closes the
+idle connections as well, which were opened against the same server, and runs once
+more on a fresh one. fetch_many() runs independent queries side by side, each on its
+own connection.
+'''
+import asyncio
+import time
+
+import mysql.connector
+
+from db_pool import PoolTimeout
+
+CONNECTION_ERRORS = (mysql.connector.InterfaceError, mysql.connector.OperationalError)
+
+
+class AsyncConnectionPool:
+    def __init__(self, factory, pool_size=5, max_overflow=10, pool_timeout=10):
+        self.factory = factory  # coroutine function returning an open connection
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.pool_timeout = pool_timeout
+
+        self._idle = []  # most recently returned last
+        self._open = 0
+        self._checked_out = 0
+        self._available = asyncio.Condition()
+
+        self._stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time': 0.0,
+            'timeouts': 0,
+            'created': 0,
+            'closed': 0,
+            'retries': 0,
+        }
+
+    async def _close(self, conn):
+        try:
+            await conn.close()
+        except Exception:
+            pass
+
+    async def acquire(self):
+        started = time.monotonic()
+        waited = False
+        async with self._available:
+            while not self._idle and self._open >= self.pool_size + self.max_overflow:
+                if not waited:
+                    waited = True
+                    self._stats['waits'] += 1
+                remaining = started + self.pool_timeout - time.monotonic()
+                try:
+                    await asyncio.wait_for(self._available.wait(), max(remaining, 0))
+                except asyncio.TimeoutError:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeout(f'Timed out after {self.pool_timeout}s waiting for a database connection')
+            conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                self._open += 1
+            self._checked_out += 1
+
+        if conn is None:
+            try:
+                conn = await self.factory()
+            except BaseException:
+                async with self._available:
+                    self._open -= 1
+                    self._checked_out -= 1
+                    self._available.notify()
+                raise
+            self._stats['created'] += 1
+
+        self._stats['checkouts'] += 1
+        if waited:
+            self._stats['wait_time'] += time.monotonic() - started
+        return conn
+
+    async def release(self, conn):
+        async with self._available:
+            self._checked_out -= 1
+            if len(self._idle) < self.pool_size:
+                self._idle.append(conn)
+                self._available.notify()
+                return
+            self._open -= 1
+            self._stats['closed'] += 1
+            self._available.notify()
+        await self._close(conn)
+
+    async def _discard(self, conn):
+        # Drop a connection that is broken or in an unknown state
+        async with self._available:
+            self._checked_out -= 1
+            self._open -= 1
+            self._stats['closed'] += 1
+            self._available.notify()
+        await self._close(conn)
+
+    async def close_all(self):
+        async with self._available:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+            self._stats['closed'] += len(idle)
+            self._available.notify(len(idle))
+        for conn in idle:
+            await self._close(conn)
+
+    async def _fetch(self, conn, query, params):
+        cursor = await conn.cursor()
+        try:
+            await cursor.execute(query, params)
+            return await cursor.fetchall()
+        finally:
+            await cursor.close()
+
+    async def fetch_all(self, query, params=()):
+        for attempt in (1, 2):
+            conn = await self.acquire()
+            try:
+                rows = await self._fetch(conn, query, params)
+            except CONNECTION_ERRORS:
+                await self._discard(conn)
+                if attempt == 2:
+                    raise
+                self._stats['retries'] += 1
+                await self.close_all()
+                continue
+            except mysql.connector.Error:
+                await self.release(conn)
+                raise
+            except BaseException:
+                # Cancelled mid-query: the connection may still have a result pending
+                await self._discard(conn)
+                raise
+            await self.release(conn)
+            return rows
+
+    async def fetch_many(self, *queries):
+        # [(query, params)] -> [rows] in the same order, run concurrently
+        return await asyncio.gather(*(self.fetch_all(query, params) for query, params in queries))
+
+    async def prefill(self, count=None):
+        count = self.pool_size if count is None else min(count, self.pool_size + self.max_overflow)
+        conns = []
+        try:
+            for _ in range(count):
+                conns.append(await self.acquire())
+        finally:
+            for conn in conns:
+                await self.release(conn)
+        return len(conns)
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats.update({
+            'pool_size': self.pool_size,
+            'max_overflow': self.max_overflow,
+            'open': self._open,
+            'idle': len(self._idle),
+            'checked_out': self._checked_out,
+            'overflow': max(self._open - self.pool_size, 0),
+        })
+        stats['wait_time'] = round(stats['wait_time'], 6)
+        return stats
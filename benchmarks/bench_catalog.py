@@ -0,0 +1,94 @@
+'''
+Load time and memory of the catalog snapshot (catalog.py) on synthetic catalogs of
+growing size.
+
+    python benchmarks/bench_catalog.py [--sizes 1000,10000,100000] [--repeat 5]
+
+No database is needed: films, actors, categories and their links are generated in
+memory with sakila's shape (~5 actors and 1 category per film). For every size the
+table shows the time to build a snapshot from rows, the snapshot file size, the best of
+--repeat loads from the file (mmap + string table decode), and the memory per 10k films:
+array bytes (mapped, shared between workers) plus string objects, next to the rows kept
+as MySQL tuples for comparison.
+'''
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_search import CATEGORIES, WORDS  # noqa: E402
+from catalog import Snapshot  # noqa: E402
+
+RATINGS = ['G', 'PG', 'PG-13', 'R', 'NC-17']
+FEATURES = ['Trailers', 'Commentaries', 'Deleted Scenes', 'Behind the Scenes']
+
+
+def synthetic_rows(film_count, seed=0):
+    rng = random.Random(seed)
+    actor_count = max(200, film_count // 5)
+    actors = [(actor_id, rng.choice(WORDS).upper(), rng.choice(WORDS).upper()) for actor_id in range(1, actor_count + 1)]
+    categories = list(enumerate(CATEGORIES, 1))
+    languages = [(1, 'English'), (2, 'Italian'), (3, 'Japanese')]
+    films, film_actors, film_categories = [], [], []
+    updated = datetime(2006, 2, 15, 5, 3, 42)
+    for film_id in range(1, film_count + 1):
+        films.append((film_id, ' '.join(rng.choice(WORDS) for _ in range(2)).upper(),
+                      'A ' + ' '.join(rng.choice(WORDS) for _ in range(12)), 2006, 1, None,
+                      rng.randint(3, 7), Decimal(rng.choice(('0.99', '2.99', '4.99'))), rng.randint(46, 185),
+                      Decimal(rng.randint(999, 2999)) / 100, rng.choice(RATINGS),
+                      set(rng.sample(FEATURES, rng.randint(1, 3))), updated))
+        for actor_id in sorted(rng.sample(range(1, actor_count + 1), 5)):
+            film_actors.append((film_id, actor_id))
+        film_categories.append((film_id, rng.randrange(1, len(CATEGORIES) + 1)))
+    return films, actors, categories, languages, film_actors, film_categories
+
+
+def rows_with_size(film_count):
+    # The rows and the bytes allocated to hold them as fetched (tuples of str, Decimal, set, datetime)
+    tracemalloc.start()
+    rows = synthetic_rows(film_count)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return rows, size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='1000,10000,100000')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'films':>8} {'build s':>8} {'file KiB':>9} {'load ms':>8} "
+          f"{'arrays KiB/10k':>15} {'strings KiB/10k':>16} {'tuples KiB/10k':>15}")
+    with tempfile.TemporaryDirectory() as directory:
+        for size in (int(value) for value in args.sizes.split(',')):
+            rows, rows_bytes = rows_with_size(size)
+            started = time.perf_counter()
+            snapshot = Snapshot.from_rows(('synthetic',), *rows)
+            build_seconds = time.perf_counter() - started
+
+            path = os.path.join(directory, f'catalog-{size}.bin')
+            snapshot.save(path)
+            loads = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                loaded = Snapshot.load(path)
+                loads.append(time.perf_counter() - started)
+            assert loaded.film_details(range(1, 11)) == snapshot.film_details(range(1, 11))
+
+            memory = loaded.memory()
+            per_10k = 10000 / size / 1024
+            print(f'{size:>8} {build_seconds:>8.2f} {os.path.getsize(path) / 1024:>9.0f} {min(loads) * 1000:>8.1f} '
+                  f'{memory["array_bytes"] * per_10k:>15.0f} {memory["string_bytes"] * per_10k:>16.0f} '
+                  f'{rows_bytes * per_10k:>15.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+'''
+Peak memory and time of the /api/allcustomers serialization strategies on synthetic rows.
+
+    python benchmarks/bench_customers.py [--rows 2000000]
+
+"list" reproduces the old path (build every dict, then serialize the whole list);
+"stream" and "ndjson" reproduce stream_customers, consuming one chunk at a time the
+way the WSGI server writes them to the socket. Rows come from a generator standing in
+for the unbuffered server-side cursor, so the database is not needed. Timings include
+tracemalloc overhead and are only meaningful relative to each other.
+'''
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+
+def customer_rows(count):
+    created = datetime(2006, 2, 14, 22, 4, 36)
+    for customer_id in range(1, count + 1):
+        yield (customer_id, customer_id % 2 + 1, f'FIRST{customer_id}', f'LAST{customer_id}',
+               f'first{customer_id}.last{customer_id}@sakilacustomer.org', customer_id % 600 + 1, 1,
+               created, created + timedelta(seconds=customer_id))
+
+
+def customer_to_dict(row):
+    return {
+        'customer_id': row[0],
+        'store_id': row[1],
+        'first_name': row[2],
+        'last_name': row[3],
+        'email': row[4],
+        'address': row[5],
+        'active': row[6] == 1,
+        'create_date': row[7],
+        'last_update': row[8]
+    }
+
+
+def dumps(value):
+    return json.dumps(value, default=str)
+
+
+def as_list(rows):
+    yield dumps([customer_to_dict(row) for row in rows])
+
+
+def as_stream(rows):
+    yield '['
+    first = True
+    for row in rows:
+        yield ('' if first else ',') + dumps(customer_to_dict(row))
+        first = False
+    yield ']'
+
+
+def as_ndjson(rows):
+    for row in rows:
+        yield dumps(customer_to_dict(row)) + '\n'
+
+
+def measure(name, strategy, count):
+    tracemalloc.start()
+    started = time.perf_counter()
+    first_byte = None
+    total_bytes = 0
+    for chunk in strategy(customer_rows(count)):
+        if first_byte is None:
+            first_byte = time.perf_counter() - started
+        total_bytes += len(chunk)
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f'{name:>8} {elapsed:>9.2f} {first_byte * 1000:>12.3f} {peak / 2 ** 20:>10.1f} {total_bytes / 2 ** 20:>9.1f}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=2_000_000)
+    parser.add_argument('--skip-list', action='store_true', help='skip the full-list path on very large runs')
+    args = parser.parse_args()
+
+    print(f'{args.rows} synthetic customers')
+    print(f"{'mode':>8} {'total s':>9} {'first byte ms':>12} {'peak MiB':>10} {'body MiB':>9}")
+    if not args.skip_list:
+        measure('list', as_list, args.rows)
+    measure('stream', as_stream, args.rows)
+    measure('ndjson', as_ndjson, args.rows)
+    sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
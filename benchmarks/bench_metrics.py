@@ -0,0 +1,70 @@
+'''
+Per-statement overhead of the SQL instrumentation.
+
+    python benchmarks/bench_metrics.py [--statements 200000]
+
+Runs execute + fetchall against a zero-latency stand-in cursor, bare and wrapped in
+InstrumentedCursor (with and without a slow-query threshold that never fires), and
+reports the added cost per statement. Database round trips are typically hundreds of
+microseconds or more, so this is the upper bound of what instrumentation adds.
+'''
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics import InstrumentedCursor, Registry, SqlMetrics  # noqa: E402
+
+QUERIES = [
+    """select customer_id, store_id, first_name, last_name, email, address_id, active, create_date, last_update
+       from sakila.customer where customer_id > %s order by customer_id limit %s;""",
+    """select f.film_id, f.title from sakila.film f where f.film_id in (%s, %s, %s);""",
+    """update sakila.rental set return_date = %s where rental_id = %s and return_date is null;""",
+]
+ROWS = [(1, 'ACADEMY DINOSAUR')] * 20
+
+
+class StandInCursor:
+    rowcount = len(ROWS)
+
+    def execute(self, query, params=()):
+        pass
+
+    def fetchall(self):
+        return ROWS
+
+    def close(self):
+        pass
+
+
+def run(make_cursor, statements):
+    cursor = make_cursor()
+    started = time.perf_counter()
+    for i in range(statements):
+        cursor.execute(QUERIES[i % len(QUERIES)], (i, 10))
+        cursor.fetchall()
+    cursor.close()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--statements', type=int, default=200_000)
+    args = parser.parse_args()
+
+    plain = SqlMetrics(Registry())
+    with_slow_log = SqlMetrics(Registry(), slow_query_seconds=60)
+
+    baseline = run(StandInCursor, args.statements)
+    print(f"{'mode':>22} {'total s':>8} {'us/stmt':>8} {'overhead us':>12}")
+    print(f"{'bare cursor':>22} {baseline:>8.3f} {baseline / args.statements * 1e6:>8.2f} {0:>12.2f}")
+    for name, sql_metrics in (('instrumented', plain), ('instrumented + slowlog', with_slow_log)):
+        seconds = run(lambda: InstrumentedCursor(StandInCursor(), sql_metrics), args.statements)
+        print(f'{name:>22} {seconds:>8.3f} {seconds / args.statements * 1e6:>8.2f} '
+              f'{(seconds - baseline) / args.statements * 1e6:>12.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+'''
+Rentals per second through /api/rentfilm (one item per request) versus /api/rentfilms
+(batches), against a running server and its sakila database.
+
+    python main.py &
+    python benchmarks/bench_rentals.py --rentals 500 --batch-size 50 --threads 4
+
+Every rental uses the marker rental_date below. Afterwards the script returns all
+of them with /api/returnfilms, so copies are free again for the next run. The extra
+rental rows stay in sakila.rental and count towards film_stats.rental_count, just as
+real rentals would.
+'''
+import argparse
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MARKER_DATE = '2099-01-01 00:00:00'
+
+
+def pick_items(count, seed=0):
+    from main import fetch_all
+
+    rng = random.Random(seed)
+    films = [row[0] for row in fetch_all("""select film_id from sakila.film_stats
+                                            where total_copies - checked_out > 0;""")]
+    customers = [row[0] for row in fetch_all("""select customer_id from sakila.customer where active = 1;""")]
+    return [{'rental_date': MARKER_DATE, 'film_id': rng.choice(films), 'customer_id': rng.choice(customers)}
+            for _ in range(count)]
+
+
+def open_marker_rentals():
+    from main import fetch_all
+
+    return fetch_all("""select rental_id, customer_id from sakila.rental
+                        where rental_date = %s and return_date is null;""", (MARKER_DATE,))
+
+
+def return_all(base_url):
+    rentals = open_marker_rentals()
+    for start in range(0, len(rentals), 200):
+        chunk = rentals[start:start + 200]
+        requests.put(f'{base_url}/api/returnfilms',
+                     json={'returns': [{'rental_id': rental_id, 'customer_id': customer_id}
+                                       for rental_id, customer_id in chunk]}).raise_for_status()
+
+
+def run_single(base_url, items, threads):
+    session = requests.Session()
+
+    def rent(item):
+        return session.put(f'{base_url}/api/rentfilm', json=item).status_code == 200
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        ok = sum(executor.map(rent, items))
+    return ok, time.perf_counter() - started
+
+
+def run_batched(base_url, items, threads, batch_size):
+    session = requests.Session()
+    batches = [items[start:start + batch_size] for start in range(0, len(items), batch_size)]
+
+    def rent(batch):
+        response = session.put(f'{base_url}/api/rentfilms', json={'rentals': batch})
+        return response.json().get('rented', 0) if response.status_code == 200 else 0
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        ok = sum(executor.map(rent, batches))
+    return ok, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000')
+    parser.add_argument('--rentals', type=int, default=500)
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--threads', type=int, default=4)
+    args = parser.parse_args()
+
+    items = pick_items(args.rentals)
+    print(f"{'mode':>10} {'rented':>7} {'seconds':>8} {'rentals/s':>10}")
+
+    return_all(args.base_url)
+    ok, seconds = run_single(args.base_url, items, args.threads)
+    print(f"{'single':>10} {ok:>7} {seconds:>8.2f} {ok / seconds:>10.1f}")
+
+    return_all(args.base_url)
+    ok, seconds = run_batched(args.base_url, items, args.threads, args.batch_size)
+    print(f"{'batch ' + str(args.batch_size):>10} {ok:>7} {seconds:>8.2f} {ok / seconds:>10.1f}")
+
+    return_all(args.base_url)
+
+
+if __name__ == '__main__':
+    main()
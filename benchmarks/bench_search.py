@@ -0,0 +1,86 @@
+'''
+Search latency of FilmSearchIndex on synthetic catalogs of growing size.
+
+    python benchmarks/bench_search.py [--sizes 1000,10000,100000] [--queries 300]
+
+No database is needed: films, actors and categories are generated in memory with a
+vocabulary shaped like sakila's (two-word titles, ~5 actors and 1 category per film).
+'''
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from film_search import FilmSearchIndex  # noqa: E402
+
+WORDS = [''.join(random.Random(i).choices('abcdefghijklmnopqrstuvwxyz', k=random.Random(-i).randint(4, 9)))
+         for i in range(5000)]
+CATEGORIES = ['Action', 'Animation', 'Children', 'Classics', 'Comedy', 'Documentary', 'Drama', 'Family',
+              'Foreign', 'Games', 'Horror', 'Music', 'New', 'Sci-Fi', 'Sports', 'Travel']
+
+
+def synthetic_catalog(film_count, seed=0):
+    rng = random.Random(seed)
+    actor_names = [(rng.choice(WORDS).title(), rng.choice(WORDS).title()) for _ in range(max(200, film_count // 5))]
+    films, actors, categories = [], [], []
+    for film_id in range(1, film_count + 1):
+        title = ' '.join(rng.choice(WORDS) for _ in range(2)).upper()
+        description = 'A ' + ' '.join(rng.choice(WORDS) for _ in range(12))
+        films.append((film_id, title, description))
+        for first_name, last_name in rng.sample(actor_names, 5):
+            actors.append((film_id, first_name, last_name))
+        categories.append((film_id, rng.choice(CATEGORIES)))
+    return films, actors, categories
+
+
+def queries(count, seed=1):
+    rng = random.Random(seed)
+    result = []
+    for _ in range(count):
+        word = rng.choice(WORDS)
+        kind = rng.random()
+        if kind < 0.4:
+            result.append(word)
+        elif kind < 0.7:
+            result.append(word[:3])
+        elif kind < 0.9:
+            position = rng.randrange(len(word))
+            result.append(word[:position] + 'x' + word[position + 1:])
+        else:
+            result.append(rng.choice(CATEGORIES) + ' ' + word[:4])
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='1000,10000,100000')
+    parser.add_argument('--queries', type=int, default=300)
+    args = parser.parse_args()
+
+    workload = queries(args.queries)
+    print(f"{'films':>8} {'build s':>8} {'tokens':>8} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}")
+    for size in (int(value) for value in args.sizes.split(',')):
+        films, actors, categories = synthetic_catalog(size)
+        index = FilmSearchIndex(catalog=None)
+
+        started = time.perf_counter()
+        index.load(films, actors, categories)
+        build_seconds = time.perf_counter() - started
+
+        timings = []
+        for text in workload:
+            started = time.perf_counter()
+            index.search(text, limit=100)
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        p95 = timings[int(len(timings) * 0.95) - 1]
+        print(f'{size:>8} {build_seconds:>8.2f} {index.stats()["tokens"]:>8} '
+              f'{statistics.median(timings):>8.3f} {p95:>8.3f} {timings[-1]:>8.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+'''
+Row-to-JSON cost of the old path (tuple -> dict -> jsonify) versus RowSpec encoding,
+for customer and film-details shaped rows. Also checks both produce the same JSON.
+
+    python benchmarks/bench_serializers.py [--rows 1000] [--repeat 50]
+'''
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import CUSTOMER, FILM_DETAILS, app, customer_to_dict  # noqa: E402
+
+CUSTOMER_ROW = (1, 1, 'MARY', 'SMITH', 'MARY.SMITH@sakilacustomer.org', 5, 1,
+                datetime(2006, 2, 14, 22, 4, 36), datetime(2006, 2, 15, 4, 57, 20))
+FILM_ROW = (1, 'ACADEMY DINOSAUR', 'A Epic Drama of a Feminist And a Mad Scientist who must Battle a Teacher in The '
+            'Canadian Rockies', 2006, 1, None, 6, Decimal('0.99'), 86, Decimal('20.99'), 'PG',
+            {'Deleted Scenes', 'Behind the Scenes'}, datetime(2006, 2, 15, 5, 3, 42), 'English')
+
+
+def old_film_dict(row):
+    return {
+        'film_id': row[0], 'title': row[1], 'description': row[2], 'release_year': row[3],
+        'language_id': row[4], 'original_language_id': row[5], 'rental_duration': row[6],
+        'rental_rate': row[7], 'length': row[8], 'replacement_cost': row[9], 'rating': row[10],
+        'special_features': sorted(list(row[11])) if isinstance(row[11], set) else row[11],
+        'last_update': row[12], 'language': row[13]
+    }
+
+
+def timed(repeat, function):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        body = function()
+    return (time.perf_counter() - started) / repeat, body
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    cases = [
+        ('customers', CUSTOMER, [(n, *CUSTOMER_ROW[1:]) for n in range(args.rows)], customer_to_dict),
+        ('film details', FILM_DETAILS, [(n, *FILM_ROW[1:]) for n in range(args.rows)], old_film_dict),
+    ]
+    with app.app_context():
+        for name, spec, rows, old_to_dict in cases:
+            old_time, old_body = timed(args.repeat, lambda: app.json.dumps([old_to_dict(row) for row in rows],
+                                                                          separators=(',', ':')))
+            new_time, new_body = timed(args.repeat, lambda: spec.encode_rows(rows))
+            columnar_time, columnar_body = timed(args.repeat, lambda: spec.encode_rows(rows, columnar=True))
+            assert json.loads(old_body) == json.loads(new_body), name
+            assert old_body == new_body, name
+            print(f'{name:<14} {args.rows} rows: dict+jsonify {old_time * 1000:7.2f} ms ({len(old_body)} bytes)  '
+                  f'RowSpec {new_time * 1000:7.2f} ms ({old_time / new_time:.1f}x)  '
+                  f'columnar {columnar_time * 1000:7.2f} ms ({len(columnar_body)} bytes)')
+
+
+if __name__ == '__main__':
+    main()
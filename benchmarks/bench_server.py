@@ -0,0 +1,111 @@
+'''
+Throughput of the debug server (python main.py), the pre-forked server (python server.py)
+and the ASGI entry point under uvicorn (asgi.py) on the same real routes.
+
+    python benchmarks/bench_server.py --workers 4 --threads 8 --concurrency 32 --duration 20
+
+Each server is started in turn on its own port, polled until it answers, loaded with
+benchmarks/run.py's request generators for --duration seconds per phase and stopped
+again, so all of them see the same data set. The phases are the read-heavy mix and
+/api/get_customerdetails alone, the route asgi.py answers from its asyncio pool. The
+debug server runs as in main.py, minus the file-watching reloader; uvicorn runs
+--workers processes with --threads WSGI threads each. Needs the sakila database
+main.py connects to.
+'''
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import requests
+
+from run import DEFAULT_MIX, Fixtures, print_phase, run_phase
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#Read routes only, so repeated runs leave the database unchanged
+READ_MIX = {name: weight for name, weight in DEFAULT_MIX.items()
+            if name not in ('rentfilm', 'returnfilm', 'addcustomer', 'editcustomer')}
+PHASES = [('read mix', READ_MIX), ('customer details', {'customerdetails': 1})]
+
+
+def start(title, command, port, startup_timeout, env=None):
+    process = subprocess.Popen(command, cwd=ROOT, start_new_session=True, env={**os.environ, **(env or {})},
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + startup_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f'{title} exited with status {process.returncode} during startup')
+        try:
+            if requests.get(f'http://127.0.0.1:{port}/api/top5rented', timeout=2).status_code == 200:
+                return process
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    stop(process)
+    raise SystemExit(f'{title} did not answer within {startup_timeout}s')
+
+
+def stop(process):
+    # Stops the gunicorn master and its workers together
+    os.killpg(process.pid, signal.SIGTERM)
+    try:
+        process.wait(30)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--port', type=int, default=5100, help='the servers use this port and the next two')
+    parser.add_argument('--startup-timeout', type=float, default=120)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    fixtures = Fixtures()
+    debug_port, prefork_port, asgi_port = args.port, args.port + 1, args.port + 2
+    prefork_title = f'pre-forked {args.workers}x{args.threads}'
+    servers = [
+        ('debug server', debug_port,
+         [sys.executable, '-c', 'import main; main.warm_up(); '
+                                f'main.app.run(debug=True, port={debug_port}, use_reloader=False)'], {}),
+        (prefork_title, prefork_port,
+         [sys.executable, 'server.py', '--bind', f'127.0.0.1:{prefork_port}',
+          '--workers', str(args.workers), '--threads', str(args.threads), '--log-level', 'warning'], {}),
+        (f'uvicorn asgi {args.workers}x{args.threads}', asgi_port,
+         [sys.executable, '-m', 'uvicorn', 'asgi:asgi_app', '--port', str(asgi_port),
+          '--workers', str(args.workers), '--log-level', 'warning'], {'ASGI_THREADS': str(args.threads)}),
+    ]
+
+    totals = {}
+    for title, port, command, env in servers:
+        process = start(title, command, port, args.startup_timeout, env)
+        try:
+            for phase, mix in PHASES:
+                result = run_phase(f'http://127.0.0.1:{port}', mix, fixtures, args.concurrency, args.duration,
+                                   args.seed)
+                print_phase(f'{title}, {phase}', result)
+                totals[title, phase] = result['_total']
+        finally:
+            stop(process)
+
+    for phase, _ in PHASES:
+        baseline = totals[prefork_title, phase]
+        print(f'\n{phase}, against {prefork_title}: {baseline["throughput_rps"]} req/s, p95 {baseline["p95_ms"]} ms')
+        for title, _, _, _ in servers:
+            if title == prefork_title:
+                continue
+            total = totals[title, phase]
+            ratio = total['throughput_rps'] / baseline['throughput_rps'] if baseline['throughput_rps'] else float('inf')
+            print(f'  {title}: {total["throughput_rps"]} req/s ({ratio:.2f}x), p95 {total["p95_ms"]} ms')
+
+
+if __name__ == '__main__':
+    main()
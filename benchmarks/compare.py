@@ -0,0 +1,72 @@
+'''
+Compare two benchmarks/run.py reports and flag regressions.
+
+    python benchmarks/compare.py runs/baseline.json runs/today.json --threshold 10
+
+A route regresses when its p95 latency grows, its throughput drops, or it issues more
+DB queries per request than in the baseline by more than --threshold percent.
+Exits with status 1 when anything regressed, so it can gate a CI job.
+'''
+import argparse
+import json
+import sys
+
+#metric -> True when a higher value is worse
+CHECKS = {
+    'p95_ms': True,
+    'p99_ms': True,
+    'throughput_rps': False,
+    'db_queries_per_request': True,
+}
+
+
+def rows(report):
+    result = {name: row for name, row in report.get('routes', {}).items()}
+    for name, row in (report.get('mixed') or {}).items():
+        result[f'mixed:{name}'] = row
+    return result
+
+
+def compare(baseline, current, threshold):
+    regressions = []
+    lines = []
+    base_rows, current_rows = rows(baseline), rows(current)
+    for name in sorted(set(base_rows) & set(current_rows)):
+        for metric, higher_is_worse in CHECKS.items():
+            old, new = base_rows[name].get(metric), current_rows[name].get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * 100
+            worse = change > threshold if higher_is_worse else change < -threshold
+            # p99 of a short run is noisy; report it but only gate on the other metrics
+            flag = 'REGRESSION' if worse and metric != 'p99_ms' else ('worse' if worse else '')
+            lines.append(f'{name:<24}{metric:<24}{old:>12}{new:>12}{change:>+9.1f}%  {flag}')
+            if flag == 'REGRESSION':
+                regressions.append((name, metric, old, new))
+    return lines, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--threshold', type=float, default=10.0, help='allowed change in percent')
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+
+    if baseline.get('dataset') != current.get('dataset') or baseline.get('concurrency') != current.get('concurrency'):
+        print('warning: runs used different datasets or concurrency, numbers may not be comparable')
+
+    lines, regressions = compare(baseline, current, args.threshold)
+    print(f'{"route":<24}{"metric":<24}{"baseline":>12}{"current":>12}{"change":>10}')
+    print('\n'.join(lines))
+    print(f'\n{len(regressions)} regression(s) above {args.threshold}%')
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+'''
+Load test for every API route against a running server, with a JSON report that
+benchmarks/compare.py can diff against an earlier run.
+
+    python benchmarks/seed.py --films 10000 --customers 50000   # optional, scales sakila up
+    python main.py &
+    python benchmarks/run.py --concurrency 8 --duration 20 --output runs/today.json
+    python benchmarks/run.py --routes searchfilms,filmdetails --mix searchfilms=3,filmdetails=1
+
+Each selected route first runs alone for --duration seconds, then all of them run
+together, picked at random with the weights from --mix. For every phase the report has
+p50/p95/p99 latency, throughput, error count and the average number of SQL statements
+per request; the latter is read from the server's /metrics endpoint
+(http_request_sql_statements), so it needs METRICS_ENABLED=1 on the server.
+
+Rentals use the marker rental_date of bench_rentals.py and are returned again at the
+end; customers added by the addcustomer route get an @bench.invalid email and are
+deleted again. The batch routes (/api/rentfilms, /api/returnfilms) are measured by
+bench_rentals.py.
+'''
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_rentals import MARKER_DATE, open_marker_rentals, return_all  # noqa: E402
+
+SEARCH_TERMS = ['academy', 'ace goldfinger', 'alien', 'dinosaur', 'drama', 'bear', 'chamber', 'agnt', 'epic', 'beach']
+NAME_TERMS = ['mary', 'smith', 'patricia jo', 'linda', 'will', 'brown', 'tay']
+
+DEFAULT_MIX = {
+    'top5rented': 10, 'top5actors': 5, 'actordetails': 5, 'searchfilms': 20, 'filmdetails': 20,
+    'allcustomers': 5, 'searchcustomers': 10, 'customerdetails': 10, 'rentfilm': 5, 'returnfilm': 5,
+    'addcustomer': 2, 'editcustomer': 3,
+}
+
+_STATEMENTS_RE = re.compile(r'^http_request_sql_statements_(sum|count)\{route="([^"]*)"\} (\S+)$', re.MULTILINE)
+
+
+class Fixtures:
+    # Ids the request generators pick from, loaded once from the database
+    def __init__(self):
+        from main import fetch_all
+
+        self.film_ids = [row[0] for row in fetch_all("""select film_id from sakila.film;""")]
+        self.rentable_film_ids = [row[0] for row in fetch_all("""select film_id from sakila.film_stats
+                                                                 where total_copies - checked_out > 0;""")]
+        self.actor_ids = [row[0] for row in fetch_all("""select actor_id from sakila.actor;""")]
+        self.customer_ids = [row[0] for row in fetch_all("""select customer_id from sakila.customer where active = 1;""")]
+        self.address_ids = [row[0] for row in fetch_all("""select address_id from sakila.address limit 100;""")]
+        self.open_rentals = deque()
+        self.added_customers = deque()
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def refill_open_rentals(self):
+        self.open_rentals.extend(open_marker_rentals())
+
+    def next_number(self):
+        with self._lock:
+            self._counter += 1
+            return self._counter
+
+
+def _rent(session, base_url, rng, fixtures):
+    return session.put(f'{base_url}/api/rentfilm', json={
+        'rental_date': MARKER_DATE,
+        'film_id': rng.choice(fixtures.rentable_film_ids),
+        'customer_id': rng.choice(fixtures.customer_ids)})
+
+
+def _return(session, base_url, rng, fixtures):
+    try:
+        rental_id, customer_id = fixtures.open_rentals.popleft()
+    except IndexError:
+        return None  # nothing left to return in this phase
+    return session.put(f'{base_url}/api/returnfilm',
+                       json={'rental_id': str(rental_id), 'customer_id': customer_id})
+
+
+def _add_customer(session, base_url, rng, fixtures):
+    number = fixtures.next_number()
+    response = session.post(f'{base_url}/api/addcustomer', json={
+        'first_name': 'BENCH', 'last_name': f'LOAD{number}', 'email': f'load{number}.{os.getpid()}@bench.invalid',
+        'address_id': rng.choice(fixtures.address_ids)})
+    if response.status_code == 201:
+        fixtures.added_customers.append(response.json()['customer_id'])
+    return response
+
+
+def _edit_customer(session, base_url, rng, fixtures):
+    if not fixtures.added_customers:
+        return _add_customer(session, base_url, rng, fixtures)
+    customer_id = fixtures.added_customers[rng.randrange(len(fixtures.added_customers))]
+    return session.put(f'{base_url}/api/editcustomer',
+                       json={'customer_id': customer_id, 'last_name': f'EDIT{fixtures.next_number()}'})
+
+
+#name -> (route rule as reported in /metrics, request function)
+ROUTES = {
+    'top5rented': ('/api/top5rented', lambda s, u, rng, f: s.get(f'{u}/api/top5rented')),
+    'top5actors': ('/api/top5actors', lambda s, u, rng, f: s.get(f'{u}/api/top5actors')),
+    'actordetails': ('/api/get_actordetails', lambda s, u, rng, f: s.get(
+        f'{u}/api/get_actordetails', params={'actor_id': rng.choice(f.actor_ids)})),
+    'searchfilms': ('/api/searchfilms', lambda s, u, rng, f: s.get(
+        f'{u}/api/searchfilms', params={'search': rng.choice(SEARCH_TERMS), 'limit': 20})),
+    'filmdetails': ('/api/get_filmdetails', lambda s, u, rng, f: s.get(
+        f'{u}/api/get_filmdetails', params={'film_id': rng.choice(f.film_ids)})),
+    'allcustomers': ('/api/allcustomers', lambda s, u, rng, f: s.get(
+        f'{u}/api/allcustomers', params={'limit': 50, 'after_customer_id': rng.choice(f.customer_ids)})),
+    'searchcustomers': ('/api/searchcustomers', lambda s, u, rng, f: s.get(
+        f'{u}/api/searchcustomers', params={'search': rng.choice(NAME_TERMS), 'limit': 20})),
+    'customerdetails': ('/api/get_customerdetails', lambda s, u, rng, f: s.get(
+        f'{u}/api/get_customerdetails', params={'customer_id': rng.choice(f.customer_ids)})),
+    'analyticsrentals': ('/api/analytics/rentals', lambda s, u, rng, f: s.get(
+        f'{u}/api/analytics/rentals', params={'bucket': rng.choice(['day', 'week', 'month']),
+                                              'by': rng.choice(['total', 'store', 'category'])})),
+    'analyticstop': ('/api/analytics/top', lambda s, u, rng, f: s.get(
+        f'{u}/api/analytics/top', params={'by': rng.choice(['film', 'category', 'store']), 'n': 10})),
+    'rentfilm': ('/api/rentfilm', _rent),
+    'returnfilm': ('/api/returnfilm', _return),
+    'addcustomer': ('/api/addcustomer', _add_customer),
+    'editcustomer': ('/api/editcustomer', _edit_customer),
+}
+
+
+def parse_mix(text):
+    mix = {}
+    for part in filter(None, (part.strip() for part in text.split(','))):
+        name, _, weight = part.partition('=')
+        if name not in ROUTES:
+            raise SystemExit(f'unknown route {name!r}; choose from {", ".join(ROUTES)}')
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def scrape_statements(base_url):
+    # route -> [statement sum, request count] from the server's histogram
+    totals = {}
+    try:
+        text = requests.get(f'{base_url}/metrics', timeout=10).text
+    except requests.RequestException:
+        return totals
+    for field, route, value in _STATEMENTS_RE.findall(text):
+        totals.setdefault(route, [0.0, 0.0])[0 if field == 'sum' else 1] = float(value)
+    return totals
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(int(round(fraction * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def run_phase(base_url, mix, fixtures, concurrency, duration, seed):
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    latencies = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    deadline = time.perf_counter() + duration
+    lock = threading.Lock()
+
+    def worker(number):
+        rng = random.Random(seed * 1000 + number)
+        session = requests.Session()
+        local = {name: [] for name in names}
+        local_errors = {name: 0 for name in names}
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, weights)[0]
+            started = time.perf_counter()
+            try:
+                response = ROUTES[name][1](session, base_url, rng, fixtures)
+                if response is None:
+                    continue
+                ok = response.status_code < 400
+            except requests.RequestException:
+                ok = False
+            local[name].append(time.perf_counter() - started)
+            if not ok:
+                local_errors[name] += 1
+        with lock:
+            for name in names:
+                latencies[name].extend(local[name])
+                errors[name] += local_errors[name]
+
+    before = scrape_statements(base_url)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    elapsed = time.perf_counter() - started
+    after = scrape_statements(base_url)
+
+    def summarize(samples, error_count, rules):
+        samples = sorted(samples)
+        statements = sum(after.get(rule, [0, 0])[0] - before.get(rule, [0, 0])[0] for rule in rules)
+        counted = sum(after.get(rule, [0, 0])[1] - before.get(rule, [0, 0])[1] for rule in rules)
+        return {
+            'requests': len(samples),
+            'errors': error_count,
+            'throughput_rps': round(len(samples) / elapsed, 2) if elapsed else 0.0,
+            'p50_ms': round(percentile(samples, 0.50) * 1000, 3) if samples else None,
+            'p95_ms': round(percentile(samples, 0.95) * 1000, 3) if samples else None,
+            'p99_ms': round(percentile(samples, 0.99) * 1000, 3) if samples else None,
+            'db_queries_per_request': round(statements / counted, 2) if counted else None,
+        }
+
+    result = {name: summarize(latencies[name], errors[name], [ROUTES[name][0]]) for name in names}
+    result['_total'] = summarize([value for name in names for value in latencies[name]],
+                                 sum(errors.values()), sorted({ROUTES[name][0] for name in names}))
+    return result
+
+
+def cleanup(base_url, fixtures):
+    return_all(base_url)
+    while fixtures.added_customers:
+        requests.put(f'{base_url}/api/deletecustomer', params={'customer_id': fixtures.added_customers.popleft()})
+
+
+def print_phase(title, result):
+    print(f'\n{title}')
+    print(f'  {"route":<16}{"req":>8}{"err":>6}{"rps":>10}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"q/req":>8}')
+    for name, row in result.items():
+        cells = [row['p50_ms'], row['p95_ms'], row['p99_ms'], row['db_queries_per_request']]
+        cells = ['-' if value is None else value for value in cells]
+        print(f'  {name:<16}{row["requests"]:>8}{row["errors"]:>6}{row["throughput_rps"]:>10}'
+              f'{cells[0]:>10}{cells[1]:>10}{cells[2]:>10}{cells[3]:>8}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10, help='seconds per phase')
+    parser.add_argument('--routes', default=','.join(ROUTES), help='routes to run on their own, comma separated')
+    parser.add_argument('--mix', default=','.join(f'{name}={weight}' for name, weight in DEFAULT_MIX.items()),
+                        help='weights for the mixed phase, e.g. searchfilms=5,filmdetails=2')
+    parser.add_argument('--no-mixed', action='store_true', help='skip the mixed phase')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the report as JSON to this file')
+    args = parser.parse_args()
+
+    fixtures = Fixtures()
+    report = {
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'base_url': args.base_url,
+        'concurrency': args.concurrency,
+        'duration': args.duration,
+        'dataset': {'films': len(fixtures.film_ids), 'customers': len(fixtures.customer_ids)},
+        'routes': {},
+        'mixed': None,
+    }
+
+    try:
+        for name in parse_mix(args.routes):
+            if name == 'returnfilm':
+                fixtures.refill_open_rentals()
+            result = run_phase(args.base_url, {name: 1}, fixtures, args.concurrency, args.duration, args.seed)
+            report['routes'][name] = result[name]
+            print_phase(name, {name: result[name]})
+
+        if not args.no_mixed:
+            cleanup(args.base_url, fixtures)
+            fixtures.refill_open_rentals()
+            mix = parse_mix(args.mix)
+            report['mix'] = mix
+            report['mixed'] = run_phase(args.base_url, mix, fixtures, args.concurrency, args.duration, args.seed)
+            print_phase('mixed', report['mixed'])
+    finally:
+        cleanup(args.base_url, fixtures)
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'\nreport written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
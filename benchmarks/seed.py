@@ -0,0 +1,146 @@
+'''
+Seed a local sakila database with a scaled-up synthetic catalog for benchmarking.
+
+    python benchmarks/seed.py --films 10000 --copies 4 --customers 50000 --rentals 500000
+    python benchmarks/seed.py --reset
+
+Synthetic rows are added next to the stock sakila data and are recognisable by their
+markers: film titles start with "BENCH ", customer emails end in "@bench.invalid".
+--reset removes them again (rentals and inventory first). The random generator is
+seeded, so the same arguments always produce the same data. Derived tables
+(film_stats) are rebuilt at the end.
+'''
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import film_stats  # noqa: E402
+from main import fetch_all, transaction  # noqa: E402
+
+TITLE_PREFIX = 'BENCH '
+EMAIL_DOMAIN = '@bench.invalid'
+BATCH = 5000
+WORDS = ['ACADEMY', 'ACE', 'ADAPTATION', 'AFFAIR', 'AFRICAN', 'AGENT', 'AIRPLANE', 'ALABAMA', 'ALADDIN', 'ALAMO',
+         'ALASKA', 'ALI', 'ALICE', 'ALIEN', 'ALLEY', 'ALONE', 'ALTER', 'AMADEUS', 'AMELIE', 'AMERICAN', 'AMISTAD',
+         'ANACONDA', 'ANALYZE', 'ANGELS', 'ANNIE', 'ANONYMOUS', 'ANTHEM', 'ANTITRUST', 'ANYTHING', 'APACHE',
+         'APOCALYPSE', 'APOLLO', 'ARABIA', 'ARACHNOPHOBIA', 'ARGONAUTS', 'ARIZONA', 'ARK', 'ARMAGEDDON', 'ARMY',
+         'ARSENIC', 'ARTIST', 'ATLANTIS', 'ATTACKS', 'ATTRACTION', 'AUTUMN', 'BABY', 'BACKLASH', 'BADMAN', 'BAKED',
+         'BALLOON', 'BALLROOM', 'BANG', 'BANGER', 'BARBARELLA', 'BAREFOOT', 'BASIC', 'BEACH', 'BEAR', 'BEAST']
+NAMES = ['MARY', 'PATRICIA', 'LINDA', 'BARBARA', 'ELIZABETH', 'JENNIFER', 'MARIA', 'SUSAN', 'MARGARET', 'DOROTHY',
+         'SMITH', 'JOHNSON', 'WILLIAMS', 'JONES', 'BROWN', 'DAVIS', 'MILLER', 'WILSON', 'MOORE', 'TAYLOR']
+
+
+def insert_batches(cursor, query, rows):
+    for start in range(0, len(rows), BATCH):
+        cursor.executemany(query, rows[start:start + BATCH])
+
+
+def reset():
+    with transaction() as cursor:
+        cursor.execute("""delete r from sakila.rental r
+                          join sakila.inventory i on r.inventory_id = i.inventory_id
+                          join sakila.film f on i.film_id = f.film_id
+                          where f.title like %s;""", (TITLE_PREFIX + '%',))
+        cursor.execute("""delete r from sakila.rental r
+                          join sakila.customer c on r.customer_id = c.customer_id
+                          where c.email like %s;""", ('%' + EMAIL_DOMAIN,))
+        cursor.execute("""delete i from sakila.inventory i
+                          join sakila.film f on i.film_id = f.film_id
+                          where f.title like %s;""", (TITLE_PREFIX + '%',))
+        cursor.execute("""delete fa from sakila.film_actor fa
+                          join sakila.film f on fa.film_id = f.film_id where f.title like %s;""", (TITLE_PREFIX + '%',))
+        cursor.execute("""delete fc from sakila.film_category fc
+                          join sakila.film f on fc.film_id = f.film_id where f.title like %s;""", (TITLE_PREFIX + '%',))
+        cursor.execute("""delete from sakila.film where title like %s;""", (TITLE_PREFIX + '%',))
+        cursor.execute("""delete from sakila.customer where email like %s;""", ('%' + EMAIL_DOMAIN,))
+        film_stats.rebuild(cursor)
+
+
+def seed(films, copies, customers, rentals, actors_per_film, seed_value):
+    rng = random.Random(seed_value)
+    actor_ids = [row[0] for row in fetch_all("""select actor_id from sakila.actor;""")]
+    category_ids = [row[0] for row in fetch_all("""select category_id from sakila.category;""")]
+    address_ids = [row[0] for row in fetch_all("""select address_id from sakila.address;""")]
+    ratings = ['G', 'PG', 'PG-13', 'R', 'NC-17']
+
+    with transaction() as cursor:
+        started = time.perf_counter()
+        film_rows = []
+        for n in range(films):
+            title = f'{TITLE_PREFIX}{rng.choice(WORDS)} {rng.choice(WORDS)} {n}'
+            description = 'A ' + ' '.join(rng.choice(WORDS).title() for _ in range(10))
+            film_rows.append((title, description, 2006, 1, rng.randint(3, 7), rng.choice(('0.99', '2.99', '4.99')),
+                              rng.randint(46, 185), rng.choice(('9.99', '14.99', '19.99', '24.99')), rng.choice(ratings)))
+        insert_batches(cursor, """insert into sakila.film (title, description, release_year, language_id,
+                                  rental_duration, rental_rate, length, replacement_cost, rating)
+                                  values (%s, %s, %s, %s, %s, %s, %s, %s, %s)""", film_rows)
+        cursor.execute("""select film_id from sakila.film where title like %s order by film_id;""", (TITLE_PREFIX + '%',))
+        film_ids = [row[0] for row in cursor.fetchall()][-films:] if films else []
+
+        insert_batches(cursor, """insert into sakila.film_actor (actor_id, film_id) values (%s, %s)""",
+                       [(actor_id, film_id) for film_id in film_ids
+                        for actor_id in rng.sample(actor_ids, min(actors_per_film, len(actor_ids)))])
+        insert_batches(cursor, """insert into sakila.film_category (film_id, category_id) values (%s, %s)""",
+                       [(film_id, rng.choice(category_ids)) for film_id in film_ids])
+        insert_batches(cursor, """insert into sakila.inventory (film_id, store_id) values (%s, %s)""",
+                       [(film_id, copy % 2 + 1) for film_id in film_ids for copy in range(copies)])
+        print(f'films, cast, categories, inventory: {time.perf_counter() - started:.1f}s')
+
+        started = time.perf_counter()
+        customer_rows = []
+        for n in range(customers):
+            first_name, last_name = rng.choice(NAMES[:10]), rng.choice(NAMES[10:])
+            customer_rows.append((n % 2 + 1, first_name, f'{last_name}{n}',
+                                  f'{first_name}.{last_name}{n}{EMAIL_DOMAIN}'.lower(), rng.choice(address_ids)))
+        insert_batches(cursor, """insert into sakila.customer (store_id, first_name, last_name, email, address_id, create_date)
+                                  values (%s, %s, %s, %s, %s, now())""", customer_rows)
+        print(f'customers: {time.perf_counter() - started:.1f}s')
+
+        started = time.perf_counter()
+        cursor.execute("""select customer_id from sakila.customer where email like %s;""", ('%' + EMAIL_DOMAIN,))
+        customer_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute("""select inventory_id from sakila.inventory where film_id >= %s;""", (min(film_ids) if film_ids else 0,))
+        inventory_ids = [row[0] for row in cursor.fetchall()]
+        if customer_ids and inventory_ids:
+            # Historical rentals, all returned; popularity is skewed like real catalogs
+            first_day = datetime(2020, 1, 1)
+            rental_rows = []
+            for _ in range(rentals):
+                rented = first_day + timedelta(minutes=rng.randint(0, 60 * 24 * 365 * 3))
+                inventory_id = inventory_ids[min(int(rng.paretovariate(1.2)) - 1, len(inventory_ids) - 1)
+                                             if rng.random() < 0.5 else rng.randrange(len(inventory_ids))]
+                rental_rows.append((rented, inventory_id, rng.choice(customer_ids),
+                                    rented + timedelta(days=rng.randint(1, 7))))
+            insert_batches(cursor, """insert into sakila.rental (rental_date, inventory_id, customer_id, return_date, staff_id)
+                                      values (%s, %s, %s, %s, 1)""", rental_rows)
+        print(f'rentals: {time.perf_counter() - started:.1f}s')
+
+        film_stats.rebuild(cursor)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--films', type=int, default=10000)
+    parser.add_argument('--copies', type=int, default=4, help='inventory copies per film')
+    parser.add_argument('--customers', type=int, default=50000)
+    parser.add_argument('--rentals', type=int, default=500000)
+    parser.add_argument('--actors-per-film', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--reset', action='store_true', help='remove previously seeded rows and exit')
+    args = parser.parse_args()
+
+    reset()
+    if args.reset:
+        print('synthetic rows removed')
+        return
+    seed(args.films, args.copies, args.customers, args.rentals, args.actors_per_film, args.seed)
+    print('done; restart the server so in-memory indexes pick up the new data')
+
+
+if __name__ == '__main__':
+    main()
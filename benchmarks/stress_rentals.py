@@ -0,0 +1,125 @@
+'''
+Concurrent rentals of one film with few copies through /api/rentfilm and /api/rentfilms,
+against a running server and its sakila database, checking that no copy is handed out
+twice.
+
+    python main.py &
+    python benchmarks/stress_rentals.py --threads 16 --rounds 20 [--film-id 1]
+
+Every round, half of the threads rent the film one copy per request and the other half
+in batches of --batch-size, all released at the same moment, so there are always more
+requests than free copies. After each round the script asserts that:
+
+* no inventory_id of the film has more than one open rental,
+* sakila.film_stats.checked_out for the film equals its open rentals,
+* the rentals the server answered as successful are exactly the new open rentals.
+
+The rentals are then returned with /api/returnfilms, so every round starts from the
+same free copies. Rentals use the marker rental_date of bench_rentals.py. Run the
+server without WRITE_BEHIND, which only queues /api/rentfilm requests.
+'''
+import argparse
+import os
+import random
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_rentals import MARKER_DATE, return_all  # noqa: E402
+from main import fetch_from_primary  # noqa: E402
+
+
+def pick_film():
+    # The film with the fewest copies that has at least two of them free
+    rows = fetch_from_primary("""select film_id from sakila.film_stats
+                                 where total_copies - checked_out >= 2
+                                 order by total_copies, film_id
+                                 limit 1;""")
+    if not rows:
+        raise SystemExit('No film with two free copies; run python film_stats.py verify')
+    return rows[0][0]
+
+
+def film_state(film_id):
+    # (copies, open rentals per inventory_id, film_stats.checked_out, open rentals made by this script)
+    copies = [row[0] for row in fetch_from_primary("""select inventory_id from sakila.inventory
+                                                      where film_id = %s;""", (film_id,))]
+    open_rentals = {inventory_id: int(count) for inventory_id, count in fetch_from_primary(
+        """select r.inventory_id, count(*) from sakila.rental r
+           join sakila.inventory i on r.inventory_id = i.inventory_id
+           where i.film_id = %s and r.return_date is null
+           group by r.inventory_id;""", (film_id,))}
+    checked_out = fetch_from_primary("""select checked_out from sakila.film_stats where film_id = %s;""",
+                                     (film_id,))[0][0]
+    marked = fetch_from_primary("""select count(*) from sakila.rental r
+                                   join sakila.inventory i on r.inventory_id = i.inventory_id
+                                   where i.film_id = %s and r.rental_date = %s and r.return_date is null;""",
+                                (film_id, MARKER_DATE))[0][0]
+    return copies, open_rentals, checked_out, int(marked)
+
+
+def run_round(base_url, film_id, customers, threads, batch_size, rng):
+    start = threading.Barrier(threads)
+
+    def rent(worker):
+        session = requests.Session()
+        items = [{'rental_date': MARKER_DATE, 'film_id': film_id, 'customer_id': rng.choice(customers)}
+                 for _ in range(1 if worker % 2 == 0 else batch_size)]
+        start.wait()
+        if len(items) == 1:
+            response = session.put(f'{base_url}/api/rentfilm', json=items[0])
+            return ('single', 1 if response.status_code == 200 else 0, response.status_code)
+        response = session.put(f'{base_url}/api/rentfilms', json={'rentals': items})
+        rented = response.json().get('rented', 0) if response.status_code == 200 else 0
+        return ('batch', rented, response.status_code)
+
+    with ThreadPoolExecutor(threads) as executor:
+        return list(executor.map(rent, range(threads)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000')
+    parser.add_argument('--film-id', type=int, default=None, help='default: the film with the fewest copies')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--batch-size', type=int, default=3)
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    customers = [row[0] for row in fetch_from_primary("""select customer_id from sakila.customer
+                                                         where active = 1 limit 1000;""")]
+    return_all(args.base_url)
+    film_id = args.film_id or pick_film()
+    copies, open_rentals, _, _ = film_state(film_id)
+    free = len(copies) - len(open_rentals)
+    print(f'film {film_id}: {len(copies)} copies, {free} free; {args.threads} threads per round')
+    print(f"{'round':>5} {'single':>7} {'batch':>6} {'rented':>7} {'errors':>7} {'free left':>10}")
+
+    for round_number in range(1, args.rounds + 1):
+        results = run_round(args.base_url, film_id, customers, args.threads, args.batch_size, rng)
+        copies, open_rentals, checked_out, opened = film_state(film_id)
+        rented = {mode: sum(count for result_mode, count, _ in results if result_mode == mode)
+                  for mode in ('single', 'batch')}
+        errors = sum(1 for _, _, status in results if status >= 500)
+
+        doubled = {inventory_id: count for inventory_id, count in open_rentals.items() if count > 1}
+        assert not doubled, f'round {round_number}: inventory ids with more than one open rental: {doubled}'
+        assert checked_out == sum(open_rentals.values()), \
+            f'round {round_number}: film_stats.checked_out {checked_out} != {sum(open_rentals.values())} open rentals'
+        assert opened == rented['single'] + rented['batch'], \
+            f'round {round_number}: server reported {rented["single"] + rented["batch"]} rentals, {opened} are open'
+
+        print(f"{round_number:>5} {rented['single']:>7} {rented['batch']:>6} {opened:>7} {errors:>7} "
+              f"{len(copies) - len(open_rentals):>10}")
+        return_all(args.base_url)
+
+    print(f'\n{args.rounds} rounds: no copy rented twice, film_stats.checked_out consistent')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,505 @@
+'''
+Read-only snapshot of the sakila catalog: film, actor, category, language and the
+film_actor / film_category links, answered from memory.
+
+A Snapshot keeps every column in a typed array, one entry per row in id order. Text
+columns hold an index into one string table in which every distinct string is stored
+once (index 0 stands for NULL), so repeated ratings, feature sets and names cost four
+bytes per row. For each table an array indexed by id gives a row's position. The links
+are kept both ways as offset lists: the actors of a film are
+film_actors[film_actor_start[film]:film_actor_start[film + 1]], and the films of an
+actor work the same way.
+
+Snapshot.save() writes the arrays to one file and Snapshot.load() maps that file into
+memory. The numeric arrays are used straight from the mapping and only the string table
+is decoded, so a worker starts without querying the catalog tables. Worker processes
+that map the same file share its pages.
+
+Catalog holds the current snapshot. At startup it uses the snapshot file when the file's
+fingerprint still matches the database. Otherwise it builds a snapshot from the tables
+and rewrites the file. A background thread compares the fingerprint every
+refresh_interval seconds and swaps in a rebuilt snapshot when a last_update or row
+count moved. Readers keep the snapshot they started with.
+
+    python catalog.py save [path]   # build from the database and write the snapshot file
+    python catalog.py info [path]   # load a snapshot file and report its size and load time
+'''
+import array
+import json
+import logging
+import mmap
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import statements
+
+catalog_log = logging.getLogger('sakila.catalog')
+
+# Cheap fingerprint of the catalog tables; any change triggers a rebuild
+CHANGE_QUERY = statements.register('catalog_change', """
+    select (select max(last_update) from sakila.film),
+           (select count(*) from sakila.film),
+           (select max(last_update) from sakila.film_actor),
+           (select count(*) from sakila.film_actor),
+           (select max(last_update) from sakila.film_category),
+           (select count(*) from sakila.film_category),
+           (select max(last_update) from sakila.actor),
+           (select count(*) from sakila.actor),
+           (select max(last_update) from sakila.category),
+           (select max(last_update) from sakila.language);
+""", full_scan_ok=True)
+
+FILMS_QUERY = """select film_id, title, description, release_year, language_id, original_language_id,
+                        rental_duration, rental_rate, length, replacement_cost, rating, special_features,
+                        last_update
+                 from sakila.film order by film_id;"""
+ACTORS_QUERY = """select actor_id, first_name, last_name from sakila.actor order by actor_id;"""
+CATEGORIES_QUERY = """select category_id, name from sakila.category order by category_id;"""
+LANGUAGES_QUERY = """select language_id, name from sakila.language order by language_id;"""
+FILM_ACTORS_QUERY = """select film_id, actor_id from sakila.film_actor order by film_id, actor_id;"""
+FILM_CATEGORIES_QUERY = """select film_id, category_id from sakila.film_category order by film_id, category_id;"""
+
+MAGIC = b'SAKILA-CATALOG\x00\x01'
+EPOCH = datetime(1970, 1, 1)
+
+#array name -> typecode. Nullable numbers use 0 for NULL, text columns index 0 of the string table.
+#Money is stored in cents, last_update in seconds since EPOCH.
+ARRAYS = {
+    'film_id': 'I', 'film_title': 'I', 'film_description': 'I', 'film_release_year': 'H',
+    'film_language': 'I', 'film_original_language': 'I', 'film_rental_duration': 'H',
+    'film_rental_rate': 'I', 'film_length': 'H', 'film_replacement_cost': 'I', 'film_rating': 'I',
+    'film_special_features': 'I', 'film_last_update': 'q',
+    'actor_id': 'I', 'actor_first_name': 'I', 'actor_last_name': 'I',
+    'category_id': 'I', 'category_name': 'I',
+    'language_id': 'I', 'language_name': 'I',
+    'film_actor_start': 'I', 'film_actors': 'I', 'actor_film_start': 'I', 'actor_films': 'I',
+    'film_category_start': 'I', 'film_categories': 'I',
+    'film_position': 'i', 'actor_position': 'i', 'category_position': 'i', 'language_position': 'i',
+    'string_start': 'I',
+}
+
+
+def fingerprint_of(row):
+    # Fingerprint values as strings, so one read from the database compares equal to one read from a file
+    return tuple(None if value is None else str(value) for value in row)
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def _positions(ids):
+    # Array indexed by id holding the row position, -1 where no row has that id
+    positions = array.array('i', [-1]) * ((max(ids) + 1) if len(ids) else 0)
+    for position, row_id in enumerate(ids):
+        positions[row_id] = position
+    return positions
+
+
+def _links(pairs, left_positions, right_positions, count):
+    # Offsets and targets grouping (left id, right id) pairs by left position
+    grouped = [[] for _ in range(count)]
+    for left_id, right_id in pairs:
+        left = left_positions[left_id] if left_id < len(left_positions) else -1
+        right = right_positions[right_id] if right_id < len(right_positions) else -1
+        if left >= 0 and right >= 0:
+            grouped[left].append(right)
+    start = array.array('I', [0])
+    targets = array.array('I')
+    for group in grouped:
+        targets.extend(sorted(group))
+        start.append(len(targets))
+    return start, targets
+
+
+class Snapshot:
+    def __init__(self, fingerprint, arrays, strings, source, mapped=None):
+        self.fingerprint = fingerprint
+        self.source = source  # 'database' or the path of the snapshot file
+        self.strings = strings  # string table; index 0 is None
+        self.arrays = arrays
+        self._mapped = mapped  # the file mapping the arrays point into, if any
+        for name in ARRAYS:
+            setattr(self, name, arrays[name])
+        self._feature_sets = {}
+
+    @classmethod
+    def from_rows(cls, fingerprint, films, actors, categories, languages, film_actors, film_categories):
+        # Rows as returned by the *_QUERY statements above
+        strings = [None]
+        string_index = {}
+
+        def text(value):
+            if value is None:
+                return 0
+            index = string_index.get(value)
+            if index is None:
+                index = string_index[value] = len(strings)
+                strings.append(sys.intern(value))
+            return index
+
+        def features(value):
+            if value is None:
+                return 0
+            if isinstance(value, str):
+                value = [item for item in value.split(',') if item]
+            return text(','.join(sorted(value)))
+
+        def cents(value):
+            return int(round(value * 100))
+
+        arrays = {name: array.array(typecode) for name, typecode in ARRAYS.items()}
+        for (film_id, title, description, release_year, language_id, original_language_id, rental_duration,
+             rental_rate, length, replacement_cost, rating, special_features, last_update) in films:
+            arrays['film_id'].append(film_id)
+            arrays['film_title'].append(text(title))
+            arrays['film_description'].append(text(description))
+            arrays['film_release_year'].append(release_year or 0)
+            arrays['film_language'].append(language_id)
+            arrays['film_original_language'].append(original_language_id or 0)
+            arrays['film_rental_duration'].append(rental_duration)
+            arrays['film_rental_rate'].append(cents(rental_rate))
+            arrays['film_length'].append(length or 0)
+            arrays['film_replacement_cost'].append(cents(replacement_cost))
+            arrays['film_rating'].append(text(rating))
+            arrays['film_special_features'].append(features(special_features))
+            arrays['film_last_update'].append(int((last_update - EPOCH).total_seconds()) if last_update else 0)
+        for actor_id, first_name, last_name in actors:
+            arrays['actor_id'].append(actor_id)
+            arrays['actor_first_name'].append(text(first_name))
+            arrays['actor_last_name'].append(text(last_name))
+        for category_id, name in categories:
+            arrays['category_id'].append(category_id)
+            arrays['category_name'].append(text(name))
+        for language_id, name in languages:
+            arrays['language_id'].append(language_id)
+            arrays['language_name'].append(text(name))
+
+        for table in ('film', 'actor', 'category', 'language'):
+            arrays[f'{table}_position'] = _positions(arrays[f'{table}_id'])
+        film_actors = list(film_actors)
+        film_count, actor_count = len(arrays['film_id']), len(arrays['actor_id'])
+        arrays['film_actor_start'], arrays['film_actors'] = _links(
+            film_actors, arrays['film_position'], arrays['actor_position'], film_count)
+        arrays['actor_film_start'], arrays['actor_films'] = _links(
+            [(actor_id, film_id) for film_id, actor_id in film_actors],
+            arrays['actor_position'], arrays['film_position'], actor_count)
+        arrays['film_category_start'], arrays['film_categories'] = _links(
+            film_categories, arrays['film_position'], arrays['category_position'], film_count)
+
+        offset = 0
+        arrays['string_start'] = array.array('I', [0, 0])
+        for value in strings[1:]:
+            offset += len(value.encode('utf-8'))
+            arrays['string_start'].append(offset)
+        return cls(fingerprint, arrays, strings, 'database')
+
+    def save(self, path):
+        # Written next to the target and renamed over it, so readers never map a partial file
+        sections, offset = {}, 0
+        for name in ARRAYS:
+            values = self.arrays[name]
+            sections[name] = (ARRAYS[name], offset, len(values))
+            offset = _align(offset + len(values) * values.itemsize)
+        string_data = ''.join(self.strings[1:]).encode('utf-8')
+        header = json.dumps({
+            'fingerprint': self.fingerprint,
+            'byteorder': sys.byteorder,
+            'arrays': sections,
+            'strings': [offset, len(string_data)],
+        }).encode()
+
+        temporary = f'{path}.{os.getpid()}.tmp'
+        with open(temporary, 'wb') as f:
+            f.write(MAGIC + len(header).to_bytes(8, 'little') + header)
+            base = _align(len(MAGIC) + 8 + len(header))
+            for name in ARRAYS:
+                f.seek(base + sections[name][1])
+                f.write(self.arrays[name].tobytes())
+            f.seek(base + offset)
+            f.write(string_data)
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mapped)
+        if bytes(view[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f'{path} is not a catalog snapshot')
+        header_length = int.from_bytes(view[len(MAGIC):len(MAGIC) + 8], 'little')
+        header_start = len(MAGIC) + 8
+        header = json.loads(bytes(view[header_start:header_start + header_length]))
+        if header['byteorder'] != sys.byteorder or set(header['arrays']) != set(ARRAYS):
+            raise ValueError(f'{path} was written for a different platform or catalog layout')
+
+        base = _align(header_start + header_length)
+        arrays = {}
+        for name, (typecode, offset, count) in header['arrays'].items():
+            start = base + offset
+            arrays[name] = view[start:start + count * array.array(typecode).itemsize].cast(typecode)
+
+        offset, length = header['strings']
+        data = bytes(view[base + offset:base + offset + length])
+        bounds = arrays['string_start']
+        strings = [None] + [sys.intern(data[bounds[index]:bounds[index + 1]].decode('utf-8'))
+                            for index in range(1, len(bounds) - 1)]
+        return cls(tuple(header['fingerprint']), arrays, strings, path, mapped)
+
+    def _features(self, index):
+        if index == 0:
+            return None
+        features = self._feature_sets.get(index)
+        if features is None:
+            text = self.strings[index]
+            features = self._feature_sets[index] = frozenset(text.split(',')) if text else frozenset()
+        return features
+
+    def film_count(self):
+        return len(self.film_id)
+
+    def _film(self, film_id):
+        positions = self.film_position
+        return positions[film_id] if 0 <= film_id < len(positions) else -1
+
+    def film_details(self, film_ids):
+        # {film_id: (film_id, title, description, release_year, language_id, original_language_id,
+        #            rental_duration, rental_rate, length, replacement_cost, rating, special_features,
+        #            last_update, language_name)} for the ids that exist
+        rows = {}
+        for film_id in film_ids:
+            position = self._film(film_id)
+            if position < 0:
+                continue
+            language_id = self.film_language[position]
+            language = self.language_position[language_id] if language_id < len(self.language_position) else -1
+            last_update = self.film_last_update[position]
+            rows[film_id] = (
+                film_id,
+                self.strings[self.film_title[position]],
+                self.strings[self.film_description[position]],
+                self.film_release_year[position] or None,
+                language_id,
+                self.film_original_language[position] or None,
+                self.film_rental_duration[position],
+                Decimal(self.film_rental_rate[position]).scaleb(-2),
+                self.film_length[position] or None,
+                Decimal(self.film_replacement_cost[position]).scaleb(-2),
+                self.strings[self.film_rating[position]],
+                self._features(self.film_special_features[position]),
+                EPOCH + timedelta(seconds=last_update) if last_update else None,
+                self.strings[self.language_name[language]] if language >= 0 else None,
+            )
+        return rows
+
+    def film_summary(self, film_id):
+        # (title, description, release_year, rating) or None
+        position = self._film(film_id)
+        if position < 0:
+            return None
+        return (self.strings[self.film_title[position]], self.strings[self.film_description[position]],
+                self.film_release_year[position] or None, self.strings[self.film_rating[position]])
+
+    def film_actor_names(self, film_id):
+        # [(first_name, last_name)] ordered by actor_id
+        position = self._film(film_id)
+        if position < 0:
+            return []
+        return [(self.strings[self.actor_first_name[actor]], self.strings[self.actor_last_name[actor]])
+                for actor in self.film_actors[self.film_actor_start[position]:self.film_actor_start[position + 1]]]
+
+    def film_category_names(self, film_id):
+        position = self._film(film_id)
+        if position < 0:
+            return []
+        return [self.strings[self.category_name[category]] for category in
+                self.film_categories[self.film_category_start[position]:self.film_category_start[position + 1]]]
+
+    def films(self):
+        # [(film_id, title, description)]
+        strings = self.strings
+        return [(self.film_id[position], strings[self.film_title[position]], strings[self.film_description[position]])
+                for position in range(len(self.film_id))]
+
+    def titles(self):
+        return {self.film_id[position]: self.strings[self.film_title[position]]
+                for position in range(len(self.film_id))}
+
+    def actors(self):
+        # {actor_id: (first_name, last_name)}
+        strings = self.strings
+        return {self.actor_id[position]: (strings[self.actor_first_name[position]],
+                                          strings[self.actor_last_name[position]])
+                for position in range(len(self.actor_id))}
+
+    def actor_film_ids(self):
+        # {actor_id: [film_id]} for actors with at least one film
+        start, films, film_ids = self.actor_film_start, self.actor_films, self.film_id
+        return {self.actor_id[position]: [film_ids[film] for film in films[start[position]:start[position + 1]]]
+                for position in range(len(self.actor_id)) if start[position + 1] > start[position]}
+
+    def film_actors_by_name(self):
+        # [(film_id, first_name, last_name)] for every film_actor link
+        return [(self.film_id[position], first_name, last_name)
+                for position in range(len(self.film_id))
+                for first_name, last_name in self.film_actor_names(self.film_id[position])]
+
+    def film_categories_by_name(self):
+        # [(film_id, category name)] for every film_category link
+        return [(self.film_id[position], name)
+                for position in range(len(self.film_id))
+                for name in self.film_category_names(self.film_id[position])]
+
+    def memory(self):
+        # Bytes held by the arrays (shared between processes when mapped from a file) and by the strings
+        array_bytes = sum(len(values) * values.itemsize for values in self.arrays.values())
+        string_bytes = sum(sys.getsizeof(value) for value in self.strings[1:]) + sys.getsizeof(self.strings)
+        return {'array_bytes': array_bytes, 'string_bytes': string_bytes}
+
+
+class Catalog:
+    def __init__(self, fetch_all, snapshot_path=None, refresh_interval=60, on_refresh=None):
+        self.fetch_all = fetch_all
+        self.snapshot_path = snapshot_path
+        self.refresh_interval = refresh_interval
+        self.on_refresh = on_refresh  # called after a changed snapshot replaced the served one
+
+        self._snapshot = None
+        self._stopping = False
+        self._thread = None
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+
+        self._stats = {
+            'builds': 0,
+            'file_loads': 0,
+            'refreshes': 0,
+            'load_time': 0.0,
+        }
+
+    def _fingerprint(self):
+        return fingerprint_of(self.fetch_all(CHANGE_QUERY)[0])
+
+    def build(self, fingerprint=None):
+        # Reads the catalog tables; the fingerprint is taken first, so a change made while
+        # the tables are read is picked up by the next refresh
+        started = time.monotonic()
+        fingerprint = fingerprint or self._fingerprint()
+        snapshot = Snapshot.from_rows(
+            fingerprint,
+            self.fetch_all(FILMS_QUERY), self.fetch_all(ACTORS_QUERY), self.fetch_all(CATEGORIES_QUERY),
+            self.fetch_all(LANGUAGES_QUERY), self.fetch_all(FILM_ACTORS_QUERY), self.fetch_all(FILM_CATEGORIES_QUERY))
+        with self._lock:
+            self._snapshot = snapshot
+            self._stats['builds'] += 1
+            self._stats['load_time'] = round(time.monotonic() - started, 6)
+        if self.snapshot_path:
+            try:
+                snapshot.save(self.snapshot_path)
+            except OSError as e:
+                catalog_log.warning('Could not write catalog snapshot %s: %s', self.snapshot_path, e)
+        return snapshot
+
+    def load(self):
+        # Maps the snapshot file when it is still current, otherwise builds from the database
+        fingerprint = self._fingerprint()
+        if self.snapshot_path and os.path.exists(self.snapshot_path):
+            started = time.monotonic()
+            try:
+                snapshot = Snapshot.load(self.snapshot_path)
+            except (OSError, ValueError) as e:
+                catalog_log.warning('Ignoring catalog snapshot %s: %s', self.snapshot_path, e)
+            else:
+                if snapshot.fingerprint == fingerprint:
+                    with self._lock:
+                        self._snapshot = snapshot
+                        self._stats['file_loads'] += 1
+                        self._stats['load_time'] = round(time.monotonic() - started, 6)
+                    return snapshot
+        return self.build(fingerprint)
+
+    def refresh_if_changed(self):
+        fingerprint = self._fingerprint()
+        if self._snapshot is None or fingerprint != self._snapshot.fingerprint:
+            self.build(fingerprint)
+            with self._lock:
+                self._stats['refreshes'] += 1
+            if self.on_refresh is not None:
+                self.on_refresh()
+
+    def snapshot(self):
+        snapshot = self._snapshot
+        return snapshot if snapshot is not None else self.load()
+
+    def version(self):
+        # Fingerprint of the snapshot being served, used for ETags
+        return self.snapshot().fingerprint
+
+    def start(self):
+        if self._snapshot is None:
+            self.load()
+        self._thread = threading.Thread(target=self._run, name='catalog-refresh', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stopping = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stopping:
+            self._wake.wait(self.refresh_interval)
+            if self._stopping:
+                return
+            try:
+                self.refresh_if_changed()
+            except Exception:
+                # Database unreachable; keep serving the current snapshot
+                pass
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            snapshot = self._snapshot
+        if snapshot is not None:
+            stats.update(snapshot.memory())
+            stats['films'] = snapshot.film_count()
+            stats['actors'] = len(snapshot.actor_id)
+            stats['strings'] = len(snapshot.strings) - 1
+            stats['source'] = snapshot.source
+            total = stats['array_bytes'] + stats['string_bytes']
+            stats['bytes_per_10k_films'] = round(total * 10000 / stats['films']) if stats['films'] else 0
+        return stats
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else ''
+    if command not in ('save', 'info'):
+        print('usage: python catalog.py save|info [path]')
+        sys.exit(2)
+    path = sys.argv[2] if len(sys.argv) > 2 else os.getenv('CATALOG_SNAPSHOT')
+    if not path:
+        print('No snapshot path given and CATALOG_SNAPSHOT is not set')
+        sys.exit(2)
+
+    if command == 'save':
+        from main import fetch_from_primary
+
+        started = time.monotonic()
+        saved = Catalog(fetch_from_primary, path).build()
+        print(f'{saved.film_count()} films written to {path} in {time.monotonic() - started:.2f}s')
+
+    started = time.monotonic()
+    snapshot = Snapshot.load(path)
+    load_seconds = time.monotonic() - started
+    memory = snapshot.memory()
+    per_10k = (memory['array_bytes'] + memory['string_bytes']) * 10000 / max(snapshot.film_count(), 1)
+    print(f'{path}: {snapshot.film_count()} films, {len(snapshot.actor_id)} actors, '
+          f'{len(snapshot.strings) - 1} strings, file {os.path.getsize(path)} bytes')
+    print(f'load {load_seconds * 1000:.1f} ms, arrays {memory["array_bytes"]} bytes (mapped), '
+          f'strings {memory["string_bytes"]} bytes, {per_10k / 1024:.0f} KiB per 10k films')
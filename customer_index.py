@@ -0,0 +1,109 @@
+'''
+In-process customer name index for /api/searchcustomers.
+
+First and last names are kept lowercased in two sorted arrays of (name, customer_id),
+so a prefix lookup is a binary search plus a walk over the matches. The arrays are
+updated by the customer write routes and rebuilt when the table fingerprint
+(row count, latest last_update) shows that someone else changed sakila.customer.
+'''
+import threading
+import time
+from bisect import bisect_left, insort
+
+import statements
+
+CHANGE_QUERY = statements.register('customer_change', """select count(*), max(last_update) from sakila.customer;""",
+                                  full_scan_ok=True)
+
+
+def normalize(name):
+    return (name or '').strip().lower()
+
+
+class CustomerNameIndex:
+    def __init__(self, fetch_all, refresh_interval=30):
+        self.fetch_all = fetch_all
+        self.refresh_interval = refresh_interval
+
+        self._first = []
+        self._last = []
+        self._names = {}  # customer_id -> (first, last)
+        self._fingerprint = None
+        self._checked_at = 0.0
+        self._built = False
+        self._lock = threading.RLock()
+
+    def build(self):
+        fingerprint = tuple(self.fetch_all(CHANGE_QUERY)[0])
+        rows = self.fetch_all("""select customer_id, first_name, last_name from sakila.customer;""")
+        names = {row[0]: (normalize(row[1]), normalize(row[2])) for row in rows}
+        with self._lock:
+            self._names = names
+            self._first = sorted((first, customer_id) for customer_id, (first, _) in names.items())
+            self._last = sorted((last, customer_id) for customer_id, (_, last) in names.items())
+            self._fingerprint = fingerprint
+            self._checked_at = time.monotonic()
+            self._built = True
+
+    def refresh_if_changed(self):
+        if not self._built:
+            self.build()
+            return
+        if time.monotonic() - self._checked_at < self.refresh_interval:
+            return
+        self._checked_at = time.monotonic()
+        if tuple(self.fetch_all(CHANGE_QUERY)[0]) != self._fingerprint:
+            self.build()
+
+    def version(self):
+        # Fingerprint of the data the index currently holds, used for ETags
+        self.refresh_if_changed()
+        return self._fingerprint
+
+    def add(self, customer_id, first_name, last_name):
+        with self._lock:
+            self.remove(customer_id)
+            first, last = normalize(first_name), normalize(last_name)
+            self._names[customer_id] = (first, last)
+            insort(self._first, (first, customer_id))
+            insort(self._last, (last, customer_id))
+
+    def update(self, customer_id, first_name=None, last_name=None):
+        with self._lock:
+            if customer_id not in self._names:
+                return
+            first, last = self._names[customer_id]
+            self.add(customer_id,
+                     first if first_name is None else first_name,
+                     last if last_name is None else last_name)
+
+    def remove(self, customer_id):
+        with self._lock:
+            names = self._names.pop(customer_id, None)
+            if names is None:
+                return
+            for entries, name in ((self._first, names[0]), (self._last, names[1])):
+                position = bisect_left(entries, (name, customer_id))
+                if position < len(entries) and entries[position] == (name, customer_id):
+                    del entries[position]
+
+    def _prefix(self, entries, prefix):
+        position = bisect_left(entries, (prefix,))
+        ids = set()
+        while position < len(entries) and entries[position][0].startswith(prefix):
+            ids.add(entries[position][1])
+            position += 1
+        return ids
+
+    def search(self, text):
+        # "mar" matches first or last names starting with mar;
+        # "mary sm" matches first name prefix mary and last name prefix sm
+        terms = normalize(text).split()
+        if not terms:
+            return []
+        with self._lock:
+            if len(terms) == 1:
+                ids = self._prefix(self._first, terms[0]) | self._prefix(self._last, terms[0])
+            else:
+                ids = self._prefix(self._first, terms[0]) & self._prefix(self._last, ' '.join(terms[1:]))
+        return sorted(ids)
@@ -0,0 +1,217 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import mysql.connector
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    # Bounded pool of MySQL connections.
+    # pool_size connections are kept around once opened, up to max_overflow extra
+    # connections may be opened under load and are closed again when returned.
+    # Idle connections older than idle_timeout are evicted, and a connection that
+    # sat idle longer than ping_interval is pinged before it is handed out again.
+    def __init__(self, factory, pool_size=5, max_overflow=10, pool_timeout=10,
+                 idle_timeout=300, ping_interval=30, on_acquire=None):
+        self.factory = factory
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.pool_timeout = pool_timeout
+        self.idle_timeout = idle_timeout
+        self.ping_interval = ping_interval
+        self.on_acquire = on_acquire  # called with the seconds each acquire() took
+
+        self._idle = deque()  # (conn, returned_at), most recently used on the right
+        self._open = 0
+        self._checked_out = 0
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+
+        self._stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time': 0.0,
+            'timeouts': 0,
+            'created': 0,
+            'closed': 0,
+            'evicted': 0,
+            'failed_pings': 0,
+        }
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except mysql.connector.Error:
+            pass
+
+    def _evict_idle(self, now):
+        # Oldest connections sit on the left, so stop at the first fresh one.
+        # Connections beyond pool_size are never idle, so anything stale goes.
+        evicted = []
+        while self._idle and now - self._idle[0][1] > self.idle_timeout:
+            conn, _ = self._idle.popleft()
+            self._open -= 1
+            self._stats['evicted'] += 1
+            evicted.append(conn)
+        return evicted
+
+    def _is_alive(self, conn, idle_for):
+        if idle_for < self.ping_interval:
+            return True
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except mysql.connector.Error:
+            return False
+
+    def acquire(self):
+        started = time.monotonic()
+        deadline = started + self.pool_timeout
+        waited = False
+
+        while True:
+            stale = []
+            with self._lock:
+                now = time.monotonic()
+                stale = self._evict_idle(now)
+
+                if self._idle:
+                    conn, returned_at = self._idle.pop()
+                    self._checked_out += 1
+                    reused = True
+                elif self._open < self.pool_size + self.max_overflow:
+                    self._open += 1
+                    self._checked_out += 1
+                    conn, returned_at = None, now
+                    reused = False
+                else:
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise PoolTimeout(f'Timed out after {self.pool_timeout}s waiting for a database connection')
+                    if not waited:
+                        waited = True
+                        self._stats['waits'] += 1
+                    self._available.wait(remaining)
+                    continue
+
+            for old in stale:
+                self._close(old)
+
+            if reused:
+                if self._is_alive(conn, now - returned_at):
+                    break
+                with self._lock:
+                    self._stats['failed_pings'] += 1
+                self._discard(conn)
+                continue
+
+            try:
+                conn = self.factory()
+            except Exception:
+                with self._lock:
+                    self._open -= 1
+                    self._checked_out -= 1
+                    self._available.notify()
+                raise
+            with self._lock:
+                self._stats['created'] += 1
+            break
+
+        elapsed = time.monotonic() - started
+        with self._lock:
+            self._stats['checkouts'] += 1
+            if waited:
+                self._stats['wait_time'] += elapsed
+        if self.on_acquire is not None:
+            self.on_acquire(elapsed)
+        return conn
+
+    def release(self, conn):
+        with self._lock:
+            self._checked_out -= 1
+            if len(self._idle) < self.pool_size:
+                self._idle.append((conn, time.monotonic()))
+                self._available.notify()
+                return
+            self._open -= 1
+            self._stats['closed'] += 1
+            self._available.notify()
+        self._close(conn)
+
+    def _discard(self, conn):
+        # Drop a connection that is broken or in an unknown state
+        with self._lock:
+            self._checked_out -= 1
+            self._open -= 1
+            self._stats['closed'] += 1
+            self._available.notify()
+        self._close(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        except (mysql.connector.InterfaceError, mysql.connector.OperationalError):
+            self._discard(conn)
+            raise
+        except BaseException:
+            try:
+                conn.rollback()
+            except mysql.connector.Error:
+                self._discard(conn)
+                raise
+            self.release(conn)
+            raise
+        else:
+            # End any snapshot a plain read left open so the next borrower
+            # does not see stale repeatable-read data.
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+            except mysql.connector.Error:
+                self._discard(conn)
+                return
+            self.release(conn)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                'pool_size': self.pool_size,
+                'max_overflow': self.max_overflow,
+                'open': self._open,
+                'idle': len(self._idle),
+                'checked_out': self._checked_out,
+                'overflow': max(self._open - self.pool_size, 0),
+            })
+        stats['wait_time'] = round(stats['wait_time'], 6)
+        return stats
+
+    def prefill(self, count=None):
+        # Opens connections up front (pool_size by default) so the first requests
+        # after startup do not pay for connecting
+        count = self.pool_size if count is None else min(count, self.pool_size + self.max_overflow)
+        conns = []
+        try:
+            for _ in range(count):
+                conns.append(self.acquire())
+        finally:
+            for conn in conns:
+                self.release(conn)
+        return len(conns)
+
+    def close_all(self):
+        with self._lock:
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._open -= len(idle)
+            self._stats['closed'] += len(idle)
+        for conn in idle:
+            self._close(conn)
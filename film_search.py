@@ -0,0 +1,192 @@
+'''
+In-memory inverted index for /api/searchfilms.
+
+Titles, actor names, category names and description words are tokenized into a
+postings map (token -> {film_id: weight}). A query token matches index tokens
+exactly, by prefix (binary search over the sorted vocabulary) or with one typo
+(deletion-neighbourhood lookup), so lookups cost depends on the query and the number
+of matches rather than on the size of the catalog. Every query token must match;
+films are ranked by the summed field weights of their best matches.
+
+The index is built from the in-memory catalog snapshot (catalog.py) and rebuilt when
+the catalog swaps in a new one, so building and refreshing it never query MySQL.
+'''
+import heapq
+import re
+import threading
+from bisect import bisect_left
+
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+FIELD_WEIGHTS = {'title': 5.0, 'actor': 3.0, 'category': 3.0, 'description': 1.0}
+EXACT, PREFIX, FUZZY = 1.0, 0.6, 0.3
+
+DESCRIPTION_STOPWORDS = frozenset(('a', 'an', 'and', 'the', 'of', 'in', 'on', 'to', 'who', 'must', 'by', 'for'))
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower()) if text else []
+
+
+def _deletes(token):
+    return {token[:i] + token[i + 1:] for i in range(len(token))}
+
+
+def _fuzzy_keys(token):
+    # Tokens shorter than 4 characters only match exactly or by prefix
+    if len(token) < 4:
+        return set()
+    return _deletes(token) | {token}
+
+
+class _IndexState:
+    def __init__(self, films, actors, categories):
+        # films: (film_id, title, description); actors: (film_id, first, last); categories: (film_id, name)
+        self.actors = {}
+        self.categories = {}
+        postings = {}
+
+        def add(text, film_id, field, stopwords=()):
+            weight = FIELD_WEIGHTS[field]
+            for token in tokenize(text):
+                if token in stopwords:
+                    continue
+                bucket = postings.setdefault(token, {})
+                if bucket.get(film_id, 0) < weight:
+                    bucket[film_id] = weight
+
+        for film_id, title, description in films:
+            add(title, film_id, 'title')
+            add(description, film_id, 'description', DESCRIPTION_STOPWORDS)
+        for film_id, first_name, last_name in actors:
+            name = f'{first_name} {last_name}'
+            self.actors.setdefault(film_id, []).append(name)
+            add(name, film_id, 'actor')
+        for film_id, name in categories:
+            self.categories.setdefault(film_id, []).append(name)
+            add(name, film_id, 'category')
+
+        for names in self.actors.values():
+            names.sort()
+        for names in self.categories.values():
+            names.sort()
+
+        self.postings = postings
+        self.vocabulary = sorted(postings)
+        self.fuzzy = {}
+        for token in self.vocabulary:
+            for key in _fuzzy_keys(token):
+                self.fuzzy.setdefault(key, []).append(token)
+        self.film_count = len(films)
+
+    def _prefix_tokens(self, prefix, limit):
+        start = bisect_left(self.vocabulary, prefix)
+        tokens = []
+        for token in self.vocabulary[start:start + limit]:
+            if not token.startswith(prefix):
+                break
+            tokens.append(token)
+        return tokens
+
+    def match(self, query_token, max_prefix_tokens):
+        # film_id -> best score for one query token
+        scores = {}
+
+        def apply(token, factor):
+            for film_id, weight in self.postings.get(token, {}).items():
+                score = weight * factor
+                if scores.get(film_id, 0) < score:
+                    scores[film_id] = score
+
+        apply(query_token, EXACT)
+        for token in self._prefix_tokens(query_token, max_prefix_tokens):
+            if token != query_token:
+                apply(token, PREFIX)
+
+        candidates = set()
+        for key in _fuzzy_keys(query_token):
+            candidates.update(self.fuzzy.get(key, ()))
+        candidates.discard(query_token)
+        for token in candidates:
+            # Shared deletion keys can pair words two edits apart (e.g. both lost a
+            # different letter); keep only true single edits and transpositions
+            if abs(len(token) - len(query_token)) <= 1 and _within_one_edit(token, query_token):
+                apply(token, FUZZY)
+        return scores
+
+
+def _within_one_edit(a, b):
+    if len(a) > len(b):
+        a, b = b, a
+    if len(a) == len(b):
+        diffs = [i for i in range(len(a)) if a[i] != b[i]]
+        if len(diffs) <= 1:
+            return True
+        return len(diffs) == 2 and diffs[1] == diffs[0] + 1 and a[diffs[0]] == b[diffs[1]] and a[diffs[1]] == b[diffs[0]]
+    for i in range(len(a)):
+        if a[i] != b[i]:
+            return a[i:] == b[i + 1:]
+    return True
+
+
+class FilmSearchIndex:
+    def __init__(self, catalog, max_prefix_tokens=200):
+        self.catalog = catalog
+        self.max_prefix_tokens = max_prefix_tokens
+
+        self._state = None
+        self._snapshot = None  # catalog snapshot the index was built from
+        self._lock = threading.Lock()
+
+    def build(self):
+        with self._lock:
+            snapshot = self.catalog.snapshot()
+            if snapshot is self._snapshot:
+                return
+            self.load(snapshot.films(), snapshot.film_actors_by_name(), snapshot.film_categories_by_name())
+            self._snapshot = snapshot
+
+    def load(self, films, actors, categories):
+        # Swapping a single reference keeps concurrent searches on a consistent state
+        self._state = _IndexState(films, actors, categories)
+
+    def refresh_if_changed(self):
+        # Cheap when the catalog is unchanged: one identity check
+        if self._state is None or self.catalog.snapshot() is not self._snapshot:
+            self.build()
+
+    def version(self):
+        # Fingerprint of the catalog snapshot the index currently holds, used for ETags
+        self.refresh_if_changed()
+        return self._snapshot.fingerprint if self._snapshot is not None else None
+
+    def search(self, text, limit=100):
+        # Returns [(film_id, score)] best first
+        state = self._state
+        query_tokens = list(dict.fromkeys(tokenize(text)))
+        if state is None or not query_tokens:
+            return []
+
+        totals = None
+        for query_token in query_tokens:
+            scores = state.match(query_token, self.max_prefix_tokens)
+            if totals is None:
+                totals = scores
+            else:
+                totals = {film_id: totals[film_id] + score for film_id, score in scores.items() if film_id in totals}
+            if not totals:
+                return []
+
+        return heapq.nsmallest(limit, totals.items(), key=lambda item: (-item[1], item[0]))
+
+    def actors_for(self, film_id):
+        return self._state.actors.get(film_id, []) if self._state else []
+
+    def categories_for(self, film_id):
+        return self._state.categories.get(film_id, []) if self._state else []
+
+    def stats(self):
+        state = self._state
+        if state is None:
+            return {'films': 0, 'tokens': 0}
+        return {'films': state.film_count, 'tokens': len(state.vocabulary)}
@@ -0,0 +1,132 @@
+'''
+Materialized per-film counters (sakila.film_stats).
+
+rental_count and checked_out are kept up to date by the rent/return write paths,
+so the landing page and film search no longer aggregate the whole rental history.
+Copies added to sakila.inventory outside this app are not tracked incrementally;
+run `python film_stats.py verify` to detect drift and `rebuild` to fix it.
+'''
+import sys
+
+CREATE_TABLE = """
+    create table if not exists sakila.film_stats (
+        film_id smallint unsigned not null primary key,
+        rental_count int unsigned not null default 0,
+        total_copies int unsigned not null default 0,
+        checked_out int unsigned not null default 0,
+        key idx_film_stats_rental_count (rental_count)
+    );
+"""
+
+# Full recompute from sakila.rental and sakila.inventory
+RECOMPUTE = """
+    select f.film_id,
+           coalesce(rentals.rental_count, 0) as rental_count,
+           coalesce(inv.total_copies, 0) as total_copies,
+           coalesce(rentals.checked_out, 0) as checked_out
+    from sakila.film f
+    left join (
+        select film_id, count(*) as total_copies
+        from sakila.inventory
+        group by film_id
+    ) inv on inv.film_id = f.film_id
+    left join (
+        select i.film_id, count(*) as rental_count, sum(r.return_date is null) as checked_out
+        from sakila.rental r
+        join sakila.inventory i on r.inventory_id = i.inventory_id
+        group by i.film_id
+    ) rentals on rentals.film_id = f.film_id
+"""
+
+
+def ensure_built(cursor):
+    #Create the table and populate it the first time the app starts against a database
+    cursor.execute(CREATE_TABLE)
+    cursor.execute("""select film_id from sakila.film_stats limit 1;""")
+    if not cursor.fetchall():
+        rebuild(cursor)
+
+
+def rebuild(cursor):
+    cursor.execute(f"""
+        insert into sakila.film_stats (film_id, rental_count, total_copies, checked_out)
+        {RECOMPUTE}
+        on duplicate key update
+            rental_count = values(rental_count),
+            total_copies = values(total_copies),
+            checked_out = values(checked_out);
+    """)
+    cursor.execute("""delete from sakila.film_stats
+                      where film_id not in (select film_id from sakila.film);""")
+
+
+def verify(cursor):
+    #Returns a list of (film_id, stored, expected) for every film whose counters drifted
+    cursor.execute(f"""
+        select expected.film_id,
+               fs.rental_count, fs.total_copies, fs.checked_out,
+               expected.rental_count, expected.total_copies, expected.checked_out
+        from ({RECOMPUTE}) expected
+        left join sakila.film_stats fs on fs.film_id = expected.film_id
+        where fs.film_id is null
+        or fs.rental_count <> expected.rental_count
+        or fs.total_copies <> expected.total_copies
+        or fs.checked_out <> expected.checked_out
+        order by expected.film_id;
+    """)
+    return [(row[0], row[1:4], tuple(int(value) for value in row[4:7])) for row in cursor.fetchall()]
+
+
+def record_rental(cursor, film_id):
+    cursor.execute("""update sakila.film_stats
+                      set rental_count = rental_count + 1, checked_out = checked_out + 1
+                      where film_id = %s;""", (film_id,))
+
+
+def record_return(cursor, rental_id):
+    cursor.execute("""update sakila.film_stats fs
+                      join sakila.inventory i on i.film_id = fs.film_id
+                      join sakila.rental r on r.inventory_id = i.inventory_id
+                      set fs.checked_out = greatest(fs.checked_out, 1) - 1
+                      where r.rental_id = %s;""", (rental_id,))
+
+
+def record_rentals(cursor, film_counts):
+    #Batched form of record_rental; film_counts maps film_id -> number of new rentals
+    cursor.executemany("""update sakila.film_stats
+                          set rental_count = rental_count + %s, checked_out = checked_out + %s
+                          where film_id = %s;""",
+                       [(count, count, film_id) for film_id, count in film_counts.items()])
+
+
+def record_returns(cursor, film_counts):
+    #Batched form of record_return; film_counts maps film_id -> number of returned rentals
+    cursor.executemany("""update sakila.film_stats
+                          set checked_out = greatest(checked_out, %s) - %s
+                          where film_id = %s;""",
+                       [(count, count, film_id) for film_id, count in film_counts.items()])
+
+
+if __name__ == '__main__':
+    from main import transaction
+
+    command = sys.argv[1] if len(sys.argv) > 1 else ''
+    if command not in ('rebuild', 'verify'):
+        print('usage: python film_stats.py rebuild|verify')
+        sys.exit(2)
+
+    if command == 'rebuild':
+        with transaction() as cursor:
+            cursor.execute(CREATE_TABLE)
+            rebuild(cursor)
+        print('film_stats rebuilt')
+        sys.exit(0)
+
+    with transaction() as cursor:
+        cursor.execute(CREATE_TABLE)
+        mismatches = verify(cursor)
+
+    for film_id, stored, expected in mismatches:
+        print(f'film {film_id}: stored (rental_count, total_copies, checked_out) = {stored}, expected {expected}')
+    print(f'{len(mismatches)} film(s) out of sync')
+    sys.exit(1 if mismatches else 0)
@@ -0,0 +1,187 @@
+'''
+Conditional GET (ETag / Last-Modified) and response compression for read endpoints.
+
+DataVersions keeps a version per data set ('rentals', 'customers', 'catalog', ...). A
+version is either a cheap fingerprint query (counts, max ids, latest last_update)
+re-run at most every check_interval seconds, or a callable such as an in-memory
+index's version(), so the ETag follows the data the route actually answers from.
+A local counter bumped by touch() when this process writes is added, so its own
+changes show up at once even within the same second.
+
+conditional(tags) derives a weak ETag from the request URL and the versions of the
+tags a route depends on. When the client's If-None-Match (or If-Modified-Since)
+still matches, a 304 is returned without running the view, so no SQL is executed.
+The versions come from the primary. A body read from a replica within lag_window
+seconds of a version change may predate it, so it is sent with Cache-Control: no-store
+and without validators instead of being tied to the new ETag.
+
+compress() gzip- or brotli-encodes JSON bodies above a size threshold when the
+client accepts it. brotli is used only if the optional brotli package is installed.
+'''
+import gzip
+import hashlib
+import threading
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from functools import wraps
+
+from flask import Response, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class DataVersions:
+    def __init__(self, fetch_all, queries, check_interval=5, lag_window=0, replica_read=None):
+        self.fetch_all = fetch_all
+        self.queries = queries  # tag -> fingerprint query, or a callable returning a version
+        self.check_interval = check_interval
+        self.lag_window = lag_window
+        self.replica_read = replica_read  # callable; True when the current request read from a replica
+
+        self._versions = {}  # tag -> (fingerprint, local counter)
+        self._checked_at = {}
+        self._changed_at = {}  # tag -> wall time the current version was first seen
+        self._local = {}
+        self._lock = threading.Lock()
+
+    def touch(self, *tags):
+        # Called after this process wrote; forces a fresh fingerprint on the next read
+        with self._lock:
+            for tag in tags:
+                self._local[tag] = self._local.get(tag, 0) + 1
+                self._checked_at.pop(tag, None)
+                self._changed_at[tag] = time.time()
+
+    def version(self, tag):
+        now = time.monotonic()
+        with self._lock:
+            current = self._versions.get(tag)
+            fresh = now - self._checked_at.get(tag, float('-inf')) < self.check_interval
+            local = self._local.get(tag, 0)
+        if current is not None and fresh and current[1] == local and not callable(self.queries[tag]):
+            return current
+        source = self.queries[tag]
+        fingerprint = source() if callable(source) else tuple(self.fetch_all(source)[0])
+        version = (fingerprint, local)
+        with self._lock:
+            if self._versions.get(tag) != version:
+                self._versions[tag] = version
+                self._changed_at[tag] = time.time()
+            self._checked_at[tag] = now
+        return version
+
+    def etag(self, key, tags):
+        digest = hashlib.sha1(repr((key, [self.version(tag) for tag in tags])).encode()).hexdigest()[:20]
+        return f'W/"{digest}"'
+
+    def last_modified(self, tags):
+        # Whole seconds, rounded up so a change later in the same second is not missed
+        with self._lock:
+            return int(max((self._changed_at.get(tag, 0) for tag in tags), default=0)) + 1
+
+    def may_lag(self, tags):
+        # True when the current request read from a replica and one of the tags changed
+        # less than lag_window seconds ago
+        if not self.lag_window or self.replica_read is None or not self.replica_read():
+            return False
+        since = time.time() - self.lag_window
+        with self._lock:
+            return any(self._changed_at.get(tag, 0) > since for tag in tags)
+
+    def stats(self):
+        with self._lock:
+            return {tag: {'fingerprint': str(fingerprint), 'local': local}
+                    for tag, (fingerprint, local) in self._versions.items()}
+
+
+def _etag_matches(header, etag):
+    if header.strip() == '*':
+        return True
+    # Weak comparison: W/"x" and "x" are the same entity
+    candidates = {value.strip().removeprefix('W/') for value in header.split(',')}
+    return etag.removeprefix('W/') in candidates
+
+
+def cache_key(path, args):
+    return path + '?' + '&'.join(f'{k}={v}' for k, v in sorted(args.items(multi=True)))
+
+
+def validate(versions, key, tags, if_none_match=None, if_modified_since=None):
+    # (ETag / Last-Modified headers for the current versions, True when the client's copy is still current)
+    etag = versions.etag(key, tags)
+    last_modified = versions.last_modified(tags)
+    headers = {'ETag': etag, 'Last-Modified': formatdate(last_modified, usegmt=True),
+               'Cache-Control': 'no-cache'}
+
+    if if_none_match is not None:
+        return headers, _etag_matches(if_none_match, etag)
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            since = None
+        return headers, since is not None and last_modified <= since
+    return headers, False
+
+
+def conditional(versions, tags):
+    # Decorator for GET views; wrap outside any response cache so a 304 skips it as well
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            headers, not_modified = validate(versions, cache_key(request.path, request.args), tags,
+                                             request.headers.get('If-None-Match'),
+                                             request.headers.get('If-Modified-Since'))
+            if not_modified:
+                return Response(status=304, headers=headers)
+
+            response = view(*args, **kwargs)
+            if isinstance(response, Response) and response.status_code == 200:
+                if versions.may_lag(tags):
+                    response.headers['Cache-Control'] = 'no-store'
+                else:
+                    response.headers.update(headers)
+            return response
+        return wrapper
+    return decorator
+
+
+def _accepted(accept_encoding):
+    # {coding: q} from an Accept-Encoding header
+    accepted = {}
+    for part in accept_encoding.split(','):
+        coding, _, params = part.strip().partition(';')
+        q = 1.0
+        if params.strip().startswith('q='):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        if coding:
+            accepted[coding.strip().lower()] = q
+    return accepted
+
+
+def compress(response, accept_encoding, min_size=1024, level=5):
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers or response.mimetype != 'application/json'):
+        return response
+    response.vary.add('Accept-Encoding')
+    body = response.get_data()
+    if len(body) < min_size:
+        return response
+
+    accepted = _accepted(accept_encoding or '')
+    if brotli is not None and accepted.get('br', 0) > 0 and accepted.get('br', 0) >= accepted.get('gzip', 0):
+        coding, compressed = 'br', brotli.compress(body, quality=min(level, 11))
+    elif accepted.get('gzip', 0) > 0:
+        coding, compressed = 'gzip', gzip.compress(body, compresslevel=level, mtime=0)
+    else:
+        return response
+
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = coding
+    return response
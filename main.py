@@ -1,298 +1,752 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, has_request_context, jsonify, request, stream_with_context
 from flask_cors import CORS
 import mysql.connector
 import os
+import logging
+import time
 from dotenv import load_dotenv
 from datetime import datetime
+from contextlib import contextmanager
+from db_pool import ConnectionPool, PoolTimeout
+from admission import Admission, ConcurrencyLimit, Rejected
+import film_stats
+from response_cache import ResponseCache
+from catalog import Catalog
+from film_search import FilmSearchIndex
+from customer_index import CustomerNameIndex, CHANGE_QUERY as CUSTOMER_CHANGE_QUERY
+from actor_stats import ActorStats
+from rollups import RentalRollups
+from overdue import OverdueRentals
+import write_behind
+from write_behind import RentalEventLog
+from metrics import InstrumentedCursor, Registry, SqlMetrics
+import statements
+from statements import PreparedStatements
+from replicas import ReplicaRouter
+from serializers import RowSpec, dumps, json_response, wants_columnar
+from http_cache import DataVersions, compress, conditional
 
 load_dotenv()
 
 app = Flask(__name__)
 CORS(app)
 
-def create_connection():
+def create_connection(host="localhost", port=3306):
     return mysql.connector.connect(
-        host="localhost",
+        host=host,
         user="root",
         password=os.getenv('MYSQL_DB_PASSWORD'),
         database="sakila",
-        port=3306,
+        port=port,
         ssl_disabled=True,
         autocommit=False,
         connection_timeout=10
     )
 
 
-def fetch_all(query, params=None):
-    normalized_params = params if params is not None else ()
-    last_error = None
-
-    for _ in range(2):
-        conn = None
-        cursor = None
+pool_settings = dict(
+    pool_size=int(os.getenv('MYSQL_POOL_SIZE', 5)),
+    max_overflow=int(os.getenv('MYSQL_POOL_MAX_OVERFLOW', 10)),
+    pool_timeout=float(os.getenv('MYSQL_POOL_TIMEOUT', 10)),
+    idle_timeout=float(os.getenv('MYSQL_POOL_IDLE_TIMEOUT', 300)),
+    ping_interval=float(os.getenv('MYSQL_POOL_PING_INTERVAL', 30))
+)
+pool = ConnectionPool(create_connection, **pool_settings)
+
+#Errors meaning the database cannot take the request right now (pool exhausted, too many
+#connections, server unreachable); routes answer them with 503 instead of blaming the input
+DATABASE_UNAVAILABLE = (PoolTimeout, mysql.connector.InterfaceError, mysql.connector.OperationalError)
+
+
+#Read replicas, e.g. MYSQL_REPLICAS=10.0.0.2:3306,10.0.0.3:3306. fetch_all reads from them
+#(MYSQL_REPLICA_STRATEGY=round_robin|least_latency); writes and transactions stay on the primary.
+#After a client writes, its reads go to the primary for READ_YOUR_WRITES_SECONDS.
+def replica_pool(address):
+    host, _, port = address.partition(':')
+    return address, ConnectionPool(lambda: create_connection(host, int(port or 3306)), **pool_settings)
+
+
+replica_router = ReplicaRouter(
+    [replica_pool(address.strip()) for address in os.getenv('MYSQL_REPLICAS', '').split(',') if address.strip()],
+    strategy=os.getenv('MYSQL_REPLICA_STRATEGY', 'round_robin'),
+    sticky_seconds=float(os.getenv('READ_YOUR_WRITES_SECONDS', 5))
+)
+PRIMARY_READS_COOKIE = 'primary_reads_until'
+
+
+def client_key():
+    return request.headers.get('X-Client-Id') or request.remote_addr
+
+
+def note_write():
+    #Remember that this request wrote, so its own reads and the client's next ones use the primary
+    if has_request_context():
+        g.wrote = True
+
+
+def reads_pinned_to_primary():
+    if not has_request_context():
+        return False
+    if g.get('wrote'):
+        return True
+    if not replica_router.replicas:
+        return False
+    #The cookie is client-controlled: a value further ahead than this server ever sets is ignored
+    until = request.cookies.get(PRIMARY_READS_COOKIE, type=float)
+    now = time.time()
+    if until is not None and now < until <= now + replica_router.sticky_seconds:
+        return True
+    return replica_router.is_pinned(client_key())
+
+
+#Instrumentation, exported on /metrics. METRICS_ENABLED=0 turns it off; SLOW_QUERY_MS=<ms>
+#logs statements slower than the threshold with their normalized text and parameters.
+metrics_enabled = os.getenv('METRICS_ENABLED', '1') != '0'
+metrics_registry = Registry()
+sql_metrics = SqlMetrics(
+    metrics_registry,
+    slow_query_seconds=float(os.getenv('SLOW_QUERY_MS')) / 1000 if os.getenv('SLOW_QUERY_MS') else None
+)
+request_seconds = metrics_registry.histogram(
+    'http_request_seconds', 'Request latency per route', ('route', 'method', 'status'))
+pool_acquire_seconds = metrics_registry.histogram(
+    'db_pool_acquire_seconds', 'Time spent waiting for a pooled connection')
+request_statements = metrics_registry.histogram(
+    'http_request_sql_statements', 'SQL statements executed per request', ('route',),
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100))
+if metrics_enabled:
+    pool.on_acquire = pool_acquire_seconds.observe
+
+
+def count_request_statement():
+    if has_request_context():
+        g.sql_statements = g.get('sql_statements', 0) + 1
+
+sql_metrics.on_statement = count_request_statement
+
+
+#Registered statements (see statements.py) run as server-side prepared statements, cached per pooled
+#connection up to PREPARED_STATEMENTS_PER_CONNECTION; PREPARED_STATEMENTS=0 sends everything as text.
+#At startup every registered statement is EXPLAINed: STATEMENT_CHECK=warn logs problems, strict refuses
+#to start on a statement that does not match the schema, off skips the check. Full scans of tables
+#smaller than STATEMENT_CHECK_MIN_ROWS are not reported.
+prepared_statements = PreparedStatements(
+    max_per_connection=int(os.getenv('PREPARED_STATEMENTS_PER_CONNECTION', 64))
+) if os.getenv('PREPARED_STATEMENTS', '1') != '0' else None
+statement_check = os.getenv('STATEMENT_CHECK', 'warn')
+statement_check_min_rows = int(os.getenv('STATEMENT_CHECK_MIN_ROWS', 1000))
+statement_log = logging.getLogger('sakila.statements')
+
+
+def open_cursor(conn, **kwargs):
+    cursor = conn.cursor(**kwargs)
+    return InstrumentedCursor(cursor, sql_metrics) if metrics_enabled else cursor
+
+
+def fetch_rows(connection_pool, query, params):
+    statement = statements.lookup(query) if prepared_statements is not None else None
+    with connection_pool.connection() as conn:
+        if statement is not None:
+            #The prepared cursor stays open on the connection for the next borrower
+            cursor = prepared_statements.cursor(conn, statement)
+            if metrics_enabled:
+                cursor = InstrumentedCursor(cursor, sql_metrics)
+            try:
+                cursor.execute(statement.sql, params)
+                return cursor.fetchall()
+            except mysql.connector.Error:
+                prepared_statements.forget(conn, statement)
+                raise
+        cursor = open_cursor(conn)
         try:
-            conn = create_connection()
-            cursor = conn.cursor()
-            cursor.execute(query, normalized_params)
+            cursor.execute(query, params)
             return cursor.fetchall()
-        except (mysql.connector.InterfaceError, mysql.connector.OperationalError) as error:
-            last_error = error
         finally:
-            if cursor is not None:
-                try:
-                    cursor.close()
-                except mysql.connector.Error:
-                    pass
-            if conn is not None:
-                try:
-                    conn.close()
-                except mysql.connector.Error:
-                    pass
+            cursor.close()
 
-    raise last_error
+
+def fetch_all(query, params=None, primary=False):
+    normalized_params = params if params is not None else ()
+
+    replica = None
+    if replica_router.replicas and not primary and not reads_pinned_to_primary():
+        replica = replica_router.pick()
+    if replica is not None:
+        started = time.perf_counter()
+        try:
+            rows = fetch_rows(replica.pool, query, normalized_params)
+        except DATABASE_UNAVAILABLE:
+            #Replica unreachable; it is skipped for a while and this read goes to the primary
+            replica_router.done(replica, failed=True)
+        except BaseException:
+            replica_router.done(replica)
+            raise
+        else:
+            replica_router.done(replica, time.perf_counter() - started)
+            if has_request_context():
+                g.replica_reads = True
+            return rows
+    if replica_router.replicas:
+        replica_router.count_primary_read()
+    try:
+        return fetch_rows(pool, query, normalized_params)
+    except (mysql.connector.InterfaceError, mysql.connector.OperationalError):
+        #The primary restarted or failed over, which the pool only notices for connections idle longer
+        #than its ping interval. The other idle connections went with it; retry once on a fresh one.
+        pool.close_all()
+        return fetch_rows(pool, query, normalized_params)
+
+
+def fetch_from_primary(query, params=None):
+    return fetch_all(query, params, primary=True)
 
 
 def execute_write(query, params=None):
     normalized_params = params if params is not None else ()
-    last_error = None
 
-    for _ in range(2):
-        conn = None
-        cursor = None
+    with pool.connection() as conn:
+        cursor = open_cursor(conn)
         try:
-            conn = create_connection()
-            cursor = conn.cursor()
             cursor.execute(query, normalized_params)
             conn.commit()
+            note_write()
             return cursor.lastrowid
-        except (mysql.connector.InterfaceError, mysql.connector.OperationalError) as error:
-            last_error = error
-            if conn is not None and conn.is_connected():
-                conn.rollback()
         finally:
-            if cursor is not None:
-                try:
-                    cursor.close()
-                except mysql.connector.Error:
-                    pass
-            if conn is not None:
-                try:
-                    conn.close()
-                except mysql.connector.Error:
-                    pass
-
-    raise last_error
+            cursor.close()
+
+
+def stream_rows(query, params=None, batch_size=500):
+    #Unbuffered cursor, so only one batch of rows is held in memory at a time
+    normalized_params = params if params is not None else ()
+
+    with pool.connection() as conn:
+        cursor = open_cursor(conn, buffered=False)
+        try:
+            cursor.execute(query, normalized_params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            cursor.close()
+
+
+@contextmanager
+def transaction(isolation_level=None, client_write=True):
+    #Yields a cursor on one pooled connection; commits on success, rolls back on error.
+    #client_write=False is for bookkeeping writes (e.g. rollup syncs) that should not pin the client to the primary.
+    with pool.connection() as conn:
+        conn.start_transaction(isolation_level=isolation_level)
+        cursor = open_cursor(conn)
+        try:
+            yield cursor
+            conn.commit()
+            if client_write:
+                note_write()
+        finally:
+            cursor.close()
+
+
+def allocate_inventory(cursor, film_id):
+    #Lock one copy of the film that has no open rental. Copies already locked by a
+    #concurrent renter are skipped rather than waited on. The anti-join reads a
+    #statement snapshot, so the open-rental check is repeated as a locking read
+    #that sees the latest committed rentals before the copy is handed out.
+    skipped = []
+    while True:
+        exclude = ''.join(' and i.inventory_id <> %s' for _ in skipped)
+        cursor.execute(
+            f"""select i.inventory_id from sakila.inventory i
+                where i.film_id = %s{exclude}
+                and not exists (
+                    select 1 from sakila.rental r
+                    where r.inventory_id = i.inventory_id and r.return_date is null
+                )
+                order by i.inventory_id
+                limit 1
+                for update skip locked;""",
+            (film_id, *skipped)
+        )
+        row = cursor.fetchone()
+        if row is None:
+            return None
+
+        cursor.execute(
+            """select rental_id from sakila.rental
+                where inventory_id = %s and return_date is null
+                limit 1 for share;""",
+            (row[0],)
+        )
+        if cursor.fetchone() is None:
+            return row[0]
+        skipped.append(row[0])
+
+
+def allocate_inventory_batch(cursor, film_counts):
+    #Batched form of allocate_inventory; film_counts maps film_id -> copies wanted.
+    #Returns film_id -> list of locked, free inventory ids (possibly fewer than wanted).
+    #Each film locks at most as many copies as it needs, so the other free copies stay
+    #available to concurrent renters. Copies this transaction already holds are not
+    #skipped by skip locked, hence the exclusion list.
+    allocated = {}
+    for film_id in sorted(film_counts):
+        copies = []
+        seen = []
+        while len(copies) < film_counts[film_id]:
+            exclude = ''.join(' and i.inventory_id <> %s' for _ in seen)
+            cursor.execute(
+                f"""select i.inventory_id from sakila.inventory i
+                    where i.film_id = %s{exclude}
+                    and not exists (
+                        select 1 from sakila.rental r
+                        where r.inventory_id = i.inventory_id and r.return_date is null
+                    )
+                    order by i.inventory_id
+                    limit %s
+                    for update skip locked;""",
+                (film_id, *seen, film_counts[film_id] - len(copies))
+            )
+            candidates = [row[0] for row in cursor.fetchall()]
+            if not candidates:
+                break
+
+            placeholders = ', '.join(['%s'] * len(candidates))
+            cursor.execute(
+                f"""select inventory_id from sakila.rental
+                    where inventory_id in ({placeholders}) and return_date is null
+                    for share;""",
+                tuple(candidates)
+            )
+            rented = {row[0] for row in cursor.fetchall()}
+            copies.extend(inventory_id for inventory_id in candidates if inventory_id not in rented)
+            seen.extend(candidates)
+        if copies:
+            allocated[film_id] = copies
+    return allocated
+
+
+#Names are resolved against the table, not the name index: the index lags behind renames and new
+#customers made through other workers by up to CUSTOMER_INDEX_REFRESH_SECONDS
+ACTIVE_CUSTOMERS_BY_NAME = statements.register('active_customers_by_name', """select customer_id, first_name, last_name
+                                           from sakila.customer
+                                           where first_name = %s and last_name = %s and active = 1
+                                           order by customer_id;""", explain_params=('MARY', 'SMITH'))
+
+
+def active_customers_named(cursor, first_name, last_name):
+    #(customer_id, first_name, last_name) of the active customers with exactly this name,
+    #read inside the caller's transaction
+    cursor.execute(ACTIVE_CUSTOMERS_BY_NAME, (first_name, last_name))
+    return cursor.fetchall()
+
+
+#The top 5 rented films only change when rentals or the catalog change
+#Clients pinned to the primary skip it, so they never get an answer computed from a lagging replica.
+#For READ_YOUR_WRITES_SECONDS after a write, answers computed from a replica are not stored either.
+response_cache = ResponseCache(
+    max_entries=int(os.getenv('RESPONSE_CACHE_SIZE', 256)),
+    bypass=reads_pinned_to_primary,
+    lag_window=replica_router.sticky_seconds if replica_router.replicas else 0,
+    replica_read=lambda: g.get('replica_reads', False)
+)
+
+#The in-memory indexes compare a change fingerprint with the data they loaded, so both must
+#come from the same server; they read from the primary.
+#Film, actor, category and language data is served from an in-memory catalog snapshot, re-checked every
+#CATALOG_REFRESH_SECONDS. With CATALOG_SNAPSHOT=<path> the snapshot is also kept in that file and
+#workers map it at startup instead of reading the tables, as long as it is still current.
+#A rebuilt snapshot drops the cached responses tagged 'catalog'.
+catalog = Catalog(
+    fetch_from_primary,
+    snapshot_path=os.getenv('CATALOG_SNAPSHOT'),
+    refresh_interval=float(os.getenv('CATALOG_REFRESH_SECONDS', 60)),
+    on_refresh=lambda: data_changed('catalog')
+)
+film_index = FilmSearchIndex(catalog)
+customer_index = CustomerNameIndex(fetch_from_primary, refresh_interval=float(os.getenv('CUSTOMER_INDEX_REFRESH_SECONDS', 30)))
+#Actor leaderboard and per-film rental counts; new rentals are folded in every ACTOR_STATS_SYNC_SECONDS
+#and the counts are rebuilt from the rental table every ACTOR_STATS_REBUILD_SECONDS
+actor_stats = ActorStats(
+    fetch_from_primary,
+    catalog,
+    sync_interval=float(os.getenv('ACTOR_STATS_SYNC_SECONDS', 5)),
+    rebuild_interval=float(os.getenv('ACTOR_STATS_REBUILD_SECONDS', 3600))
+)
+#Rentals per day, store and film for /api/analytics; synced from new rental ids every ROLLUP_SYNC_SECONDS.
+#A gap in the rental ids holds the sync back for up to ROLLUP_GAP_GRACE_SECONDS, in case the insert commits late.
+rollups = RentalRollups(
+    lambda: transaction(client_write=False),
+    fetch_from_primary,
+    sync_interval=float(os.getenv('ROLLUP_SYNC_SECONDS', 5)),
+    chunk_size=int(os.getenv('ROLLUP_CHUNK_SIZE', 50000)),
+    gap_grace=float(os.getenv('ROLLUP_GAP_GRACE_SECONDS', 30))
+)
+#Open rentals by due date for /api/overdue, kept current by a background thread
+overdue_rentals = OverdueRentals(
+    fetch_from_primary,
+    sync_interval=float(os.getenv('OVERDUE_SYNC_SECONDS', 5)),
+    rebuild_interval=float(os.getenv('OVERDUE_REBUILD_SECONDS', 3600))
+)
+
+#Data versions behind the ETag / Last-Modified of read routes. SQL fingerprints are re-checked at most
+#every DATA_VERSION_CHECK_SECONDS; routes answered from an in-memory index use the index's own version.
+#For READ_YOUR_WRITES_SECONDS after a version changes, bodies read from a replica get no ETag.
+RENTALS_CHANGE_QUERY = statements.register('rentals_change', """select (select max(rental_id) from sakila.rental),
+                                 (select sum(rental_count) from sakila.film_stats),
+                                 (select sum(checked_out) from sakila.film_stats);""", full_scan_ok=True)
+data_versions = DataVersions(fetch_from_primary, {
+    'rentals': RENTALS_CHANGE_QUERY,
+    'customers': CUSTOMER_CHANGE_QUERY,
+    'catalog': catalog.version,
+    'film_index': film_index.version,
+    'customer_index': customer_index.version,
+    'actor_stats': actor_stats.version,
+    'rollups': rollups.version,
+}, check_interval=float(os.getenv('DATA_VERSION_CHECK_SECONDS', 5)),
+    lag_window=replica_router.sticky_seconds if replica_router.replicas else 0,
+    replica_read=lambda: g.get('replica_reads', False))
+
+
+def data_changed(*tags):
+    #Called by the write routes once their transaction committed
+    response_cache.invalidate(*tags)
+    data_versions.touch(*tags)
+
+
+#Connection pool counters, used to tune MYSQL_POOL_SIZE / MYSQL_POOL_MAX_OVERFLOW
+@app.route('/api/poolstats', methods=['GET'])
+def get_pool_stats():
+    return jsonify(pool.stats())
+
+@app.route('/api/replicastats', methods=['GET'])
+def get_replica_stats():
+    return jsonify(replica_router.stats())
+
+@app.route('/api/cachestats', methods=['GET'])
+def get_cache_stats():
+    stats = response_cache.stats()
+    stats['data_versions'] = data_versions.stats()
+    stats['catalog'] = catalog.stats()
+    stats['rollups'] = rollups.stats()
+    stats['overdue'] = overdue_rentals.stats()
+    if prepared_statements is not None:
+        stats['prepared_statements'] = prepared_statements.stats()
+    return jsonify(stats)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    started = g.pop('request_started', None)
+    if metrics_enabled and started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        request_seconds.observe(time.perf_counter() - started, route, request.method, str(response.status_code))
+        request_statements.observe(g.pop('sql_statements', 0), route)
+    if g.get('wrote') and replica_router.replicas:
+        replica_router.mark_write(client_key())
+        response.set_cookie(PRIMARY_READS_COOKIE, f'{time.time() + replica_router.sticky_seconds:.3f}',
+                            max_age=int(replica_router.sticky_seconds) + 1, httponly=True, samesite='Lax')
+    return response
+
+#gzip (or brotli, when installed) for JSON bodies of at least COMPRESS_MIN_BYTES; COMPRESSION_ENABLED=0 turns it off
+compression_enabled = os.getenv('COMPRESSION_ENABLED', '1') != '0'
+compress_min_bytes = int(os.getenv('COMPRESS_MIN_BYTES', 1024))
+compress_level = int(os.getenv('COMPRESS_LEVEL', 5))
+compressed_bytes = metrics_registry.counter(
+    'http_compressed_bytes_total', 'Response bytes before and after compression', ('encoding', 'stage'))
+
+@app.after_request
+def compress_response(response):
+    if not compression_enabled:
+        return response
+    original_length = response.calculate_content_length()
+    compress(response, request.headers.get('Accept-Encoding'), compress_min_bytes, compress_level)
+    encoding = response.headers.get('Content-Encoding')
+    if metrics_enabled and encoding and original_length is not None:
+        compressed_bytes.inc(encoding, 'in', amount=original_length)
+        compressed_bytes.inc(encoding, 'out', amount=response.calculate_content_length())
+    return response
+
+#Admission control (see admission.py). Requests are classed as reads, aggregates or writes and each
+#class runs at most ADMISSION_<CLASS>_CONCURRENCY requests at once; up to ADMISSION_QUEUE_SIZE more
+#wait ADMISSION_QUEUE_TIMEOUT seconds for a slot, the rest get 503. RATE_LIMIT_PER_SECOND (0 = off)
+#and RATE_LIMIT_BURST limit each client address; RATE_LIMIT_KEY=client keys on X-Client-Id instead,
+#for trusted callers behind a proxy. ADMISSION_CONTROL=0 turns it all off.
+admission_queue_size = int(os.getenv('ADMISSION_QUEUE_SIZE', 16))
+admission_queue_timeout = float(os.getenv('ADMISSION_QUEUE_TIMEOUT', 0.5))
+admission = Admission(
+    {
+        'read': ConcurrencyLimit(int(os.getenv('ADMISSION_READ_CONCURRENCY', pool.pool_size + pool.max_overflow)),
+                                 admission_queue_size, admission_queue_timeout),
+        'aggregate': ConcurrencyLimit(int(os.getenv('ADMISSION_AGGREGATE_CONCURRENCY', max(1, pool.pool_size // 2))),
+                                      admission_queue_size, admission_queue_timeout),
+        'write': ConcurrencyLimit(int(os.getenv('ADMISSION_WRITE_CONCURRENCY', pool.pool_size)),
+                                  admission_queue_size, admission_queue_timeout),
+    },
+    rate=float(os.getenv('RATE_LIMIT_PER_SECOND', 0)),
+    burst=int(os.getenv('RATE_LIMIT_BURST', 0)) or None
+) if os.getenv('ADMISSION_CONTROL', '1') != '0' else None
+rate_limit_key = os.getenv('RATE_LIMIT_KEY', 'address')
+
+#Endpoints that scan rollups or many rows per request; other GETs are reads, other methods writes
+AGGREGATE_ENDPOINTS = {'get_rental_trends', 'get_top_rentals'}
+#Monitoring stays reachable under overload
+UNLIMITED_ENDPOINTS = {'get_metrics', 'get_pool_stats', 'get_replica_stats', 'get_cache_stats', 'get_admission_stats'}
+
+
+def route_class():
+    if request.endpoint in AGGREGATE_ENDPOINTS:
+        return 'aggregate'
+    return 'read' if request.method in ('GET', 'HEAD') else 'write'
+
+
+def retry_later(message, status, retry_after):
+    response = jsonify({'error': message})
+    response.headers['Retry-After'] = str(retry_after)
+    return response, status
+
+
+def database_unavailable():
+    return retry_later('The database is busy. Please retry shortly.', 503, 1)
+
+@app.before_request
+def admit_request():
+    if admission is None or request.method == 'OPTIONS' or request.endpoint in UNLIMITED_ENDPOINTS \
+            or request.endpoint is None:
+        return None
+    client = client_key() if rate_limit_key == 'client' else request.remote_addr
+    requested_class = route_class()
+    try:
+        admission.admit(client, requested_class)
+    except Rejected as e:
+        message = 'Too many requests.' if e.status == 429 else 'The server is busy. Please retry shortly.'
+        return retry_later(message, e.status, e.retry_after)
+    g.admission_class = requested_class
+    return None
+
+@app.teardown_request
+def release_admission(error=None):
+    #A streamed response gives its slot back once the view returned; the stream then only holds its connection
+    requested_class = g.pop('admission_class', None)
+    if requested_class is not None:
+        admission.release(requested_class)
+
+@app.errorhandler(PoolTimeout)
+@app.errorhandler(mysql.connector.InterfaceError)
+@app.errorhandler(mysql.connector.OperationalError)
+def handle_database_unavailable(error):
+    return database_unavailable()
+
+@app.route('/api/admissionstats', methods=['GET'])
+def get_admission_stats():
+    return jsonify(admission.stats() if admission is not None else {})
+
+def collect_admission_stats():
+    if admission is None:
+        return []
+    classes = admission.stats()['classes']
+    samples = []
+    for name, kind, help_text in (('active', 'gauge', 'Requests running per route class'),
+                                  ('waiting', 'gauge', 'Requests queued for a slot per route class'),
+                                  ('limit', 'gauge', 'Concurrent requests allowed per route class'),
+                                  ('admitted', 'counter', 'Requests admitted per route class'),
+                                  ('queued', 'counter', 'Requests that waited for a slot per route class'),
+                                  ('queue_time', 'counter', 'Seconds spent waiting for a slot per route class')):
+        metric = f'http_admission_{name}' if kind == 'gauge' else f'http_admission_{name}_total'
+        samples.append((metric, kind, help_text,
+                        [({'class': route_class}, values[name]) for route_class, values in classes.items()]))
+    samples.append(('http_admission_rejected_total', 'counter', 'Requests turned away per route class and reason',
+                    [({'class': route_class, 'reason': reason}, values[f'rejected_{reason}'])
+                     for route_class, values in classes.items()
+                     for reason in ('rate_limited', 'queue_full', 'queue_timeout')]))
+    return samples
+
+metrics_registry.collector(collect_admission_stats)
+
+def collect_pool_and_cache_stats():
+    samples = []
+    for name, value in pool.stats().items():
+        kind = 'gauge' if name in ('pool_size', 'max_overflow', 'open', 'idle', 'checked_out', 'overflow') else 'counter'
+        metric = f'db_pool_{name}' if kind == 'gauge' else f'db_pool_{name}_total'
+        samples.append((metric, kind, f'Connection pool {name}', [({}, value)]))
+    for name, value in response_cache.stats().items():
+        kind = 'gauge' if name in ('entries', 'max_entries', 'hit_ratio') else 'counter'
+        metric = f'response_cache_{name}' if kind == 'gauge' else f'response_cache_{name}_total'
+        samples.append((metric, kind, f'Response cache {name}', [({}, value)]))
+    if replica_router.replicas:
+        routing = replica_router.stats()
+        samples.append(('db_primary_reads_total', 'counter', 'fetch_all reads served by the primary',
+                        [({}, routing['primary_reads'])]))
+        for name, kind in (('reads', 'counter'), ('failures', 'counter'), ('inflight', 'gauge')):
+            metric = f'db_replica_{name}_total' if kind == 'counter' else f'db_replica_{name}'
+            samples.append((metric, kind, f'Read replica {name}',
+                            [({'replica': replica}, values[name]) for replica, values in routing['replicas'].items()]))
+    if prepared_statements is not None:
+        for name, value in prepared_statements.stats().items():
+            kind = 'gauge' if name in ('connections', 'statements') else 'counter'
+            metric = f'db_prepared_{name}' if kind == 'gauge' else f'db_prepared_{name}_total'
+            samples.append((metric, kind, f'Prepared statements {name}', [({}, value)]))
+    return samples
+
+metrics_registry.collector(collect_pool_and_cache_stats)
+
+#Prometheus scrape endpoint
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
 
 '''
 Landing Page (index.html)
 '''
+#Column specs for the JSON written by the routes below; rows stay tuples until they are encoded
+TOP_RENTED = RowSpec('top_rented', [('film_id', 'int'), ('title', 'str'), ('rental_count', 'int'),
+                                    ('available_copies', 'int')])
+TOP_ACTORS = RowSpec('top_actors', [('actor_id', 'int'), ('name', 'str'), ('movies', 'int')])
+ACTOR_FILMS = RowSpec('actor_films', [('actor_id', 'int'), ('first_name', 'str'), ('last_name', 'str'),
+                                      ('film_id', 'int'), ('title', 'str'), ('rental_count', 'int')])
+FILM_SEARCH = RowSpec('film_search', [('film_id', 'int'), ('title', 'str'), ('description', 'str'),
+                                      ('release_year', 'int'), ('rating', 'str'), ('categories', 'str'),
+                                      ('actors', 'str'), ('available_copies', 'int')])
+FILM_DETAILS = RowSpec('film_details', [('film_id', 'int'), ('title', 'str'), ('description', 'str'),
+                                        ('release_year', 'int'), ('language_id', 'int'),
+                                        ('original_language_id', 'int'), ('rental_duration', 'int'),
+                                        ('rental_rate', 'decimal'), ('length', 'int'),
+                                        ('replacement_cost', 'decimal'), ('rating', 'str'),
+                                        ('special_features', 'set'), ('last_update', 'datetime'),
+                                        ('language', 'str')])
+CUSTOMER = RowSpec('customer', [('customer_id', 'int'), ('store_id', 'int'), ('first_name', 'str'),
+                                ('last_name', 'str'), ('email', 'str'), ('address', 'int'), ('active', 'bool'),
+                                ('create_date', 'datetime'), ('last_update', 'datetime')])
+RENTAL_HISTORY = RowSpec('rental_history', [('rental_id', 'int'), ('film_id', 'int'), ('title', 'str'),
+                                            ('rental_date', 'datetime'), ('return_date', 'datetime')])
+
 #Feature 1: As a user I want to view top 5 rented films of all times
+TOP_RENTED_QUERY = statements.register('top5rented', """
+        select f.film_id,
+               f.title,
+               fs.rental_count,
+               fs.total_copies - fs.checked_out as available_copies
+        from sakila.film_stats fs
+        join sakila.film f on fs.film_id = f.film_id
+        where fs.rental_count > 0
+        order by fs.rental_count desc limit 5;
+    """)
+
 @app.route('/api/top5rented', methods=['GET'])
+@conditional(data_versions, ('rentals', 'catalog'))
+@response_cache.cached(ttl=60, tags=('rentals', 'catalog'))
 def get_top_five_rented():
     #run sql query
     #store in results
-    results = fetch_all("""
-        select f.film_id,
-               f.title,
-               count(f.film_id) as rental_count,
-               coalesce(inv.total_copies, 0) - coalesce(active.checked_out, 0) as available_copies
-        from sakila.rental r
-        join sakila.inventory i on r.inventory_id = i.inventory_id
-        join sakila.film f on i.film_id = f.film_id
-        left join (
-            select film_id, count(*) as total_copies
-            from sakila.inventory
-            group by film_id
-        ) inv on inv.film_id = f.film_id
-        left join (
-            select i2.film_id, count(*) as checked_out
-            from sakila.rental r2
-            join sakila.inventory i2 on r2.inventory_id = i2.inventory_id
-            where r2.return_date is null
-            group by i2.film_id
-        ) active on active.film_id = f.film_id
-        group by f.film_id, f.title, inv.total_copies, active.checked_out
-        order by rental_count desc limit 5;
-    """)
+    results = fetch_all(TOP_RENTED_QUERY)
 
-    #process results into json format
-    films = []
-    for row in results:
-        films.append({
-            'film_id': row[0],
-            'title': row[1],
-            'rental_count': row[2],
-            'available_copies': row[3]
-        })
-    return jsonify(films)
+    return json_response(TOP_RENTED.encode_rows(results))
 
 #Feature 2: As a user I want to be able to click on any of the top 5 films and view its details
 #Just call get_film_details(film_id) function
 
 #Feature 3: As a user I want to be able to view top 5 actors that are part of films I have in the store
 @app.route('/api/top5actors', methods=['GET'])
+@conditional(data_versions, ('actor_stats',))
 def get_top_five_actors():
-    #run sql query
-    #store in results
-    results = fetch_all("""
-        select a.actor_id, a.first_name, a.last_name, count(fa.film_id) as movies
-        from sakila.film_actor fa 
-        join sakila.actor a on fa.actor_id = a.actor_id
-        group by a.actor_id 
-        order by movies desc limit 5;
-    """)
+    #leaderboard is precomputed from film_actor; ?n= changes how many actors are returned
+    n = min(max(request.args.get('n', 5, type=int), 1), 50)
+    results = actor_stats.top_actors(n)
 
-    #process results into json format
-    actors = []
-    for row in results:
-        actors.append({
-            'actor_id': row[0],
-            'name': row[1] + ' ' + row[2],
-            'movies': row[3]
-        })
-    return jsonify(actors)
+    return json_response(TOP_ACTORS.encode_rows([(row[0], row[1] + ' ' + row[2], row[3]) for row in results]))
 
 #Feature 4: As a user I want to be able to view the actor’s details and view their top 5 rented films
 @app.route('/api/get_actordetails', methods=['GET'])
+@conditional(data_versions, ('actor_stats',))
 def get_actor_details():
-    actor_id = request.args.get('actor_id')
+    actor_id = request.args.get('actor_id', type=int)
     if not actor_id:
         return jsonify({'error': 'Missing required query parameter: actor_id'}), 400
 
-    query = """select actor.actor_id, actor.first_name, actor.last_name, film.title, count(rental.rental_id)
-                from sakila.actor
-                join sakila.film_actor on actor.actor_id = film_actor.actor_id
-                join sakila.film on film_actor.film_id = film.film_id
-                join sakila.inventory on film.film_id = inventory.film_id
-                join sakila.rental on inventory.inventory_id = rental.inventory_id
-                where actor.actor_id = %s
-                group by film.film_id
-                order by count(film.film_id) desc limit 5;
-            """
+    #?n= number of films, ?window_days= only count rentals from the last N days
+    n = min(max(request.args.get('n', 5, type=int), 1), 50)
+    window_days = request.args.get('window_days', type=int)
+    if window_days is not None and window_days < 1:
+        return jsonify({'error': 'window_days must be a positive number of days.'}), 400
 
-    #run sql query
-    #store in results
-    results = fetch_all(query, (actor_id,))
-
-    if not results:
+    name = actor_stats.actor_name(actor_id)
+    if name is None:
         return jsonify([])
 
-    #process results into json format
-    actor_details = []
-    for row in results:
-        actor_details.append({
-            'actor_id': row[0],
-            'first_name': row[1],
-            'last_name': row[2],
-            'title': row[3],
-            'rental_count': row[4]
-        })
-
-    return jsonify(actor_details)
+    rows = [(actor_id, name[0], name[1], film_id, title, rental_count)
+            for film_id, title, rental_count in actor_stats.top_films(actor_id, n, window_days)]
+    return json_response(ACTOR_FILMS.encode_rows(rows))
 
 '''
 Films Page (films.html)
 '''
 #Feature 5: As a user I want to be able to search a film by name of film, name of an actor, or genre of the film
+FILM_AVAILABILITY = statements.template('searchfilms_availability', """select film_id,
+                    total_copies - checked_out as available_copies
+                from sakila.film_stats
+                where film_id in ({placeholders});""")
+
 @app.route('/api/searchfilms', methods=['GET'])
+@conditional(data_versions, ('film_index', 'rentals'))
 def search_films():
     search_term = request.args.get('search', '').strip()
 
     if not search_term:
         return jsonify({'error': 'Invalid search term. Please enter a valid search term.'}), 400
 
-    query = """select f.film_id,
-                    f.title,
-                    f.description,
-                    f.release_year,
-                    f.rating,
-                    group_concat(distinct c.name separator ', ') as categories,
-                    group_concat(distinct concat(a.first_name, ' ', a.last_name) separator ', ') as actors,
-                    coalesce(inv.total_copies, 0) - coalesce(active.checked_out, 0) as available_copies
-                from sakila.film f
-                join sakila.film_actor fa on f.film_id = fa.film_id
-                join sakila.actor a on fa.actor_id = a.actor_id
-                join sakila.film_category fc on f.film_id = fc.film_id
-                join sakila.category c on fc.category_id = c.category_id
-                left join (
-                    select film_id, count(*) as total_copies
-                    from sakila.inventory
-                    group by film_id
-                ) inv on inv.film_id = f.film_id
-                left join (
-                    select i2.film_id, count(*) as checked_out
-                    from sakila.rental r2
-                    join sakila.inventory i2 on r2.inventory_id = i2.inventory_id
-                    where r2.return_date is null
-                    group by i2.film_id
-                ) active on active.film_id = f.film_id
-                where f.title like %s
-                or a.first_name like %s
-                or a.last_name like %s
-                or c.name like %s
-                group by f.film_id, f.title, f.description, f.release_year, f.rating, inv.total_copies, active.checked_out;"""
-    
-    #updated to allow partial matching
-    search_term = f"%{search_term}%"
-    results = fetch_all(query, (search_term, search_term, search_term, search_term))
+    limit = min(max(request.args.get('limit', 100, type=int), 1), 1000)
+    columnar = wants_columnar(request)
+
+    #ranked film ids come from the in-memory index and film data from the catalog snapshot;
+    #only the copies available are read from the database, in one batched query
+    film_index.refresh_if_changed()
+    matches = film_index.search(search_term, limit)
+    if not matches:
+        return json_response(FILM_SEARCH.encode_rows([], columnar))
 
+    film_ids = [film_id for film_id, _ in matches]
+    available = dict(fetch_all(*FILM_AVAILABILITY.bind(film_ids)))
+
+    snapshot = catalog.snapshot()
     films = []
-    for row in results:
-        films.append({
-            'film_id': row[0],
-            'title': row[1],
-            'description': row[2],
-            'release_year': row[3],
-            'rating': row[4],
-            'categories': row[5],
-            'actors': row[6],
-            'available_copies': row[7]
-        })
-    return jsonify(films)
+    for film_id in film_ids:
+        summary = snapshot.film_summary(film_id)
+        if summary is None:
+            continue
+        films.append((film_id, *summary, ', '.join(film_index.categories_for(film_id)),
+                      ', '.join(film_index.actors_for(film_id)), available.get(film_id, 0)))
+    return json_response(FILM_SEARCH.encode_rows(films, columnar))
 
 #Feature 6: As a user I want to be able to view details of the film
+MAX_FILM_IDS = 100
 @app.route('/api/get_filmdetails', methods=['GET'])
+@conditional(data_versions, ('catalog',))
 def get_film_details():
     film_id = request.args.get('film_id')
-    if not film_id:
-        return jsonify({'error': 'Missing required query parameter: film_id'}), 400
-
-    query = """select f.film_id, f.title, f.description, f.release_year, f.language_id,
-                    f.original_language_id, f.rental_duration, f.rental_rate, f.length,
-                    f.replacement_cost, f.rating, f.special_features, f.last_update,
-                    l.name as language_name
-                from sakila.film f
-                join sakila.language l on f.language_id = l.language_id
-                where f.film_id = %s;"""
-
-    #run sql query
-    #store in results
-    results = fetch_all(query, (film_id,))
-
-    if not results:
+    film_ids = request.args.get('film_ids')
+    if not film_id and not film_ids:
+        return jsonify({'error': 'Missing required query parameter: film_id or film_ids'}), 400
+
+    #?film_ids=1,2,3 returns the films that exist, in the order asked for; both forms read the catalog snapshot
+    if film_ids:
+        parts = [part.strip() for part in film_ids.split(',') if part.strip()]
+        if not parts or not all(part.isdigit() for part in parts):
+            return jsonify({'error': 'film_ids must be a comma separated list of film ids.'}), 400
+        if len(parts) > MAX_FILM_IDS:
+            return jsonify({'error': f'At most {MAX_FILM_IDS} film_ids per request.'}), 400
+        ids = list(dict.fromkeys(int(part) for part in parts))
+        rows = catalog.snapshot().film_details(ids)
+        return json_response(FILM_DETAILS.encode_rows([rows[film_id] for film_id in ids if film_id in rows]))
+
+    row = catalog.snapshot().film_details([int(film_id)]).get(int(film_id)) if film_id.isdigit() else None
+    if row is None:
         return jsonify({'error': 'Film not found'}), 404
 
-    row = results[0]
-
-    #process results into json format
-    films = [{
-        'film_id': row[0],
-        'title': row[1],
-        'description': row[2],
-        'release_year': row[3],
-        'language_id': row[4],
-        'original_language_id': row[5],
-        'rental_duration': row[6],
-        'rental_rate': row[7],
-        'length': row[8],
-        'replacement_cost': row[9],
-        'rating': row[10],
-        'special_features': sorted(list(row[11])) if isinstance(row[11], set) else row[11], #Convert python set to json list
-        'last_update': row[12],
-        'language': row[13]
-    }]
-
-    return jsonify(films)
+    #special_features is a MySQL SET; the spec writes it as a sorted list
+    return json_response(FILM_DETAILS.encode_rows([row]))
 
 #Feature 7: As a user I want to be able to rent a film out to a customer
 @app.route('/api/rentfilm', methods=['PUT'])
@@ -311,120 +765,148 @@ def rent_film():
         if not film_id:
             return jsonify({'error': 'Missing required field: film_id.'}), 400
 
-        if customer_id:
-            customer_rows = fetch_all(
-                """select customer_id from sakila.customer where customer_id = %s and active = 1 limit 1;""",
-                (customer_id,)
-            )
-            if not customer_rows:
-                return jsonify({'error': 'Customer not found or inactive.'}), 400
-            resolved_customer_id = customer_rows[0][0]
-        else:
-            if not first_name or not last_name:
-                return jsonify({'error': 'Provide either customer_id or both first_name and last_name.'}), 400
-
-            matching_customers = fetch_all(
-                """select customer_id from sakila.customer
-                    where lower(first_name) = lower(%s)
-                    and lower(last_name) = lower(%s)
-                    and active = 1
-                    order by customer_id;""",
-                (first_name, last_name)
-            )
-
-            if not matching_customers:
-                return jsonify({'error': 'No active customer found with that first and last name.'}), 400
-
-            if len(matching_customers) > 1:
-                return jsonify({'error': 'Multiple active customers found with that name. Please use customer_id.'}), 400
+        if not customer_id and (not first_name or not last_name):
+            return jsonify({'error': 'Provide either customer_id or both first_name and last_name.'}), 400
+
+        if rental_log is not None:
+            return queue_rental(rental_date, film_id, customer_id, first_name, last_name)
+
+        # Customer check, copy selection and the insert share one transaction so
+        # two renters can never be handed the same copy. A rejection raises, which
+        # rolls the transaction back without recording a write for the client.
+        with transaction(isolation_level='READ COMMITTED') as cursor:
+            if customer_id:
+                cursor.execute(
+                    """select customer_id, first_name, last_name from sakila.customer
+                        where customer_id = %s and active = 1 limit 1;""",
+                    (customer_id,)
+                )
+                customer_rows = cursor.fetchall()
+                if not customer_rows:
+                    raise ValueError('Customer not found or inactive.')
+            else:
+                customer_rows = active_customers_named(cursor, first_name, last_name)
+                if not customer_rows:
+                    raise ValueError('No active customer found with that first and last name.')
+
+                if len(customer_rows) > 1:
+                    raise ValueError('Multiple active customers found with that name. Please use customer_id.')
 
-            resolved_customer_id = matching_customers[0][0]
-
-        inventory_rows = fetch_all("""select inventory_id from sakila.inventory where film_id = %s;""", (film_id,))
-        inventory_id = None
-        for row in inventory_rows:
-            if not fetch_all("""select rental_id from sakila.rental where inventory_id = %s and return_date is null limit 1;""", (row[0],)):
-                inventory_id = row[0]
-                break
+            resolved_customer_id = customer_rows[0][0]
+            customer_name = f"{customer_rows[0][1]} {customer_rows[0][2]}"
 
-        if inventory_id is None:
-            return jsonify({'error': 'No inventory available.'}), 400
-        
-        # Fetch customer name for message
-        customer_name_rows = fetch_all("""select first_name, last_name from sakila.customer where customer_id = %s;""", (resolved_customer_id,))
-        customer_name = f"{customer_name_rows[0][0]} {customer_name_rows[0][1]}" if customer_name_rows else "Customer"
-        
-        query = """insert into sakila.rental (rental_date, inventory_id, customer_id, return_date, staff_id)
-                   values (%s, %s, %s, NULL, 1)"""
+            inventory_id = allocate_inventory(cursor, film_id)
+            if inventory_id is None:
+                raise ValueError('No inventory available.')
 
-        execute_write(query, (
-            rental_date,
-            inventory_id,
-            resolved_customer_id
-        ))
+            cursor.execute(
+                """insert into sakila.rental (rental_date, inventory_id, customer_id, return_date, staff_id)
+                   values (%s, %s, %s, NULL, 1)""",
+                (rental_date, inventory_id, resolved_customer_id)
+            )
+            rental_id = cursor.lastrowid
+            film_stats.record_rental(cursor, film_id)
 
+        actor_stats.mark_dirty()
+        rollups.mark_dirty()
+        overdue_rentals.rented([rental_id])
+        data_changed('rentals')
         return jsonify({'message': f"Film rented successfully to {customer_name} ({resolved_customer_id})"}), 200
 
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except DATABASE_UNAVAILABLE:
+        return database_unavailable()
     except Exception:
-        return jsonify({'error': 'Error! Unable to rent film.'}), 400
+        return jsonify({'error': 'Error! Unable to rent film.'}), 500
 
 '''
 Customer Page (customer.html)
 '''
 #Feature 8: As a user I want to view a list of all customers (Pref. using pagination)
+CUSTOMER_COLUMNS = """customer_id, store_id, first_name, last_name, email, address_id, active, create_date, last_update"""
+CUSTOMER_PAGE_QUERY = statements.register('allcustomers_page', f"""select {CUSTOMER_COLUMNS}
+                            from sakila.customer
+                            where customer_id > %s
+                            order by customer_id
+                            limit %s;""", explain_params=(0, 100))
+CUSTOMER_BY_ID_QUERY = statements.register(
+    'customer_by_id', f"""select {CUSTOMER_COLUMNS} from sakila.customer where customer_id = %s;""")
+CUSTOMERS_BY_IDS = statements.template('customers_by_ids', f"""select {CUSTOMER_COLUMNS} from sakila.customer
+                                where customer_id in ({{placeholders}})
+                                order by customer_id;""")
+
+
+def customer_to_dict(row):
+    return CUSTOMER.to_dict(row)
+
+
 @app.route('/api/allcustomers', methods=['GET'])
+@conditional(data_versions, ('customers',))
 def get_all_customers():
-    #run sql query
-    #store in results
-    results = fetch_all("""select * from sakila.customer;""")
-
-    #process results into json format
-    customers = []
-    for row in results:
-        customers.append({
-            'customer_id': row[0],
-            'store_id': row[1],
-            'first_name': row[2],
-            'last_name': row[3],
-            'email': row[4],
-            'address': row[5],
-            'active': row[6] == 1,
-            'create_date': row[7],
-            'last_update': row[8]
-        })
-    return jsonify(customers)
+    stream = request.args.get('stream')
+    if 'limit' not in request.args and 'after_customer_id' not in request.args:
+        #full export: rows go from a server-side cursor straight to the client
+        return stream_customers(ndjson=(stream == 'ndjson'))
+
+    #keyset pagination: ?limit=100&after_customer_id=<last id of previous page>
+    limit = min(max(request.args.get('limit', 100, type=int), 1), 1000)
+    after_customer_id = request.args.get('after_customer_id', 0, type=int)
+
+    results = fetch_all(CUSTOMER_PAGE_QUERY, (after_customer_id, limit))
+
+    next_after_customer_id = results[-1][0] if len(results) == limit else None
+    return json_response('{"customers":' + CUSTOMER.encode_rows(results, wants_columnar(request))
+                         + ',"next_after_customer_id":' + dumps(next_after_customer_id) + '}')
+
+
+def stream_customers(ndjson=False):
+    rows = stream_rows(f"""select {CUSTOMER_COLUMNS} from sakila.customer order by customer_id;""")
+
+    def generate():
+        if ndjson:
+            for row in rows:
+                yield CUSTOMER.encode(row) + '\n'
+            return
+        yield '['
+        first = True
+        for row in rows:
+            yield ('' if first else ',') + CUSTOMER.encode(row)
+            first = False
+        yield ']'
+
+    mimetype = 'application/x-ndjson' if ndjson else 'application/json'
+    return Response(stream_with_context(generate()), mimetype=mimetype)
 
 #Feature 9: As a user I want the ability to filter/search customers by their customer id, first name or last name.
 @app.route('/api/searchcustomers', methods=['GET'])
+@conditional(data_versions, ('customer_index', 'customers'))
 def search_customers():
     search_term = request.args.get('search', '').strip()
 
     if not search_term:
         return jsonify({'error': 'Invalid search term. Please enter a valid search term.'}), 400
 
-    query = """select customer_id, store_id, first_name, last_name, email, address_id, active, create_date, last_update
-                from sakila.customer
-                where cast(customer_id as char) like %s
-                or lower(first_name) like lower(%s)
-                or lower(last_name) like lower(%s);"""
-
-    search_term = f"%{search_term}%"
-    results = fetch_all(query, (search_term, search_term, search_term))
-
-    customers = []
-    for row in results:
-        customers.append({
-            'customer_id': row[0],
-            'store_id': row[1],
-            'first_name': row[2],
-            'last_name': row[3],
-            'email': row[4],
-            'address': row[5],
-            'active': row[6] == 1,
-            'create_date': row[7],
-            'last_update': row[8]
-        })
-    return jsonify(customers)
+    limit = min(max(request.args.get('limit', 100, type=int), 1), 500)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    columnar = wants_columnar(request)
+
+    #a numeric term is a customer id: primary key lookup
+    if search_term.isdigit():
+        results = fetch_all(CUSTOMER_BY_ID_QUERY, (int(search_term),))
+        return json_response(CUSTOMER.encode_rows(results[offset:offset + limit], columnar),
+                             headers={'X-Total-Count': str(len(results))})
+
+    #names go through the in-memory prefix index, then one batched query
+    customer_index.refresh_if_changed()
+    customer_ids = customer_index.search(search_term)
+    page_ids = customer_ids[offset:offset + limit]
+
+    results = []
+    if page_ids:
+        results = fetch_all(*CUSTOMERS_BY_IDS.bind(page_ids))
+
+    return json_response(CUSTOMER.encode_rows(results, columnar), headers={'X-Total-Count': str(len(customer_ids))})
 
 #Feature 10: As a user I want to be able to add a new customer
 @app.route('/api/addcustomer', methods=['POST'])
@@ -437,6 +919,11 @@ def add_customer():
             if field not in data:
                 return jsonify({'error': f'Missing required field: {field}'}), 400
 
+        # the name index is updated after the insert committed, so check what it needs first
+        for field in ['first_name', 'last_name']:
+            if not isinstance(data[field], str) or not data[field].strip():
+                return jsonify({'error': f'Invalid input for {field}.'}), 400
+
         store_id = data.get('store_id', 1)
         
         create_date = data.get('create_date', datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
@@ -452,11 +939,15 @@ def add_customer():
             data['address_id'],
             create_date
         ))
+        customer_index.add(last_row_id, data['first_name'], data['last_name'])
+        data_changed('customers')
         
         return jsonify({
             'message': 'Customer added successfully',
             'customer_id': last_row_id
         }), 201
+    except DATABASE_UNAVAILABLE:
+        return database_unavailable()
     except Exception as e:
         return jsonify({'error': 'Error adding customer. Please try again.'}), 500
 
@@ -471,6 +962,11 @@ def edit_customer():
             return jsonify({'error': 'Missing required field: customer_id'}), 400
             
         customer_id = data['customer_id']
+        if not str(customer_id).isdigit():
+            return jsonify({'error': 'Invalid input for customer_id.'}), 400
+        for field in ['first_name', 'last_name']:
+            if field in data and (not isinstance(data[field], str) or not data[field].strip()):
+                return jsonify({'error': f'Invalid input for {field}.'}), 400
         
         # Build dynamic query based on fields provided
         update_fields = []
@@ -490,88 +986,123 @@ def edit_customer():
         params.append(customer_id)
         
         execute_write(query, tuple(params))
+        customer_index.update(int(customer_id), data.get('first_name'), data.get('last_name'))
+        data_changed('customers')
         
         return jsonify({'message': 'Customer updated successfully', 'customer_id': customer_id}), 200
         
+    except DATABASE_UNAVAILABLE:
+        return database_unavailable()
     except Exception as e:
         return jsonify({'error': 'Error updating customer. Please try again.'}), 500
 
 #Feature 12: As a user I want to be able to delete a customer if they no longer wish to patron at store
+ACTIVE_RENTAL_QUERY = statements.register(
+    'customer_active_rental',
+    """select rental_id from sakila.rental where customer_id = %s and return_date is null limit 1;""")
+
 @app.route('/api/deletecustomer', methods=['PUT'])
 def delete_customer():
     customer_id = request.args.get('customer_id')
     if not customer_id:
         return jsonify({'error': 'Missing required query parameter: customer_id'}), 400
+    if not customer_id.isdigit():
+        return jsonify({'error': 'Invalid input for customer_id.'}), 400
 
     try:
-        active_rentals = fetch_all("""select rental_id from sakila.rental where customer_id = %s and return_date is null limit 1;""", (customer_id,))
+        active_rentals = fetch_all(ACTIVE_RENTAL_QUERY, (customer_id,), primary=True)
         if active_rentals:
             return jsonify({'error': 'Customer has active rentals. Cannot delete.'}), 400
 
         query = """delete from sakila.customer where customer_id = %s;"""
         execute_write(query, (customer_id,))
+        customer_index.remove(int(customer_id))
+        data_changed('customers')
 
         return jsonify({'message': 'Customer deleted successfully'}), 200
+    except DATABASE_UNAVAILABLE:
+        return database_unavailable()
     except Exception as e:
         return jsonify({'error': 'Error deleting customer. Please try again.'}), 500
 
+#Customer row, rental counts and one page of history in a single round trip; one registered
+#statement per history filter, with and without the before_rental_id keyset
+HISTORY_FILTERS = {'all': '', 'active': 'and r.return_date is null', 'past': 'and r.return_date is not null'}
+CUSTOMER_DETAILS_QUERY = """
+        select c.customer_id, c.store_id, c.first_name, c.last_name, c.email, c.address_id, c.active, c.create_date, c.last_update,
+               coalesce(counts.active_count, 0), coalesce(counts.past_count, 0),
+               h.rental_id, h.film_id, h.title, h.rental_date, h.return_date
+        from sakila.customer c
+        left join (
+            select customer_id, sum(return_date is null) as active_count, sum(return_date is not null) as past_count
+            from sakila.rental
+            where customer_id = %s
+            group by customer_id
+        ) counts on counts.customer_id = c.customer_id
+        left join (
+            select r.rental_id, i.film_id, f.title, r.rental_date, r.return_date
+            from sakila.rental r
+            join sakila.inventory i on r.inventory_id = i.inventory_id
+            join sakila.film f on i.film_id = f.film_id
+            where r.customer_id = %s {history_filter}{keyset_filter}
+            order by r.rental_id desc
+            limit %s
+        ) h on true
+        where c.customer_id = %s
+        order by h.rental_id desc;
+    """
+CUSTOMER_DETAILS_QUERIES = {
+    (history, keyset): statements.register(
+        f'customerdetails_{history}' + ('_keyset' if keyset else ''),
+        CUSTOMER_DETAILS_QUERY.format(history_filter=history_filter,
+                                      keyset_filter=' and r.rental_id < %s' if keyset else ''))
+    for history, history_filter in HISTORY_FILTERS.items() for keyset in (False, True)
+}
+
+def customer_details_args(args):
+    #(customer_id, history, limit, before_rental_id) from the query string; ValueError carries the 400 message.
+    #?history=all|active|past, newest first, paged with limit and before_rental_id;
+    #?summary=1 returns only the customer and the rental counts
+    customer_id = args.get('customer_id')
+    if not customer_id:
+        raise ValueError('Missing required query parameter: customer_id')
+    history = args.get('history', 'all')
+    if history not in HISTORY_FILTERS:
+        raise ValueError('Invalid history. Use all, active or past.')
+    limit = 0 if args.get('summary') in ('1', 'true') else min(max(args.get('limit', 20, type=int), 1), 100)
+    return customer_id, history, limit, args.get('before_rental_id', type=int)
+
+
+def customer_details_body(customer_row, active_count, past_count, history_rows, limit):
+    #history_rows: (rental_id, film_id, title, rental_date, return_date), newest first
+    customer_details = customer_to_dict(customer_row)
+    customer_details['active_rental_count'] = int(active_count)
+    customer_details['past_rental_count'] = int(past_count)
+
+    rentals = [RENTAL_HISTORY.to_dict(row) for row in history_rows]
+    customer_details['active_rentals'] = [rental for rental in rentals if rental['return_date'] is None]
+    customer_details['past_rentals'] = [rental for rental in rentals if rental['return_date'] is not None]
+    customer_details['next_before_rental_id'] = rentals[-1]['rental_id'] if limit and len(rentals) == limit else None
+    return dumps(customer_details)
+
 #Feature 13: As a user I want to be able to view customer details and see their past and present rental history
 @app.route('/api/get_customerdetails', methods=['GET'])
+@conditional(data_versions, ('customers', 'rentals'))
 def get_customer_details():
-    customer_id = request.args.get('customer_id')
-    if not customer_id:
-        return jsonify({'error': 'Missing required query parameter: customer_id'}), 400
+    try:
+        customer_id, history, limit, before_rental_id = customer_details_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-    # Get customer info
-    customer_query = """
-        select c.customer_id, c.store_id, c.first_name, c.last_name, c.email, c.address_id, c.active, c.create_date, c.last_update
-        from sakila.customer c
-        where c.customer_id = %s;
-    """
-    customer_results = fetch_all(customer_query, (customer_id,))
-    if not customer_results:
+    history_params = (customer_id, before_rental_id) if before_rental_id else (customer_id,)
+    query = CUSTOMER_DETAILS_QUERIES[history, bool(before_rental_id)]
+    results = fetch_all(query, (customer_id, *history_params, limit, customer_id))
+    if not results:
         return jsonify({'error': 'Customer not found'}), 404
 
-    row = customer_results[0]
-    customer_details = {
-        'customer_id': row[0],
-        'store_id': row[1],
-        'first_name': row[2],
-        'last_name': row[3],
-        'email': row[4],
-        'address': row[5],
-        'active': row[6] == 1,
-        'create_date': row[7],
-        'last_update': row[8]
-    }
-
-    # Get active rentals
-    active_rentals_query = """
-        select f.title, r.rental_id
-        from sakila.rental r
-        join sakila.inventory i on r.inventory_id = i.inventory_id
-        join sakila.film f on i.film_id = f.film_id
-        where r.customer_id = %s and r.return_date is null
-        order by r.rental_id desc;
-    """
-    active_results = fetch_all(active_rentals_query, (customer_id,))
-    active_rentals_list = [f"{row[0]} ({row[1]})" for row in active_results]
-    customer_details['active_rentals'] = ', '.join(active_rentals_list) if active_rentals_list else ''
-
-    # Get past rentals
-    past_rentals_query = """
-        select f.title, r.return_date
-        from sakila.rental r
-        join sakila.inventory i on r.inventory_id = i.inventory_id
-        join sakila.film f on i.film_id = f.film_id
-        where r.customer_id = %s and r.return_date is not null
-        order by r.return_date desc;
-    """
-    past_results = fetch_all(past_rentals_query, (customer_id,))
-    past_rentals_list = [f"{row[0]} ({str(row[1]).split()[0]})" for row in past_results]
-    customer_details['past_rentals'] = ', '.join(past_rentals_list) if past_rentals_list else ''
-
-    return jsonify(customer_details)
+    row = results[0]
+    return json_response(customer_details_body(row[:9], row[9], row[10],
+                                               [row[11:16] for row in results if row[11] is not None], limit))
 
 #Feature 14: As a user I want to be able to indicate that a customer has returned a rented movie 
 @app.route('/api/returnfilm', methods=['PUT'])
@@ -586,25 +1117,585 @@ def return_film():
         # check validity of rental_id
         if not data['rental_id'] or not data['rental_id'].isdigit():
             return jsonify({'error': 'Invalid input for rental_id.'}), 400
+
+        if rental_log is not None:
+            return queue_return(int(data['rental_id']), data['customer_id'])
         
-        # check if rental exists
-        existing_rental = fetch_all("""select rental_id from sakila.rental where rental_id = %s
-                                        and customer_id = %s
-                                        and return_date is null limit 1;""",
-                                        (data['rental_id'], data['customer_id']))
-
-        if not existing_rental:
-            return jsonify({'error': 'Rental does not exist or is already returned.'}), 400
-
-        query = """update sakila.rental set return_date = %s where rental_id = %s;"""
-        execute_write(query, (
-            datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            data['rental_id']
-        ))
+        # the return_date guard makes the update a no-op for missing or already returned rentals
+        with transaction() as cursor:
+            cursor.execute("""update sakila.rental set return_date = %s
+                              where rental_id = %s
+                              and customer_id = %s
+                              and return_date is null;""",
+                           (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), data['rental_id'], data['customer_id']))
+
+            if cursor.rowcount == 0:
+                raise ValueError('Rental does not exist or is already returned.')
 
+            film_stats.record_return(cursor, data['rental_id'])
+
+        overdue_rentals.returned([int(data['rental_id'])])
+        data_changed('rentals')
         return jsonify({'message': 'Film returned successfully'}), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except DATABASE_UNAVAILABLE:
+        return database_unavailable()
     except Exception as e:
         return jsonify({'error': 'Error returning film. Please try again.'}), 500
 
+MAX_BATCH_ITEMS = 200
+
+
+def apply_rentals(cursor, pending):
+    #pending maps any key -> (rental_date, film_id, customer_id); returns key -> outcome dict,
+    #either {'error': ...} or film_id, customer_id, inventory_id and rental_id of the new rental
+    outcomes = {}
+    pending = dict(pending)
+    active_customers = set()
+    if pending:
+        customer_ids = sorted({customer_id for _, _, customer_id in pending.values()})
+        placeholders = ', '.join(['%s'] * len(customer_ids))
+        cursor.execute(f"""select customer_id from sakila.customer
+                           where customer_id in ({placeholders}) and active = 1;""", tuple(customer_ids))
+        active_customers = {row[0] for row in cursor.fetchall()}
+
+    film_counts = {}
+    for key, (_, film_id, customer_id) in list(pending.items()):
+        if customer_id not in active_customers:
+            outcomes[key] = {'error': 'Customer not found or inactive.'}
+            del pending[key]
+            continue
+        film_counts[film_id] = film_counts.get(film_id, 0) + 1
+
+    allocated = allocate_inventory_batch(cursor, film_counts) if film_counts else {}
+
+    inserts = []
+    for key, (rental_date, film_id, customer_id) in pending.items():
+        copies = allocated.get(film_id)
+        if not copies:
+            outcomes[key] = {'error': 'No inventory available.'}
+            continue
+        inventory_id = copies.pop(0)
+        inserts.append((rental_date, inventory_id, customer_id))
+        outcomes[key] = {'film_id': film_id, 'customer_id': customer_id, 'inventory_id': inventory_id}
+
+    if inserts:
+        cursor.executemany(
+            """insert into sakila.rental (rental_date, inventory_id, customer_id, return_date, staff_id)
+               values (%s, %s, %s, NULL, 1)""",
+            inserts
+        )
+
+        #the copies are still locked by this transaction, so their open rentals are the new rows
+        placeholders = ', '.join(['%s'] * len(inserts))
+        cursor.execute(f"""select inventory_id, rental_id from sakila.rental
+                           where inventory_id in ({placeholders}) and return_date is null;""",
+                       tuple(inventory_id for _, inventory_id, _ in inserts))
+        rental_ids = dict(cursor.fetchall())
+
+        rented_counts = {}
+        for outcome in outcomes.values():
+            if 'inventory_id' in outcome:
+                outcome['rental_id'] = rental_ids.get(outcome['inventory_id'])
+                rented_counts[outcome['film_id']] = rented_counts.get(outcome['film_id'], 0) + 1
+        film_stats.record_rentals(cursor, rented_counts)
+    return outcomes
+
+
+def apply_returns(cursor, pending, return_date):
+    #pending maps any key -> (rental_id, customer_id); returns key -> outcome dict
+    outcomes = {}
+    open_rentals = {}
+    if pending:
+        rental_ids = sorted({rental_id for rental_id, _ in pending.values()})
+        placeholders = ', '.join(['%s'] * len(rental_ids))
+        cursor.execute(f"""select r.rental_id, r.customer_id, i.film_id
+                           from sakila.rental r
+                           join sakila.inventory i on r.inventory_id = i.inventory_id
+                           where r.rental_id in ({placeholders}) and r.return_date is null
+                           for update;""", tuple(rental_ids))
+        open_rentals = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+
+    returned_ids = []
+    returned_counts = {}
+    for key, (rental_id, customer_id) in pending.items():
+        rental = open_rentals.pop(rental_id, None)
+        if rental is None or rental[0] != customer_id:
+            outcomes[key] = {'error': 'Rental does not exist or is already returned.'}
+            continue
+        returned_ids.append(rental_id)
+        returned_counts[rental[1]] = returned_counts.get(rental[1], 0) + 1
+        outcomes[key] = {'rental_id': rental_id}
+
+    if returned_ids:
+        placeholders = ', '.join(['%s'] * len(returned_ids))
+        cursor.execute(f"""update sakila.rental set return_date = %s
+                           where rental_id in ({placeholders});""", (return_date, *returned_ids))
+        film_stats.record_returns(cursor, returned_counts)
+    return outcomes
+
+#Feature 15: As a user I want to rent out a stack of films in one request
+@app.route('/api/rentfilms', methods=['PUT'])
+def rent_films():
+    data = request.get_json(silent=True) or {}
+    items = data.get('rentals')
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'Missing required field: rentals (non-empty list).'}), 400
+    if len(items) > MAX_BATCH_ITEMS:
+        return jsonify({'error': f'At most {MAX_BATCH_ITEMS} rentals per request.'}), 400
+
+    #per-item validation; anything left in pending goes to the database
+    results = [None] * len(items)
+    pending = {}
+    named = {}
+    for index, item in enumerate(items):
+        item = item if isinstance(item, dict) else {}
+        if not item.get('rental_date'):
+            results[index] = {'error': 'Missing required field: rental_date.'}
+            continue
+        if not item.get('film_id'):
+            results[index] = {'error': 'Missing required field: film_id.'}
+            continue
+
+        if not str(item['film_id']).isdigit():
+            results[index] = {'error': 'Invalid input for film_id.'}
+            continue
+
+        customer_id = item.get('customer_id')
+        if customer_id and not str(customer_id).isdigit():
+            results[index] = {'error': 'Invalid input for customer_id.'}
+            continue
+        if not customer_id:
+            first_name = (item.get('first_name') or '').strip()
+            last_name = (item.get('last_name') or '').strip()
+            if not first_name or not last_name:
+                results[index] = {'error': 'Provide either customer_id or both first_name and last_name.'}
+                continue
+            #resolved against active customers inside the transaction, as in rent_film
+            named[index] = (item['rental_date'], int(item['film_id']), first_name, last_name)
+            continue
+        pending[index] = (item['rental_date'], int(item['film_id']), int(customer_id))
+
+    try:
+        with transaction(isolation_level='READ COMMITTED') as cursor:
+            for index, (rental_date, film_id, first_name, last_name) in named.items():
+                customer_rows = active_customers_named(cursor, first_name, last_name)
+                if not customer_rows:
+                    results[index] = {'error': 'No active customer found with that first and last name.'}
+                elif len(customer_rows) > 1:
+                    results[index] = {'error': 'Multiple active customers found with that name. Please use customer_id.'}
+                else:
+                    pending[index] = (rental_date, film_id, customer_rows[0][0])
+            for index, outcome in apply_rentals(cursor, pending).items():
+                results[index] = outcome
+    except DATABASE_UNAVAILABLE:
+        return database_unavailable()
+    except Exception:
+        return jsonify({'error': 'Error! Unable to rent films.'}), 500
+
+    rented = sum(1 for result in results if 'error' not in result)
+    if rented:
+        actor_stats.mark_dirty()
+        rollups.mark_dirty()
+        overdue_rentals.rented([result.get('rental_id') for result in results if 'error' not in result])
+        data_changed('rentals')
+
+    for index, result in enumerate(results):
+        result['index'] = index
+        result['status'] = 'error' if 'error' in result else 'rented'
+    return jsonify({'rented': rented, 'failed': len(results) - rented, 'results': results}), 200
+
+#Feature 16: As a user I want to return a stack of films in one request
+@app.route('/api/returnfilms', methods=['PUT'])
+def return_films():
+    data = request.get_json(silent=True) or {}
+    items = data.get('returns')
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'Missing required field: returns (non-empty list).'}), 400
+    if len(items) > MAX_BATCH_ITEMS:
+        return jsonify({'error': f'At most {MAX_BATCH_ITEMS} returns per request.'}), 400
+
+    results = [None] * len(items)
+    pending = {}
+    for index, item in enumerate(items):
+        item = item if isinstance(item, dict) else {}
+        if 'customer_id' not in item or 'rental_id' not in item:
+            results[index] = {'error': 'Missing required field: customer_id or rental_id'}
+            continue
+        invalid = next((field for field in ('rental_id', 'customer_id') if not str(item[field]).isdigit()), None)
+        if invalid is not None:
+            results[index] = {'error': f'Invalid input for {invalid}.'}
+            continue
+        pending[index] = (int(item['rental_id']), int(item['customer_id']))
+
+    try:
+        with transaction() as cursor:
+            return_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            for index, outcome in apply_returns(cursor, pending, return_date).items():
+                results[index] = outcome
+    except DATABASE_UNAVAILABLE:
+        return database_unavailable()
+    except Exception:
+        return jsonify({'error': 'Error returning films. Please try again.'}), 500
+
+    returned = sum(1 for result in results if 'error' not in result)
+    if returned:
+        overdue_rentals.returned([result['rental_id'] for result in results if 'error' not in result])
+        data_changed('rentals')
+
+    for index, result in enumerate(results):
+        result['index'] = index
+        result['status'] = 'error' if 'error' in result else 'returned'
+    return jsonify({'returned': returned, 'failed': len(results) - returned, 'results': results}), 200
+
+'''
+Write-behind mode for /api/rentfilm and /api/returnfilm (WRITE_BEHIND=1)
+'''
+#Validated rentals and returns are acknowledged with 202 once they are fsynced to the local log in
+#WRITE_BEHIND_DIR; a background committer applies them in batches of up to WRITE_BEHIND_BATCH.
+#/api/rentalevent?event_id= tells whether an event has been applied yet.
+def apply_rental_events(events):
+    #One transaction per batch; every event id is recorded with its outcome, so replaying
+    #the log after a crash skips events that were already applied
+    by_id = {event['event_id']: event for event in events}
+    with transaction(isolation_level='READ COMMITTED') as cursor:
+        placeholders = ', '.join(['%s'] * len(by_id))
+        cursor.execute(f"""select event_id, status, rental_id, error from sakila.rental_event
+                           where event_id in ({placeholders});""", tuple(by_id))
+        outcomes = {row[0]: {'status': row[1], 'rental_id': row[2], 'error': row[3]} for row in cursor.fetchall()}
+        new = [event for event_id, event in by_id.items() if event_id not in outcomes]
+
+        results = apply_rentals(cursor, {event['event_id']: (event['rental_date'], event['film_id'], event['customer_id'])
+                                         for event in new if event['kind'] == 'rent'})
+        #returns are dated when they were accepted, not when they are applied
+        returns_by_date = {}
+        for event in new:
+            if event['kind'] == 'return':
+                return_date = datetime.fromtimestamp(event['logged_at']).strftime('%Y-%m-%d %H:%M:%S')
+                returns_by_date.setdefault(return_date, {})[event['event_id']] = (event['rental_id'], event['customer_id'])
+        for return_date, pending in returns_by_date.items():
+            results.update(apply_returns(cursor, pending, return_date))
+
+        rows = []
+        for event in new:
+            result = results[event['event_id']]
+            outcome = {'status': 'failed' if 'error' in result else 'applied',
+                       'rental_id': result.get('rental_id'), 'error': result.get('error')}
+            outcomes[event['event_id']] = outcome
+            rows.append((event['event_id'], event['kind'], outcome['status'], outcome['rental_id'], outcome['error']))
+        if rows:
+            cursor.executemany("""insert into sakila.rental_event (event_id, kind, status, rental_id, error)
+                                  values (%s, %s, %s, %s, %s)""", rows)
+
+    applied = [event for event in new if outcomes[event['event_id']]['status'] == 'applied']
+    if any(event['kind'] == 'rent' for event in applied):
+        actor_stats.mark_dirty()
+        rollups.mark_dirty()
+        overdue_rentals.rented([outcomes[event['event_id']]['rental_id'] for event in applied if event['kind'] == 'rent'])
+    overdue_rentals.returned([event['rental_id'] for event in applied if event['kind'] == 'return'])
+    if applied:
+        data_changed('rentals')
+    return outcomes
+
+
+def lookup_rental_events(event_ids):
+    placeholders = ', '.join(['%s'] * len(event_ids))
+    rows = fetch_all(f"""select event_id, status, rental_id, error from sakila.rental_event
+                         where event_id in ({placeholders});""", tuple(event_ids), primary=True)
+    return {row[0]: {'status': row[1], 'rental_id': row[2], 'error': row[3]} for row in rows}
+
+
+def record_failed_rental_event(event, error):
+    execute_write("""insert ignore into sakila.rental_event (event_id, kind, status, error)
+                     values (%s, %s, 'failed', %s)""", (event['event_id'], event['kind'], error))
+
+
+rental_log = RentalEventLog(
+    os.getenv('WRITE_BEHIND_DIR', 'write_behind'),
+    apply_rental_events,
+    lookup_rental_events,
+    record_failed_rental_event,
+    batch_size=int(os.getenv('WRITE_BEHIND_BATCH', 200)),
+    flush_interval=float(os.getenv('WRITE_BEHIND_FLUSH_MS', 20)) / 1000
+) if os.getenv('WRITE_BEHIND') == '1' else None
+
+
+ACTIVE_CUSTOMER_QUERY = statements.register('queue_active_customer', """select customer_id, first_name, last_name
+                                     from sakila.customer where customer_id = %s and active = 1 limit 1;""")
+FILM_AVAILABLE_QUERY = statements.register(
+    'queue_film_available', """select total_copies - checked_out from sakila.film_stats where film_id = %s;""")
+OPEN_RENTAL_QUERY = statements.register('queue_open_rental', """select rental_id from sakila.rental
+                               where rental_id = %s and customer_id = %s and return_date is null;""")
+
+
+def queue_rental(rental_date, film_id, customer_id, first_name, last_name):
+    #Same checks as the synchronous path, against committed data plus the events still in the log
+    if not str(film_id).isdigit() or (customer_id and not str(customer_id).isdigit()):
+        return jsonify({'error': 'Invalid input for film_id or customer_id.'}), 400
+    film_id = int(film_id)
+
+    if customer_id:
+        customer_rows = fetch_all(ACTIVE_CUSTOMER_QUERY, (int(customer_id),), primary=True)
+        if not customer_rows:
+            return jsonify({'error': 'Customer not found or inactive.'}), 400
+    else:
+        customer_rows = fetch_all(ACTIVE_CUSTOMERS_BY_NAME, (first_name, last_name), primary=True)
+        if not customer_rows:
+            return jsonify({'error': 'No active customer found with that first and last name.'}), 400
+        if len(customer_rows) > 1:
+            return jsonify({'error': 'Multiple active customers found with that name. Please use customer_id.'}), 400
+
+    available = fetch_all(FILM_AVAILABLE_QUERY, (film_id,), primary=True)
+    if not available or available[0][0] - rental_log.pending_rentals(film_id) <= 0:
+        return jsonify({'error': 'No inventory available.'}), 400
+
+    resolved_customer_id = customer_rows[0][0]
+    event_id = rental_log.append('rent', rental_date=rental_date, film_id=film_id, customer_id=resolved_customer_id)
+    return jsonify({
+        'message': f"Rental to {customer_rows[0][1]} {customer_rows[0][2]} ({resolved_customer_id}) accepted",
+        'event_id': event_id,
+        'status': 'pending'
+    }), 202
+
+
+def queue_return(rental_id, customer_id):
+    if not str(customer_id).isdigit():
+        return jsonify({'error': 'Invalid input for customer_id.'}), 400
+    open_rental = fetch_all(OPEN_RENTAL_QUERY, (rental_id, int(customer_id)), primary=True)
+    if not open_rental or rental_log.return_pending(rental_id):
+        return jsonify({'error': 'Rental does not exist or is already returned.'}), 400
+
+    event_id = rental_log.append('return', rental_id=rental_id, customer_id=int(customer_id))
+    return jsonify({'message': 'Return accepted', 'event_id': event_id, 'status': 'pending'}), 202
+
+
+#Feature 17: As a user I want to know whether an accepted rental or return has been recorded
+@app.route('/api/rentalevent', methods=['GET'])
+def get_rental_event():
+    event_id = request.args.get('event_id', '').strip()
+    if not event_id:
+        return jsonify({'error': 'Missing required query parameter: event_id'}), 400
+    if rental_log is None:
+        return jsonify({'error': 'Write-behind mode is not enabled.'}), 404
+
+    outcome = rental_log.status(event_id)
+    if outcome is None:
+        return jsonify({'error': 'Unknown event_id'}), 404
+    return jsonify({'event_id': event_id, **outcome})
+
+
+def collect_rental_log_stats():
+    if rental_log is None:
+        return []
+    stats = rental_log.stats()
+    samples = []
+    for name in ('queued', 'outstanding', 'log_bytes'):
+        samples.append((f'write_behind_{name}', 'gauge', f'Write-behind log {name}', [({}, stats[name])]))
+    for name in ('appended', 'fsyncs', 'batches', 'applied', 'failed', 'replayed', 'retries', 'truncations'):
+        samples.append((f'write_behind_{name}_total', 'counter', f'Write-behind log {name}', [({}, stats[name])]))
+    return samples
+
+metrics_registry.collector(collect_rental_log_stats)
+
+'''
+Analytics (store managers)
+'''
+ANALYTICS_SERIES = RowSpec('analytics_series', [('bucket', 'str'), ('key', 'int'), ('name', 'str'),
+                                                ('rentals', 'int'), ('revenue', 'decimal')])
+ANALYTICS_TOP = RowSpec('analytics_top', [('key', 'int'), ('name', 'str'), ('rentals', 'int'),
+                                          ('revenue', 'decimal')])
+
+
+def analytics_filters():
+    #start/end (YYYY-MM-DD, inclusive), store_id, category_id; raises ValueError with a message for the client
+    filters = {}
+    for name in ('start', 'end'):
+        value = request.args.get(name)
+        if value:
+            try:
+                filters[name] = datetime.strptime(value, '%Y-%m-%d').date()
+            except ValueError:
+                raise ValueError(f'{name} must be a date in YYYY-MM-DD format.')
+    if 'start' in filters and 'end' in filters and filters['start'] > filters['end']:
+        raise ValueError('start must not be after end.')
+    for name in ('store_id', 'category_id'):
+        value = request.args.get(name)
+        if value:
+            if not value.isdigit():
+                raise ValueError(f'{name} must be a number.')
+            filters[name] = int(value)
+    return filters
+
+
+#Feature 18: As a store manager I want to see rentals and revenue per day, week or month,
+#in total or per store, category or film
+@app.route('/api/analytics/rentals', methods=['GET'])
+@conditional(data_versions, ('rollups', 'catalog'))
+def get_rental_trends():
+    bucket = request.args.get('bucket', 'day')
+    by = request.args.get('by', 'total')
+    if bucket not in ('day', 'week', 'month'):
+        return jsonify({'error': 'bucket must be day, week or month.'}), 400
+    if by not in ('total', 'store', 'category', 'film'):
+        return jsonify({'error': 'by must be total, store, category or film.'}), 400
+    try:
+        filters = analytics_filters()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    film_id = request.args.get('film_id')
+    if film_id:
+        if not film_id.isdigit():
+            return jsonify({'error': 'film_id must be a number.'}), 400
+        filters['film_id'] = int(film_id)
+    if by == 'film' and 'film_id' not in filters and 'category_id' not in filters:
+        #One series per film over the whole catalog is too large; /api/analytics/top ranks films instead
+        return jsonify({'error': 'by=film needs a film_id or category_id.'}), 400
+
+    rows = rollups.series(bucket, by, **filters)
+    return json_response(ANALYTICS_SERIES.encode_rows(
+        [(row[0].isoformat(), row[1], row[2], int(row[3]), row[4]) for row in rows],
+        columnar=wants_columnar(request)))
+
+#Feature 19: As a store manager I want to see the most rented films, categories or stores in a date range
+@app.route('/api/analytics/top', methods=['GET'])
+@conditional(data_versions, ('rollups', 'catalog'))
+def get_top_rentals():
+    by = request.args.get('by', 'film')
+    if by not in ('store', 'category', 'film'):
+        return jsonify({'error': 'by must be store, category or film.'}), 400
+    n = min(max(request.args.get('n', 10, type=int), 1), 100)
+    try:
+        filters = analytics_filters()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    rows = rollups.top(by, n, **filters)
+    return json_response(ANALYTICS_TOP.encode_rows([(row[0], row[1], int(row[2]), row[3]) for row in rows],
+                                                   columnar=wants_columnar(request)))
+
+OVERDUE = RowSpec('overdue', [('rental_id', 'int'), ('customer_id', 'int'), ('first_name', 'str'),
+                               ('last_name', 'str'), ('store_id', 'int'), ('film_id', 'int'), ('title', 'str'),
+                               ('rental_date', 'datetime'), ('due_date', 'datetime'), ('days_overdue', 'int')])
+MAX_OVERDUE_PAGE = 500
+
+#Feature 20: As a store manager I want to see the overdue rentals of a store or of a customer, most overdue first
+@app.route('/api/overdue', methods=['GET'])
+def get_overdue_rentals():
+    store_id = request.args.get('store_id', '')
+    customer_id = request.args.get('customer_id', '')
+    if not store_id and not customer_id:
+        return jsonify({'error': 'Missing required query parameter: store_id or customer_id'}), 400
+    if (store_id and not store_id.isdigit()) or (customer_id and not customer_id.isdigit()):
+        return jsonify({'error': 'store_id and customer_id must be numbers.'}), 400
+    limit = min(max(request.args.get('limit', 100, type=int), 1), MAX_OVERDUE_PAGE)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+
+    total, rows = overdue_rentals.overdue(store_id=int(store_id) if store_id else None,
+                                          customer_id=int(customer_id) if customer_id else None,
+                                          limit=limit, offset=offset)
+    body = ('{"overdue":' + OVERDUE.encode_rows(rows, columnar=wants_columnar(request))
+            + ',"total":' + str(total) + '}')
+    return json_response(body)
+
+#Feature 21: As a store manager I want to see how many rentals are overdue in each store
+@app.route('/api/overdue/counts', methods=['GET'])
+def get_overdue_counts():
+    counts = overdue_rentals.counts()
+    return json_response(dumps([{'store_id': store_id, 'overdue': count} for store_id, count in sorted(counts.items())]))
+
+def collect_rollup_stats():
+    stats = rollups.stats()
+    return [
+        ('rental_rollup_watermark', 'gauge', 'Highest rental_id folded into the rollups',
+         [({}, stats['watermark'] or 0)]),
+        ('rental_rollup_rental_ids_folded_total', 'counter', 'Rental ids folded into the rollups',
+         [({}, stats['rental_ids_folded'])]),
+        ('rental_rollup_sync_seconds_total', 'counter', 'Time spent syncing the rollups',
+         [({}, stats['sync_time'])]),
+    ]
+
+metrics_registry.collector(collect_rollup_stats)
+
+def collect_overdue_stats():
+    stats = overdue_rentals.stats()
+    return [
+        ('overdue_index_open_rentals', 'gauge', 'Open rentals in the overdue index', [({}, stats['open_rentals'])]),
+        ('overdue_index_dropped_on_read_total', 'counter', 'Rentals found returned when an overdue page was read',
+         [({}, stats['dropped_on_read'])]),
+        ('overdue_rentals', 'gauge', 'Overdue rentals per store',
+         [({'store': str(store_id)}, count) for store_id, count in overdue_rentals.counts().items()]),
+    ]
+
+metrics_registry.collector(collect_overdue_stats)
+
+def collect_catalog_stats():
+    stats = catalog.stats()
+    if 'films' not in stats:
+        return []
+    return [
+        ('catalog_films', 'gauge', 'Films in the catalog snapshot', [({}, stats['films'])]),
+        ('catalog_bytes', 'gauge', 'Memory held by the catalog snapshot',
+         [({'part': 'arrays'}, stats['array_bytes']), ({'part': 'strings'}, stats['string_bytes'])]),
+        ('catalog_load_seconds', 'gauge', 'Time the current catalog snapshot took to load',
+         [({}, stats['load_time'])]),
+        ('catalog_refreshes_total', 'counter', 'Catalog snapshots rebuilt after a change', [({}, stats['refreshes'])]),
+    ]
+
+metrics_registry.collector(collect_catalog_stats)
+
+def check_statements():
+    #EXPLAINs every registered statement; see STATEMENT_CHECK
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        try:
+            problems = statements.check(cursor, statement_check_min_rows)
+        finally:
+            cursor.close()
+    for name, kind, message in problems:
+        statement_log.warning('%s in statement %s: %s', kind, name, message)
+    errors = [name for name, kind, _ in problems if kind == 'error']
+    if errors and statement_check == 'strict':
+        raise RuntimeError(f'Statements do not match the schema: {", ".join(errors)}')
+    return problems
+
+
+def warm_up():
+    #Prepare derived tables, open pooled connections and build the in-memory indexes before serving traffic
+    with transaction() as cursor:
+        film_stats.ensure_built(cursor)
+        if rental_log is not None:
+            write_behind.ensure_table(cursor)
+    if statement_check != 'off':
+        check_statements()
+    pool.prefill()
+    for replica in replica_router.replicas:
+        try:
+            replica.pool.prefill()
+        except (mysql.connector.Error, PoolTimeout):
+            #An unreachable replica is marked down by the first read that tries it
+            pass
+    if rental_log is not None:
+        rental_log.start()
+    catalog.start()
+    film_index.build()
+    customer_index.build()
+    actor_stats.build()
+    rollups.ensure_built()
+    overdue_rentals.start()
+
+
+def shut_down(timeout=10):
+    #Called once in-flight requests are done: applies queued rental events, then closes connections
+    if rental_log is not None:
+        rental_log.stop(timeout)
+    overdue_rentals.stop()
+    catalog.stop()
+    pool.close_all()
+    for replica in replica_router.replicas:
+        replica.pool.close_all()
+
+#Development server only; use server.py (pre-forked workers) in production
 if __name__ == '__main__':
+    warm_up()
     app.run(debug=True, port=5000)
@@ -0,0 +1,240 @@
+'''
+Minimal Prometheus-style metrics (counters and histograms) plus a timing cursor wrapper.
+
+Registry.render() produces the text exposition format served on /metrics.
+InstrumentedCursor wraps a MySQL cursor and records per-statement execute time,
+fetch time and row counts; statements slower than the slow-query threshold are
+logged with their normalized text and parameters.
+'''
+import hashlib
+import logging
+import re
+import threading
+import time
+from bisect import bisect_left
+from functools import lru_cache
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+slow_query_log = logging.getLogger('sakila.slow_query')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f'{self.name}{_labels(self.labelnames, labels)} {value}' for labels, value in items]
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        position = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            if position < len(self.buckets):
+                series[position] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(labels, list(series)) for labels, series in self._series.items()]
+        lines = []
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, labels, [("le", bound)])} {cumulative}')
+            lines.append(f'{self.name}_bucket{_labels(self.labelnames, labels, [("le", "+Inf")])} {series[-1]}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, labels)} {series[-2]:.6f}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, labels)} {series[-1]}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, help_text, labelnames=()):
+        metric = Counter(name, help_text, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help_text, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, collect):
+        # collect() is called at scrape time and returns [(name, kind, help_text, samples)],
+        # where samples is a list of (labels dict, value)
+        self._collectors.append(collect)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.help_text}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.samples())
+        for collect in self._collectors:
+            for name, kind, help_text, samples in collect():
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, value in samples:
+                    lines.append(f'{name}{_labels(labels.keys(), labels.values())} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+_IN_LIST_RE = re.compile(r'in\s*\(\s*%s(\s*,\s*%s)*\s*\)', re.IGNORECASE)
+_LITERAL_RE = re.compile(r"'(?:[^'\\]|\\.)*'|\b\d+\b")
+_SPACE_RE = re.compile(r'\s+')
+
+
+@lru_cache(maxsize=1024)
+def normalize_statement(query):
+    # Collapse whitespace, literals and variable-length IN lists so one statement shape
+    # maps to one metric series; returns (statement_id, normalized_text)
+    text = _SPACE_RE.sub(' ', query).strip().rstrip(';').strip()
+    text = _IN_LIST_RE.sub('in (...)', text)
+    text = _LITERAL_RE.sub('?', text)
+    return hashlib.sha1(text.encode()).hexdigest()[:10], text
+
+
+class SqlMetrics:
+    def __init__(self, registry, slow_query_seconds=None, on_statement=None):
+        self.slow_query_seconds = slow_query_seconds
+        self.on_statement = on_statement  # called once per recorded statement
+        self.statements = {}
+        self.execute_seconds = registry.histogram(
+            'sql_execute_seconds', 'Time spent in cursor.execute per statement', ('statement_id',))
+        self.fetch_seconds = registry.histogram(
+            'sql_fetch_seconds', 'Time spent fetching rows per statement', ('statement_id',))
+        self.rows = registry.counter('sql_rows_total', 'Rows fetched or affected per statement', ('statement_id',))
+        self.slow = registry.counter('sql_slow_queries_total', 'Statements slower than the slow-query threshold',
+                                     ('statement_id',))
+        registry.collector(self._statement_info)
+
+    def _statement_info(self):
+        # statement_id -> normalized SQL, so the per-statement series can be read
+        samples = [({'statement_id': statement_id, 'sql': text[:300]}, 1)
+                   for statement_id, text in list(self.statements.items())]
+        return [('sql_statement_info', 'gauge', 'Normalized SQL text of each statement_id', samples)]
+
+    def record(self, query, params, execute_seconds, fetch_seconds, rows):
+        statement_id, text = normalize_statement(query)
+        self.statements.setdefault(statement_id, text)
+        if self.on_statement is not None:
+            self.on_statement()
+        self.execute_seconds.observe(execute_seconds, statement_id)
+        if fetch_seconds is not None:
+            self.fetch_seconds.observe(fetch_seconds, statement_id)
+        if rows:
+            self.rows.inc(statement_id, amount=rows)
+        total = execute_seconds + (fetch_seconds or 0)
+        if self.slow_query_seconds is not None and total >= self.slow_query_seconds:
+            self.slow.inc(statement_id)
+            slow_query_log.warning('slow query %.1f ms [%s] %s params=%r',
+                                   total * 1000, statement_id, text, params)
+
+
+class InstrumentedCursor:
+    # Delegates to a real cursor; only execute/executemany/fetch* are timed
+    def __init__(self, cursor, sql_metrics):
+        self._cursor = cursor
+        self._metrics = sql_metrics
+        self._query = None
+        self._pending = None  # (params, execute_seconds) until the first fetch
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def _flush(self):
+        # A statement that was never fetched from (writes, DDL) is recorded with its rowcount
+        if self._pending is not None:
+            params, execute_seconds = self._pending
+            self._pending = None
+            self._metrics.record(self._query, params, execute_seconds, None, max(self._cursor.rowcount, 0))
+
+    def execute(self, query, params=()):
+        self._flush()
+        started = time.perf_counter()
+        result = self._cursor.execute(query, params)
+        self._query = query
+        self._pending = (params, time.perf_counter() - started)
+        return result
+
+    def executemany(self, query, seq_params):
+        self._flush()
+        started = time.perf_counter()
+        result = self._cursor.executemany(query, seq_params)
+        self._query = query
+        self._pending = (None, time.perf_counter() - started)
+        self._flush()
+        return result
+
+    def _timed_fetch(self, fetch, *args):
+        started = time.perf_counter()
+        rows = fetch(*args)
+        elapsed = time.perf_counter() - started
+        count = len(rows) if isinstance(rows, list) else int(rows is not None)
+        if self._pending is not None:
+            params, execute_seconds = self._pending
+            self._pending = None
+            self._metrics.record(self._query, params, execute_seconds, elapsed, count)
+        elif self._query is not None and count:
+            # later batches from an unbuffered cursor
+            self._metrics.rows.inc(normalize_statement(self._query)[0], amount=count)
+        return rows
+
+    def fetchall(self):
+        return self._timed_fetch(self._cursor.fetchall)
+
+    def fetchone(self):
+        return self._timed_fetch(self._cursor.fetchone)
+
+    def fetchmany(self, size=1):
+        return self._timed_fetch(self._cursor.fetchmany, size)
+
+    def close(self):
+        self._flush()
+        return self._cursor.close()
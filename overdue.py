@@ -0,0 +1,242 @@
+'''
+In-memory index of open rentals by due date, behind /api/overdue.
+
+A rental is due rental_duration days (from sakila.film) after its rental_date. Open
+rentals are kept in one list per store and one per customer, each sorted by
+(due date, rental_id), so the overdue rentals of a store or customer are the prefix of
+its list before "now": a binary search finds the end and only the rows returned are
+touched, however long the rental history is.
+
+The index is bootstrapped from one query over the open rentals and then maintained by
+a background thread. The rent paths hand over new rental ids (rented) and the return
+paths remove rentals (returned); every sync_interval the thread also picks up rentals
+other processes created, by reading open rentals above the id watermark. The window
+re-reads the last lookback ids as well, so a rental whose transaction committed after
+a higher id was already seen is not missed. Returns made by other processes are found
+by the same sync, which re-checks up to recheck_batch of the rentals it holds by
+primary key (taking the next ones in id order each time) and drops the closed ones, so
+counts() catches up within a few sync_intervals. Pages re-check their own rows when
+they are read, and a full rebuild every rebuild_interval starts over.
+'''
+import threading
+import time
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta
+
+import statements
+
+OPEN_RENTALS = """select r.rental_id, r.customer_id, i.store_id, r.rental_date, f.rental_duration
+                  from sakila.rental r
+                  join sakila.inventory i on r.inventory_id = i.inventory_id
+                  join sakila.film f on i.film_id = f.film_id
+                  where r.return_date is null"""
+
+DETAILS_QUERY = statements.template('overdue_details', """select r.rental_id, r.customer_id, c.first_name, c.last_name, i.store_id, i.film_id, f.title,
+                          r.rental_date
+                   from sakila.rental r
+                   join sakila.customer c on r.customer_id = c.customer_id
+                   join sakila.inventory i on r.inventory_id = i.inventory_id
+                   join sakila.film f on i.film_id = f.film_id
+                   where r.rental_id in ({placeholders}) and r.return_date is null;""")
+
+STILL_OPEN_QUERY = statements.template('overdue_still_open', """select rental_id from sakila.rental
+                   where rental_id in ({placeholders}) and return_date is null;""")
+
+
+def _remove(entries, entry):
+    index = bisect_left(entries, entry)
+    if index < len(entries) and entries[index] == entry:
+        del entries[index]
+
+
+class OverdueRentals:
+    def __init__(self, fetch_all, sync_interval=5, rebuild_interval=3600, lookback=1000, recheck_batch=4096):
+        self.fetch_all = fetch_all
+        self.sync_interval = sync_interval
+        self.rebuild_interval = rebuild_interval
+        self.lookback = lookback
+        self.recheck_batch = recheck_batch
+
+        self._rentals = {}      # rental_id -> (due, customer_id, store_id)
+        self._by_store = {}     # store_id -> [(due, rental_id)] sorted
+        self._by_customer = {}  # customer_id -> [(due, rental_id)] sorted
+        self._watermark = 0
+        self._new_ids = set()   # rented here, not loaded yet
+        self._recheck_after = 0  # the next re-check of held rentals starts above this id
+        self._built_at = None
+        self._stopping = False
+        self._thread = None
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+
+        self._stats = {
+            'syncs': 0,
+            'added': 0,
+            'removed': 0,
+            'dropped_on_read': 0,
+            'dropped_on_sync': 0,
+            'build_time': 0.0,
+        }
+
+    def _add(self, rental_id, customer_id, store_id, rental_date, rental_duration):
+        # Called with the lock held
+        if rental_id in self._rentals or rental_date is None:
+            return
+        due = rental_date + timedelta(days=rental_duration)
+        self._rentals[rental_id] = (due, customer_id, store_id)
+        insort(self._by_store.setdefault(store_id, []), (due, rental_id))
+        insort(self._by_customer.setdefault(customer_id, []), (due, rental_id))
+        self._stats['added'] += 1
+
+    def _discard(self, rental_id):
+        # Called with the lock held
+        rental = self._rentals.pop(rental_id, None)
+        if rental is None:
+            return False
+        due, customer_id, store_id = rental
+        _remove(self._by_store[store_id], (due, rental_id))
+        entries = self._by_customer[customer_id]
+        _remove(entries, (due, rental_id))
+        if not entries:
+            del self._by_customer[customer_id]
+        self._stats['removed'] += 1
+        return True
+
+    def build(self):
+        started = time.monotonic()
+        watermark = self.fetch_all("""select coalesce(max(rental_id), 0) from sakila.rental;""")[0][0]
+        rows = self.fetch_all(OPEN_RENTALS + " and r.rental_id <= %s;", (watermark,))
+        with self._lock:
+            self._rentals, self._by_store, self._by_customer = {}, {}, {}
+            for row in rows:
+                self._add(*row)
+            self._watermark = watermark
+            self._built_at = time.monotonic()
+            self._stats['build_time'] = round(time.monotonic() - started, 6)
+
+    def sync(self):
+        with self._lock:
+            new_ids = sorted(self._new_ids)
+            self._new_ids.clear()
+            since = max(self._watermark - self.lookback, 0)
+        rows = list(self.fetch_all(OPEN_RENTALS + " and r.rental_id > %s;", (since,)))
+        known = {row[0] for row in rows}
+        new_ids = [rental_id for rental_id in new_ids if rental_id <= since and rental_id not in known]
+        if new_ids:
+            placeholders = ', '.join(['%s'] * len(new_ids))
+            rows.extend(self.fetch_all(OPEN_RENTALS + f" and r.rental_id in ({placeholders});", tuple(new_ids)))
+        with self._lock:
+            for row in rows:
+                self._add(*row)
+                self._watermark = max(self._watermark, row[0])
+            self._stats['syncs'] += 1
+        self._recheck()
+
+    def _recheck(self):
+        # Drops held rentals that were returned through another process; checks the next
+        # recheck_batch held ids after the last one checked, wrapping around at the end
+        with self._lock:
+            held = sorted(self._rentals)
+        start = bisect_left(held, self._recheck_after + 1)
+        batch = (held[start:] + held[:start])[:self.recheck_batch]
+        if not batch:
+            return
+        still_open = set()
+        for offset in range(0, len(batch), STILL_OPEN_QUERY.max_values):
+            chunk = batch[offset:offset + STILL_OPEN_QUERY.max_values]
+            still_open.update(row[0] for row in self.fetch_all(*STILL_OPEN_QUERY.bind(chunk)))
+        with self._lock:
+            for rental_id in batch:
+                if rental_id not in still_open and self._discard(rental_id):
+                    self._stats['dropped_on_sync'] += 1
+        self._recheck_after = batch[-1] if len(batch) < len(held) else 0
+
+    def start(self):
+        if self._built_at is None:
+            self.build()
+        self._thread = threading.Thread(target=self._run, name='overdue-sync', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stopping = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stopping:
+            self._wake.wait(self.sync_interval)
+            self._wake.clear()
+            if self._stopping:
+                return
+            try:
+                if time.monotonic() - self._built_at >= self.rebuild_interval:
+                    self.build()
+                self.sync()
+            except Exception:
+                # Database unreachable; try again on the next round
+                pass
+
+    def rented(self, rental_ids):
+        # Called after a rental transaction committed; the background thread loads the rows
+        with self._lock:
+            self._new_ids.update(rental_id for rental_id in rental_ids if rental_id is not None)
+        self._wake.set()
+
+    def returned(self, rental_ids):
+        # Called after a return transaction committed
+        with self._lock:
+            for rental_id in rental_ids:
+                self._discard(rental_id)
+
+    def _page(self, entries, now, limit, offset):
+        # Called with the lock held; entries due before now, oldest due date first
+        end = bisect_left(entries, (now,))
+        return end, [rental_id for _, rental_id in entries[offset:min(end, offset + limit)]]
+
+    def overdue(self, store_id=None, customer_id=None, limit=100, offset=0, now=None):
+        # (total, [(rental_id, customer_id, first_name, last_name, store_id, film_id, title,
+        #           rental_date, due_date, days_overdue)]) for one store or one customer
+        now = now or datetime.now()
+        with self._lock:
+            if customer_id is not None:
+                entries = self._by_customer.get(customer_id, [])
+                if store_id is not None:
+                    entries = [entry for entry in entries if self._rentals[entry[1]][2] == store_id]
+            else:
+                entries = self._by_store.get(store_id, [])
+            total, rental_ids = self._page(entries, now, limit, offset)
+            due_dates = {rental_id: self._rentals[rental_id][0] for rental_id in rental_ids}
+        if not rental_ids:
+            return total, []
+
+        details = {row[0]: row for row in self.fetch_all(*DETAILS_QUERY.bind(rental_ids))}
+        closed = [rental_id for rental_id in rental_ids if rental_id not in details]
+        if closed:
+            # Returned through another process since the index saw them
+            with self._lock:
+                for rental_id in closed:
+                    self._discard(rental_id)
+                self._stats['dropped_on_read'] += len(closed)
+        rows = []
+        for rental_id in rental_ids:
+            if rental_id in details:
+                due = due_dates[rental_id]
+                rows.append((*details[rental_id], due, (now - due).days))
+        return total - len(closed), rows
+
+    def counts(self, now=None):
+        # {store_id: number of overdue rentals}
+        now = now or datetime.now()
+        with self._lock:
+            return {store_id: bisect_left(entries, (now,)) for store_id, entries in self._by_store.items()}
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                'open_rentals': len(self._rentals),
+                'watermark': self._watermark,
+                'pending_ids': len(self._new_ids),
+            })
+        return stats
@@ -0,0 +1,113 @@
+'''
+Routes reads across MySQL read replicas.
+
+Each replica has its own ConnectionPool. pick() returns the replica to use for the
+next read, either in turn (round_robin) or the one with the lowest expected wait
+(least_latency: moving average of its read time scaled by the reads in flight on it;
+a replica without a recent sample is tried again so a past slow spell is not held
+against it forever).
+A replica whose connections fail is skipped for down_seconds; callers fall back to
+the primary meanwhile.
+
+Read-your-writes is handled per client: after a client wrote, mark_write() pins its
+reads to the primary for sticky_seconds, long enough for the replicas to catch up.
+'''
+import itertools
+import threading
+import time
+
+
+class Replica:
+    def __init__(self, name, pool):
+        self.name = name
+        self.pool = pool
+        self.latency = None  # moving average of read seconds
+        self.sampled_at = 0.0
+        self.inflight = 0
+        self.reads = 0
+        self.failures = 0
+        self.down_until = 0.0
+
+
+class ReplicaRouter:
+    def __init__(self, replicas, strategy='round_robin', sticky_seconds=5.0, down_seconds=10.0, smoothing=0.2,
+                 resample_seconds=5.0):
+        if strategy not in ('round_robin', 'least_latency'):
+            raise ValueError(f'Unknown replica strategy: {strategy}')
+        self.replicas = [Replica(name, pool) for name, pool in replicas]
+        self.strategy = strategy
+        self.sticky_seconds = sticky_seconds
+        self.down_seconds = down_seconds
+        self.smoothing = smoothing
+        self.resample_seconds = resample_seconds
+
+        self._turn = itertools.count()
+        self._writers = {}  # client key -> monotonic time until which its reads use the primary
+        self._primary_reads = 0
+        self._lock = threading.Lock()
+
+    def pick(self):
+        # Returns a Replica, or None when none is configured or all are down
+        now = time.monotonic()
+        with self._lock:
+            up = [replica for replica in self.replicas if replica.down_until <= now]
+            if not up:
+                return None
+            if self.strategy == 'round_robin':
+                replica = up[next(self._turn) % len(up)]
+            else:
+                # Replicas without a recent sample count as fastest so they get one
+                replica = min(up, key=lambda r: (r.latency if now - r.sampled_at < self.resample_seconds else 0.0)
+                              * (r.inflight + 1))
+            replica.inflight += 1
+            replica.reads += 1
+            return replica
+
+    def done(self, replica, seconds=None, failed=False):
+        with self._lock:
+            replica.inflight -= 1
+            if failed:
+                replica.failures += 1
+                replica.down_until = time.monotonic() + self.down_seconds
+            elif seconds is not None:
+                replica.sampled_at = time.monotonic()
+                replica.latency = seconds if replica.latency is None else \
+                    replica.latency + self.smoothing * (seconds - replica.latency)
+
+    def count_primary_read(self):
+        with self._lock:
+            self._primary_reads += 1
+
+    def mark_write(self, client):
+        now = time.monotonic()
+        with self._lock:
+            self._writers[client] = now + self.sticky_seconds
+            if len(self._writers) > 10000:
+                self._writers = {key: until for key, until in self._writers.items() if until > now}
+
+    def is_pinned(self, client):
+        with self._lock:
+            until = self._writers.get(client)
+            if until is None:
+                return False
+            if until <= time.monotonic():
+                del self._writers[client]
+                return False
+            return True
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return {
+                'strategy': self.strategy,
+                'primary_reads': self._primary_reads,
+                'pinned_clients': sum(1 for until in self._writers.values() if until > now),
+                'replicas': {replica.name: {
+                    'reads': replica.reads,
+                    'failures': replica.failures,
+                    'inflight': replica.inflight,
+                    'latency_ms': round(replica.latency * 1000, 3) if replica.latency is not None else None,
+                    'down': replica.down_until > now,
+                    'pool': replica.pool.stats(),
+                } for replica in self.replicas},
+            }
@@ -0,0 +1,217 @@
+'''
+In-process response cache for read endpoints.
+
+Entries are kept in an LRU bounded by max_entries and expire after a per-route TTL.
+Every entry remembers the generation of the tags it depends on (e.g. 'rentals');
+invalidate() bumps those generations so stale entries are skipped without having to
+find them. Concurrent misses on the same key wait for a single computation instead
+of all hitting MySQL at once.
+
+A response computed from a read replica within lag_window seconds of an invalidation
+of one of its tags is served but not stored: the replica may not have the write yet,
+and the entry would carry the new generation until its TTL ran out.
+
+An optional shared backend lets several worker processes see each other's entries and
+invalidations. LocalBackend is the in-memory stand-in; a networked store only needs to
+provide the same get/set/incr methods.
+'''
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, request
+
+
+class LocalBackend:
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._values.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at is not None and expires_at <= time.time():
+                del self._values[key]
+                return None
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._values[key] = (value, time.time() + ttl if ttl else None)
+
+    def incr(self, key):
+        with self._lock:
+            value = (self._values.get(key, (0, None))[0] or 0) + 1
+            self._values[key] = (value, None)
+            return value
+
+
+class ResponseCache:
+    def __init__(self, max_entries=256, backend=None, wait_timeout=5, bypass=None, lag_window=0, replica_read=None):
+        self.max_entries = max_entries
+        self.backend = backend
+        self.wait_timeout = wait_timeout
+        self.bypass = bypass  # callable; when it returns True the view runs uncached
+        self.lag_window = lag_window
+        self.replica_read = replica_read  # callable; True when the current request read from a replica
+
+        self._entries = OrderedDict()  # key -> (payload, expires_at, generations)
+        self._generations = {}
+        self._changed_at = {}  # tag -> time.time() of its last invalidation
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+        self._stats = {
+            'hits': 0,
+            'shared_hits': 0,
+            'misses': 0,
+            'expired': 0,
+            'evictions': 0,
+            'invalidations': 0,
+            'coalesced': 0,
+            'bypassed': 0,
+            'not_stored_replica_lag': 0,
+        }
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _current_generations(self, tags):
+        if self.backend is not None:
+            return tuple(self.backend.get(f'gen:{tag}') or 0 for tag in tags)
+        with self._lock:
+            return tuple(self._generations.get(tag, 0) for tag in tags)
+
+    def invalidate(self, *tags):
+        now = time.time()
+        for tag in tags:
+            if self.backend is not None:
+                self.backend.incr(f'gen:{tag}')
+                if self.lag_window:
+                    self.backend.set(f'changed:{tag}', now, self.lag_window)
+            with self._lock:
+                self._generations[tag] = self._generations.get(tag, 0) + 1
+                self._changed_at[tag] = now
+        self._count('invalidations')
+
+    def _recently_changed(self, tags):
+        # True when one of the tags was invalidated less than lag_window seconds ago
+        since = time.time() - self.lag_window
+        for tag in tags:
+            with self._lock:
+                changed_at = self._changed_at.get(tag, 0)
+            if self.backend is not None:
+                changed_at = max(changed_at, self.backend.get(f'changed:{tag}') or 0)
+            if changed_at > since:
+                return True
+        return False
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _lookup(self, key, generations):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                payload, expires_at, stored_generations = entry
+                if expires_at > now and stored_generations == generations:
+                    self._entries.move_to_end(key)
+                    self._stats['hits'] += 1
+                    return payload
+                del self._entries[key]
+                self._stats['expired'] += 1
+
+        if self.backend is not None:
+            shared = self.backend.get(f'resp:{key}')
+            if shared is not None and tuple(shared[2]) == generations and shared[1] > now:
+                self._store(key, shared[0], shared[1], generations)
+                self._count('shared_hits')
+                return shared[0]
+        return None
+
+    def _store(self, key, payload, expires_at, generations):
+        with self._lock:
+            self._entries[key] = (payload, expires_at, generations)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def get_or_compute(self, key, ttl, tags, compute):
+        # compute() returns (payload, cacheable)
+        generations = self._current_generations(tags)
+        payload = self._lookup(key, generations)
+        if payload is not None:
+            return payload
+
+        with self._lock:
+            event = self._inflight.get(key)
+            leader = event is None
+            if leader:
+                event = self._inflight[key] = threading.Event()
+                self._stats['misses'] += 1
+
+        if not leader:
+            self._count('coalesced')
+            event.wait(self.wait_timeout)
+            payload = self._lookup(key, generations)
+            if payload is not None:
+                return payload
+            return compute()[0]
+
+        try:
+            payload, cacheable = compute()
+            if cacheable:
+                expires_at = time.time() + ttl
+                self._store(key, payload, expires_at, generations)
+                if self.backend is not None:
+                    self.backend.set(f'resp:{key}', (payload, expires_at, generations), ttl)
+            return payload
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            event.set()
+
+    def cached(self, ttl, tags=()):
+        # Decorator for Flask views; only 200 responses are stored
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if self.bypass is not None and self.bypass():
+                    self._count('bypassed')
+                    return view(*args, **kwargs)
+                key = request.path + '?' + '&'.join(f'{k}={v}' for k, v in sorted(request.args.items(multi=True)))
+
+                def compute():
+                    response = view(*args, **kwargs)
+                    if isinstance(response, Response) and response.status_code == 200:
+                        payload = (response.get_data(), response.mimetype)
+                        if (self.lag_window and self.replica_read is not None and self.replica_read()
+                                and self._recently_changed(tags)):
+                            self._count('not_stored_replica_lag')
+                            return payload, False
+                        return payload, True
+                    return response, False
+
+                payload = self.get_or_compute(key, ttl, tags, compute)
+                if isinstance(payload, tuple) and len(payload) == 2 and isinstance(payload[0], bytes):
+                    return Response(payload[0], mimetype=payload[1])
+                return payload
+            return wrapper
+        return decorator
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['max_entries'] = self.max_entries
+        lookups = stats['hits'] + stats['shared_hits'] + stats['misses']
+        stats['hit_ratio'] = round((stats['hits'] + stats['shared_hits']) / lookups, 4) if lookups else 0.0
+        return stats
@@ -0,0 +1,285 @@
+'''
+Time-bucketed rental rollups (sakila.rental_rollup) behind the /api/analytics routes.
+
+Rentals are summed per day, store and film together with their revenue (the film's
+rental_rate), so trends per day, week or month by store, category or film read a few
+thousand small rows instead of the whole rental history. Weeks start on Monday.
+
+The table is filled by a backfill and then extended by sync(): rental rows with an id
+above the watermark in sakila.rollup_watermark are aggregated and added in the same
+transaction that moves the watermark, at most chunk_size ids per transaction. The
+watermark row is locked while that happens, so worker processes never count a rental
+twice.
+
+Rental ids are handed out when a row is inserted, not when it commits, so a missing id
+may still show up. The watermark only moves up to the first gap in the ids; a gap
+that is still there after gap_grace seconds is taken to be a rolled-back insert and
+folded past. A rental that commits later than that is only counted by a rebuild, and
+is reported by verify. A sync runs before a read when the rollups are older than sync_interval, or
+right away after this process wrote rentals (mark_dirty).
+
+    python rollups.py backfill   # fold in everything above the watermark
+    python rollups.py rebuild    # start over from the rental history
+    python rollups.py verify     # compare with a full recompute
+'''
+import sys
+import threading
+import time
+
+CREATE_TABLES = ("""
+    create table if not exists sakila.rental_rollup (
+        day date not null,
+        store_id tinyint unsigned not null,
+        film_id smallint unsigned not null,
+        rentals int unsigned not null,
+        revenue decimal(12,2) not null,
+        primary key (day, store_id, film_id),
+        key idx_rental_rollup_film_day (film_id, day)
+    );
+""", """
+    create table if not exists sakila.rollup_watermark (
+        name varchar(32) not null primary key,
+        rental_id int unsigned not null
+    );
+""")
+
+WATERMARK = 'rental_rollup'
+
+AGGREGATE = """
+    select date(r.rental_date), i.store_id, i.film_id, count(*), sum(f.rental_rate)
+    from sakila.rental r
+    join sakila.inventory i on r.inventory_id = i.inventory_id
+    join sakila.film f on i.film_id = f.film_id
+    where r.rental_id > %s and r.rental_id <= %s
+    group by date(r.rental_date), i.store_id, i.film_id
+"""
+
+#bucket name -> SQL expression for the first day of the bucket
+BUCKETS = {
+    'day': 'ro.day',
+    'week': 'ro.day - interval weekday(ro.day) day',
+    'month': 'ro.day - interval (dayofmonth(ro.day) - 1) day',
+}
+
+#dimension name -> (key expression, name expression, joins it needs)
+DIMENSIONS = {
+    'total': ('null', 'null', ''),
+    'store': ('ro.store_id', 'null', ''),
+    'category': ('fc.category_id', 'c.name',
+                 ' join sakila.film_category fc on fc.film_id = ro.film_id'
+                 ' join sakila.category c on c.category_id = fc.category_id'),
+    'film': ('ro.film_id', 'f.title', ' join sakila.film f on f.film_id = ro.film_id'),
+}
+
+
+def ensure_tables(cursor):
+    for statement in CREATE_TABLES:
+        cursor.execute(statement)
+    cursor.execute("""insert ignore into sakila.rollup_watermark (name, rental_id) values (%s, 0);""",
+                   (WATERMARK,))
+
+
+class RentalRollups:
+    def __init__(self, transaction, fetch_all, sync_interval=5, chunk_size=50000, gap_grace=30):
+        self.transaction = transaction  # () -> context manager yielding a cursor in a transaction
+        self.fetch_all = fetch_all
+        self.sync_interval = sync_interval
+        self.chunk_size = chunk_size
+        self.gap_grace = gap_grace
+
+        self._watermark = None
+        self._gaps = {}  # first missing rental id -> monotonic time it was first seen missing
+        self._synced_at = 0.0
+        self._dirty = False
+        self._lock = threading.Lock()
+
+        self._stats = {
+            'syncs': 0,
+            'chunks': 0,
+            'rental_ids_folded': 0,
+            'gap_waits': 0,
+            'gaps_skipped': 0,
+            'sync_time': 0.0,
+        }
+
+    def _horizon(self, watermark, upper, rental_ids):
+        # Highest id up to upper that can be folded: the ids above the watermark must be
+        # contiguous up to it, apart from gaps older than gap_grace. Returns (horizon, waiting).
+        now = time.monotonic()
+        horizon = watermark
+        for rental_id in (*rental_ids, upper + 1):
+            if rental_id > horizon + 1:
+                first_seen = self._gaps.setdefault(horizon + 1, now)
+                if now - first_seen < self.gap_grace:
+                    return horizon, True
+                self._stats['gaps_skipped'] += 1
+            horizon = min(rental_id, upper)
+        return horizon, False
+
+    def _fold_chunk(self):
+        # Folds up to chunk_size rental ids into the rollups; returns (watermark, caught_up)
+        with self.transaction() as cursor:
+            cursor.execute("""select rental_id from sakila.rollup_watermark where name = %s for update;""",
+                           (WATERMARK,))
+            watermark = cursor.fetchall()[0][0]
+            cursor.execute("""select coalesce(max(rental_id), 0) from sakila.rental;""")
+            latest = cursor.fetchall()[0][0]
+            if latest <= watermark:
+                return watermark, True
+            upper = min(latest, watermark + self.chunk_size)
+            cursor.execute("""select rental_id from sakila.rental
+                              where rental_id > %s and rental_id <= %s
+                              order by rental_id;""", (watermark, upper))
+            rental_ids = [row[0] for row in cursor.fetchall()]
+            with self._lock:
+                upper, waiting = self._horizon(watermark, upper, rental_ids)
+                self._gaps = {gap: seen for gap, seen in self._gaps.items() if gap > upper}
+                if waiting:
+                    self._stats['gap_waits'] += 1
+            if upper == watermark:
+                return watermark, True
+            cursor.execute(f"""
+                insert into sakila.rental_rollup (day, store_id, film_id, rentals, revenue)
+                {AGGREGATE}
+                on duplicate key update
+                    rentals = rentals + values(rentals),
+                    revenue = revenue + values(revenue);
+            """, (watermark, upper))
+            cursor.execute("""update sakila.rollup_watermark set rental_id = %s where name = %s;""",
+                           (upper, WATERMARK))
+        with self._lock:
+            self._stats['chunks'] += 1
+            self._stats['rental_ids_folded'] += upper - watermark
+        return upper, waiting or upper >= latest
+
+    def backfill(self):
+        # Folds in everything above the watermark; returns the new watermark
+        started = time.monotonic()
+        while True:
+            watermark, caught_up = self._fold_chunk()
+            if caught_up:
+                break
+        with self._lock:
+            self._watermark = watermark
+            self._synced_at = time.monotonic()
+            self._stats['syncs'] += 1
+            self._stats['sync_time'] += self._synced_at - started
+        return watermark
+
+    def ensure_built(self):
+        with self.transaction() as cursor:
+            ensure_tables(cursor)
+        return self.backfill()
+
+    def rebuild(self):
+        with self.transaction() as cursor:
+            ensure_tables(cursor)
+            cursor.execute("""select rental_id from sakila.rollup_watermark where name = %s for update;""",
+                           (WATERMARK,))
+            cursor.fetchall()
+            cursor.execute("""delete from sakila.rental_rollup;""")
+            cursor.execute("""update sakila.rollup_watermark set rental_id = 0 where name = %s;""", (WATERMARK,))
+        return self.backfill()
+
+    def verify(self):
+        # [(day, store_id, film_id, stored (rentals, revenue), expected)] for rows that differ
+        with self.transaction() as cursor:
+            cursor.execute("""select rental_id from sakila.rollup_watermark where name = %s lock in share mode;""",
+                           (WATERMARK,))
+            watermark = cursor.fetchall()[0][0]
+            cursor.execute(AGGREGATE, (0, watermark))
+            expected = {tuple(row[:3]): (int(row[3]), row[4]) for row in cursor.fetchall()}
+            cursor.execute("""select day, store_id, film_id, rentals, revenue from sakila.rental_rollup;""")
+            stored = {tuple(row[:3]): (int(row[3]), row[4]) for row in cursor.fetchall()}
+        return [(*key, stored.get(key), expected.get(key))
+                for key in sorted(set(stored) | set(expected))
+                if stored.get(key) != expected.get(key)]
+
+    def mark_dirty(self):
+        # Called after this process inserted rentals; the next read syncs immediately
+        self._dirty = True
+
+    def sync(self, force=False):
+        with self._lock:
+            if not (force or self._dirty or self._watermark is None
+                    or time.monotonic() - self._synced_at >= self.sync_interval):
+                return
+            self._dirty = False
+        self.backfill()
+
+    def version(self):
+        # Rental watermark behind the current rollups, used for ETags
+        self.sync()
+        return self._watermark
+
+    def _range(self, start, end, store_id, category_id, film_id, dimension):
+        joins = DIMENSIONS[dimension][2]
+        conditions, params = [], []
+        for column, value in (('ro.day >= %s', start), ('ro.day <= %s', end), ('ro.store_id = %s', store_id),
+                              ('ro.film_id = %s', film_id)):
+            if value is not None:
+                conditions.append(column)
+                params.append(value)
+        if category_id is not None:
+            if dimension != 'category':
+                joins += ' join sakila.film_category fc on fc.film_id = ro.film_id'
+            conditions.append('fc.category_id = %s')
+            params.append(category_id)
+        where = (' where ' + ' and '.join(conditions)) if conditions else ''
+        return joins, where, params
+
+    def series(self, bucket, dimension='total', start=None, end=None, store_id=None, category_id=None,
+               film_id=None):
+        # [(bucket start date, key, name, rentals, revenue)] ordered by bucket, then key
+        self.sync()
+        key, name, _ = DIMENSIONS[dimension]
+        joins, where, params = self._range(start, end, store_id, category_id, film_id, dimension)
+        return self.fetch_all(f"""
+            select {BUCKETS[bucket]} as bucket, {key} as dimension_key, {name} as dimension_name,
+                   sum(ro.rentals), sum(ro.revenue)
+            from sakila.rental_rollup ro{joins}{where}
+            group by bucket, dimension_key, dimension_name
+            order by bucket, dimension_key;
+        """, tuple(params))
+
+    def top(self, dimension, n=10, start=None, end=None, store_id=None, category_id=None):
+        # [(key, name, rentals, revenue)] for the n keys with the most rentals in the range
+        self.sync()
+        key, name, _ = DIMENSIONS[dimension]
+        joins, where, params = self._range(start, end, store_id, category_id, None, dimension)
+        return self.fetch_all(f"""
+            select {key} as dimension_key, {name} as dimension_name, sum(ro.rentals) as rentals, sum(ro.revenue)
+            from sakila.rental_rollup ro{joins}{where}
+            group by dimension_key, dimension_name
+            order by rentals desc, dimension_key
+            limit %s;
+        """, (*params, n))
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['watermark'] = self._watermark
+        stats['sync_time'] = round(stats['sync_time'], 6)
+        return stats
+
+
+if __name__ == '__main__':
+    from main import rollups
+
+    command = sys.argv[1] if len(sys.argv) > 1 else ''
+    if command not in ('backfill', 'rebuild', 'verify'):
+        print('usage: python rollups.py backfill|rebuild|verify')
+        sys.exit(2)
+
+    if command in ('backfill', 'rebuild'):
+        started = time.monotonic()
+        watermark = rollups.ensure_built() if command == 'backfill' else rollups.rebuild()
+        print(f'rental_rollup {command} done up to rental_id {watermark} in {time.monotonic() - started:.1f}s')
+        sys.exit(0)
+
+    rollups.ensure_built()
+    mismatches = rollups.verify()
+    for day, store_id, film_id, stored, expected in mismatches:
+        print(f'{day} store {store_id} film {film_id}: stored (rentals, revenue) = {stored}, expected {expected}')
+    print(f'{len(mismatches)} rollup row(s) out of sync')
+    sys.exit(1 if mismatches else 0)
@@ -0,0 +1,137 @@
+'''
+Column specs that turn MySQL row tuples straight into JSON text.
+
+A RowSpec names the columns of one query shape and how each value is written. Rows
+stay plain tuples: encode() writes a row as a JSON object without building a dict, and
+encode_rows(columnar=True) writes {"columns": [...], "rows": [[...], ...]} so large
+lists do not repeat every key per row. The output matches what jsonify produces for
+the equivalent dicts: keys sorted, ASCII only, dates in HTTP date format and Decimal
+as a string.
+
+Kinds: int, str, bool (true when the value is 1), decimal, datetime (dates too),
+set (MySQL SET columns, written as a sorted list) and any (falls back to dumps()).
+'''
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from json.encoder import encode_basestring_ascii
+
+from flask import Response
+
+_DAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+_MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+
+def http_date(value):
+    # Same text as werkzeug.http.http_date for naive (UTC) datetimes and dates
+    if isinstance(value, datetime):
+        return (f'{_DAYS[value.weekday()]}, {value.day:02d} {_MONTHS[value.month - 1]} {value.year:04d} '
+                f'{value.hour:02d}:{value.minute:02d}:{value.second:02d} GMT')
+    return f'{_DAYS[value.weekday()]}, {value.day:02d} {_MONTHS[value.month - 1]} {value.year:04d} 00:00:00 GMT'
+
+
+def _default(value):
+    if isinstance(value, date):
+        return http_date(value)
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+_encoder = json.JSONEncoder(default=_default, separators=(',', ':'), sort_keys=True)
+
+
+def dumps(obj):
+    # Compact JSON with the same conventions as jsonify, for shapes that are not a flat row
+    return _encoder.encode(obj)
+
+
+def _int(value):
+    return 'null' if value is None else '%d' % value
+
+
+def _str(value):
+    return 'null' if value is None else encode_basestring_ascii(value)
+
+
+def _bool(value):
+    return 'true' if value == 1 else 'false'
+
+
+def _decimal(value):
+    return 'null' if value is None else f'"{value}"'
+
+
+def _datetime(value):
+    return 'null' if value is None else f'"{http_date(value)}"'
+
+
+def _set(value):
+    if value is None:
+        return 'null'
+    if isinstance(value, str):
+        return encode_basestring_ascii(value)
+    return '[' + ','.join([encode_basestring_ascii(item) for item in sorted(value)]) + ']'
+
+
+ENCODERS = {
+    'int': _int,
+    'str': _str,
+    'bool': _bool,
+    'decimal': _decimal,
+    'datetime': _datetime,
+    'set': _set,
+    'any': dumps,
+}
+
+_PYTHON_VALUES = {
+    'bool': lambda value: value == 1,
+    'set': lambda value: sorted(value) if isinstance(value, (set, frozenset)) else value,
+}
+
+
+class RowSpec:
+    __slots__ = ('name', 'keys', '_fields', '_array_encoders', '_converters', '_columns_json')
+
+    def __init__(self, name, columns):
+        # columns: [(key, kind)] in the order the query returns them
+        self.name = name
+        self.keys = tuple(key for key, _ in columns)
+        for key, kind in columns:
+            if kind not in ENCODERS:
+                raise ValueError(f'Unknown column kind {kind!r} for {name}.{key}')
+        # (prefix, index, encoder) in sorted key order, the first one opening the object
+        ordered = sorted(range(len(columns)), key=lambda index: columns[index][0])
+        self._fields = [((',' if position else '{') + encode_basestring_ascii(columns[index][0]) + ':',
+                         index, ENCODERS[columns[index][1]]) for position, index in enumerate(ordered)]
+        self._array_encoders = [ENCODERS[kind] for _, kind in columns]
+        self._converters = [_PYTHON_VALUES.get(kind) for _, kind in columns]
+        self._columns_json = '[' + ','.join(encode_basestring_ascii(key) for key in self.keys) + ']'
+
+    def encode(self, row):
+        return ''.join([prefix + encode(row[index]) for prefix, index, encode in self._fields]) + '}'
+
+    def encode_array(self, row):
+        return '[' + ','.join([encode(value) for encode, value in zip(self._array_encoders, row)]) + ']'
+
+    def encode_rows(self, rows, columnar=False):
+        if columnar:
+            return ('{"columns":' + self._columns_json + ',"rows":['
+                    + ','.join([self.encode_array(row) for row in rows]) + ']}')
+        return '[' + ','.join([self.encode(row) for row in rows]) + ']'
+
+    def to_dict(self, row):
+        # For responses that nest rows inside a larger object
+        return {key: convert(value) if convert is not None else value
+                for key, convert, value in zip(self.keys, self._converters, row)}
+
+
+def json_response(body, status=200, headers=None):
+    # body is JSON text from RowSpec.encode*/dumps; the trailing newline matches jsonify
+    return Response(body + '\n', status=status, headers=headers, mimetype='application/json')
+
+
+def wants_columnar(request):
+    return request.args.get('format') == 'columns'
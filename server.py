@@ -0,0 +1,147 @@
+'''
+Production entry point: the Flask app behind a pre-forked gunicorn server.
+
+    python server.py --workers 4 --threads 8 --bind 0.0.0.0:5000 --pid server.pid
+    kill -HUP $(cat server.pid)    # graceful reload: fresh workers warm up, old ones drain
+    kill -TERM $(cat server.pid)   # graceful stop
+
+The master process forks --workers processes and each serves up to --threads requests
+at a time. Every worker runs main.warm_up() after the fork and before it accepts a
+connection: derived tables are checked, the connection pool is opened and the search
+indexes and caches are built, so no request pays for a cold start. Connections and
+background threads are never shared across the fork; each worker has its own pool, so
+the database sees up to workers * (MYSQL_POOL_SIZE + MYSQL_POOL_MAX_OVERFLOW)
+connections.
+With CATALOG_SNAPSHOT set, workers map the same catalog snapshot file instead of each
+reading the catalog tables, and the mapped pages are shared between them.
+
+On HUP or TERM a worker stops accepting, finishes the requests it has in flight (a
+rental inside its transaction commits or rolls back as a whole) for up to
+--graceful-timeout seconds, then main.shut_down() applies any queued write-behind
+events and closes its connections. Events not applied by then stay in the worker's
+log file, which the next worker adopts and replays.
+
+Metrics and the in-memory caches are per worker; /metrics shows the worker that
+answered the scrape.
+'''
+import argparse
+import multiprocessing
+import os
+import threading
+
+from gunicorn.app.base import BaseApplication
+
+#Defaults, each overridable on the command line
+DEFAULT_BIND = os.getenv('SERVER_BIND', '0.0.0.0:5000')
+DEFAULT_WORKERS = int(os.getenv('SERVER_WORKERS', multiprocessing.cpu_count()))
+DEFAULT_THREADS = int(os.getenv('SERVER_THREADS', 4))
+DEFAULT_TIMEOUT = int(os.getenv('SERVER_TIMEOUT', 30))
+DEFAULT_GRACEFUL_TIMEOUT = int(os.getenv('SERVER_GRACEFUL_TIMEOUT', 30))
+
+
+def _heartbeating(worker, function, name):
+    #Runs function on a thread while telling the master the worker is alive, so slow
+    #startup or shutdown work is not mistaken for a hung worker and killed
+    finished = threading.Event()
+    errors = []
+
+    def run():
+        try:
+            function()
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            finished.set()
+
+    threading.Thread(target=run, name=name, daemon=True).start()
+    while not finished.wait(1.0):
+        worker.notify()
+    if errors:
+        raise errors[0]
+
+
+def post_worker_init(worker):
+    #Runs in each worker after the fork, before it accepts connections. A worker that cannot
+    #warm up raises here and never serves; gunicorn then stops with a boot error.
+    import main
+
+    _heartbeating(worker, main.warm_up, 'warm-up')
+    worker.log.info('Worker %s warmed up', worker.pid)
+
+
+def worker_exit(server, worker):
+    #Runs in the worker once it stopped accepting and its in-flight requests finished
+    import main
+
+    _heartbeating(worker, lambda: main.shut_down(timeout=worker.cfg.graceful_timeout), 'shut-down')
+
+
+def on_reload(server):
+    server.log.info('Reloading: starting fresh workers, draining the old ones')
+
+
+class Server(BaseApplication):
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            if value is not None:
+                self.cfg.set(key, value)
+        self.cfg.set('post_worker_init', post_worker_init)
+        self.cfg.set('worker_exit', worker_exit)
+        self.cfg.set('on_reload', on_reload)
+
+    def load(self):
+        #Imported here so that, without --preload, every worker (and every reload) loads fresh code
+        from main import app
+        return app
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Run the API with pre-forked worker processes.')
+    parser.add_argument('--bind', action='append',
+                        help=f'host:port or unix:path, may be repeated (default {DEFAULT_BIND})')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='worker processes')
+    parser.add_argument('--threads', type=int, default=DEFAULT_THREADS, help='request threads per worker')
+    parser.add_argument('--timeout', type=int, default=DEFAULT_TIMEOUT,
+                        help='seconds a busy worker may go silent before it is restarted')
+    parser.add_argument('--graceful-timeout', type=int, default=DEFAULT_GRACEFUL_TIMEOUT,
+                        help='seconds a stopping worker gets to finish in-flight requests')
+    parser.add_argument('--keep-alive', type=int, default=5, help='seconds to hold idle keep-alive connections')
+    parser.add_argument('--backlog', type=int, default=2048, help='pending connections the socket queues')
+    parser.add_argument('--max-requests', type=int, default=0,
+                        help='recycle a worker after this many requests (0 = never)')
+    parser.add_argument('--max-requests-jitter', type=int, default=0)
+    parser.add_argument('--preload', action='store_true',
+                        help='import the app once in the master (less memory; HUP then keeps the old code)')
+    parser.add_argument('--pid', help='write the master pid to this file')
+    parser.add_argument('--log-level', default='info')
+    parser.add_argument('--access-log', help="access log file, '-' for stdout")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    Server({
+        'bind': args.bind or [DEFAULT_BIND],
+        'workers': args.workers,
+        'threads': args.threads,
+        'worker_class': 'gthread' if args.threads > 1 else 'sync',
+        #The master counts a draining worker as hung after timeout seconds, so it must cover the drain
+        'timeout': max(args.timeout, args.graceful_timeout),
+        'graceful_timeout': args.graceful_timeout,
+        'keepalive': args.keep_alive,
+        'backlog': args.backlog,
+        'max_requests': args.max_requests,
+        'max_requests_jitter': args.max_requests_jitter,
+        'preload_app': args.preload,
+        'pidfile': args.pid,
+        'loglevel': args.log_level,
+        'accesslog': args.access_log,
+    }).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+'''
+Central registry of the SQL the read paths run, executed as server-side prepared statements.
+
+Modules register their statements at import time with register() (fixed text) or
+template() (an IN list whose length varies). fetch_all looks the query text up here;
+registered statements run through a prepared cursor that is kept per pooled
+connection, so MySQL parses and plans each statement once per connection instead of
+once per request. Unregistered text (writes, one-off maintenance queries) keeps the
+plain text protocol.
+
+Templates pad their IN list to the next power of two by repeating the last value,
+which leaves the result unchanged and keeps the number of distinct statements per
+template small (1, 2, 4, ... up to max_values).
+
+check() runs EXPLAIN for every registered statement with example parameters: a
+statement that no longer matches the schema is reported as an error, and a plan that
+reads a whole table or index of at least min_rows rows as a full scan, unless the
+statement was registered with full_scan_ok (index builds read whole tables on purpose).
+
+    python statements.py check [--min-rows 1000]
+'''
+import argparse
+import sys
+import threading
+import weakref
+from collections import OrderedDict
+
+import mysql.connector
+
+_statements = {}  # sql text -> Statement
+_names = {}       # name -> Statement or Template
+_lock = threading.Lock()
+
+
+class Statement:
+    __slots__ = ('name', 'sql', 'explain_params', 'full_scan_ok')
+
+    def __init__(self, name, sql, explain_params=None, full_scan_ok=False):
+        self.name = name
+        self.sql = sql
+        # Example values for EXPLAIN; 1 for every placeholder unless given
+        self.explain_params = tuple(explain_params) if explain_params is not None else (1,) * sql.count('%s')
+        self.full_scan_ok = full_scan_ok
+
+
+class Template:
+    # A statement with an "in ({placeholders})" list of varying length
+    def __init__(self, name, sql, max_values=1024, full_scan_ok=False):
+        self.name = name
+        self.sql = sql
+        self.max_values = max_values
+        self.full_scan_ok = full_scan_ok
+        self._variants = {}  # padded size -> Statement
+
+    def _variant(self, size):
+        statement = self._variants.get(size)
+        if statement is None:
+            statement = _add(Statement(f'{self.name}[{size}]',
+                                       self.sql.format(placeholders=', '.join(['%s'] * size)),
+                                       full_scan_ok=self.full_scan_ok))
+            self._variants[size] = statement
+        return statement
+
+    def bind(self, values, *params):
+        # (sql, params) for the given IN values followed by any further parameters
+        values = list(values)
+        if not values or len(values) > self.max_values:
+            raise ValueError(f'{self.name} takes 1 to {self.max_values} values, got {len(values)}')
+        size = 1
+        while size < len(values):
+            size *= 2
+        values.extend([values[-1]] * (size - len(values)))
+        return self._variant(size).sql, (*values, *params)
+
+
+def _add(statement):
+    with _lock:
+        existing = _statements.get(statement.sql)
+        if existing is not None:
+            return existing
+        _statements[statement.sql] = statement
+    return statement
+
+
+def register(name, sql, explain_params=None, full_scan_ok=False):
+    # Returns the sql text; pass exactly this string to fetch_all
+    if name in _names and getattr(_names[name], 'sql', None) != sql:
+        raise ValueError(f'Statement {name!r} is already registered with different SQL')
+    statement = _add(Statement(name, sql, explain_params, full_scan_ok))
+    _names[name] = statement
+    return statement.sql
+
+
+def template(name, sql, max_values=1024, full_scan_ok=False):
+    if name in _names:
+        raise ValueError(f'Statement {name!r} is already registered')
+    registered = _names[name] = Template(name, sql, max_values, full_scan_ok)
+    return registered
+
+
+def lookup(sql):
+    return _statements.get(sql)
+
+
+def registered():
+    # Named statements and the one-value variant of every template, for check()
+    result = []
+    for item in list(_names.values()):
+        result.append(item._variant(1) if isinstance(item, Template) else item)
+    return result
+
+
+class PreparedStatements:
+    # Prepared cursors per pooled connection, at most max_per_connection, least recently used evicted.
+    # A connection is used by one thread at a time, so only the outer map needs the lock.
+    def __init__(self, max_per_connection=64):
+        self.max_per_connection = max_per_connection
+        self._cursors = weakref.WeakKeyDictionary()  # connection -> OrderedDict(sql -> prepared cursor)
+        self._lock = threading.Lock()
+        self._stats = {
+            'prepared': 0,
+            'reused': 0,
+            'evicted': 0,
+            'failed': 0,
+        }
+
+    def cursor(self, conn, statement):
+        with self._lock:
+            cursors = self._cursors.get(conn)
+            if cursors is None:
+                cursors = self._cursors[conn] = OrderedDict()
+        cursor = cursors.get(statement.sql)
+        if cursor is not None:
+            cursors.move_to_end(statement.sql)
+            with self._lock:
+                self._stats['reused'] += 1
+            return cursor
+        cursor = cursors[statement.sql] = conn.cursor(prepared=True)
+        evicted = []
+        while len(cursors) > self.max_per_connection:
+            evicted.append(cursors.popitem(last=False)[1])
+        for old in evicted:
+            # Closing the cursor deallocates its statement on the server
+            try:
+                old.close()
+            except mysql.connector.Error:
+                pass
+        with self._lock:
+            self._stats['prepared'] += 1
+            self._stats['evicted'] += len(evicted)
+        return cursor
+
+    def forget(self, conn, statement):
+        # Drops a cursor whose last execution failed; it is prepared again on next use
+        cursors = self._cursors.get(conn)
+        cursor = cursors.pop(statement.sql, None) if cursors is not None else None
+        if cursor is not None:
+            try:
+                cursor.close()
+            except mysql.connector.Error:
+                pass
+        with self._lock:
+            self._stats['failed'] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['connections'] = len(self._cursors)
+            stats['statements'] = sum(len(cursors) for cursors in self._cursors.values())
+        return stats
+
+
+def check(cursor, min_rows=1000):
+    # [(statement name, 'error' | 'full_scan', message)] for every registered statement
+    problems = []
+    for statement in registered():
+        try:
+            cursor.execute('explain ' + statement.sql.strip().rstrip(';'), statement.explain_params)
+            columns = cursor.column_names
+            plan = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        except mysql.connector.Error as e:
+            problems.append((statement.name, 'error', str(e)))
+            continue
+        if statement.full_scan_ok:
+            continue
+        for step in plan:
+            table = step.get('table') or ''
+            rows = step.get('rows') or 0
+            if step.get('type') in ('ALL', 'index') and not table.startswith('<') and rows >= min_rows:
+                scan = 'table' if step['type'] == 'ALL' else 'index'
+                problems.append((statement.name, 'full_scan',
+                                 f'full {scan} scan of {table} (~{rows} rows, key {step.get("key")})'))
+    return problems
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['check'])
+    parser.add_argument('--min-rows', type=int, default=1000, help='ignore full scans of smaller tables')
+    args = parser.parse_args()
+
+    from main import pool
+
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        try:
+            problems = check(cursor, args.min_rows)
+        finally:
+            cursor.close()
+
+    for name, kind, message in problems:
+        print(f'{kind:<10} {name}: {message}')
+    print(f'{len(registered())} statement(s) checked, {len(problems)} problem(s)')
+    sys.exit(1 if problems else 0)
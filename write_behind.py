@@ -0,0 +1,333 @@
+'''
+Write-behind log for single rentals and returns (optional, WRITE_BEHIND=1).
+
+append() writes the validated event as one JSON line to a local log file and returns
+once the line is on disk. Appenders that arrive while an fsync is running share the
+next one, so many acknowledgements cost a single fsync. A background committer then
+applies the events to sakila in batches through apply_batch(events), which runs one
+transaction and records every event id in sakila.rental_event together with its
+effect. That table is what makes replay safe: on start the log is read back and
+only events without a row there are applied again.
+
+Each process locks its own log file (rental_events.<n>.log in the log directory);
+logs left behind by processes that are gone are taken over and replayed. A log is
+truncated once every event in it has been applied.
+'''
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+import mysql.connector
+
+from db_pool import PoolTimeout
+
+#Errors that mean "try again later" rather than "this event is bad"
+RETRYABLE = (mysql.connector.InterfaceError, mysql.connector.OperationalError, PoolTimeout)
+
+CREATE_TABLE = """
+    create table if not exists sakila.rental_event (
+        event_id char(32) not null primary key,
+        kind varchar(8) not null,
+        status varchar(8) not null,
+        rental_id int null,
+        error varchar(255) null,
+        applied_at timestamp not null default current_timestamp,
+        key idx_rental_event_applied_at (applied_at)
+    );
+"""
+
+
+def ensure_table(cursor):
+    cursor.execute(CREATE_TABLE)
+
+
+def _read_events(f):
+    # A crash can leave a half-written last line; it was never acknowledged, so skip it
+    f.seek(0)
+    events = []
+    for line in f.read().splitlines():
+        try:
+            events.append(json.loads(line))
+        except ValueError:
+            continue
+    return events
+
+
+class RentalEventLog:
+    def __init__(self, directory, apply_batch, lookup_applied, record_failure, batch_size=200,
+                 flush_interval=0.02, max_log_bytes=64 * 1024 * 1024, max_statuses=100000):
+        self.directory = directory
+        self.apply_batch = apply_batch        # events -> {event_id: outcome}, one transaction
+        self.lookup_applied = lookup_applied  # event ids -> {event_id: outcome} already in sakila
+        self.record_failure = record_failure  # (event, error message) -> stores a failed outcome
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_log_bytes = max_log_bytes
+        self.max_statuses = max_statuses
+
+        self._file = None
+        self.path = None
+        self._queue = deque()  # durable events waiting for the committer
+        self._statuses = OrderedDict()  # event_id -> outcome, most recent last
+        self._pending_films = {}  # film_id -> rentals appended but not applied
+        self._pending_returns = set()  # rental ids with a return appended but not applied
+        self._outstanding = 0  # appended and not yet applied (or failed)
+        self._written = 0
+        self._synced = 0
+        self._stopping = False
+        self._backoff = 0.0
+        self._threads = []
+
+        self._lock = threading.Lock()
+        self._written_cond = threading.Condition(self._lock)
+        self._synced_cond = threading.Condition(self._lock)
+        self._queued_cond = threading.Condition(self._lock)
+
+        self._stats = {
+            'appended': 0,
+            'fsyncs': 0,
+            'batches': 0,
+            'applied': 0,
+            'failed': 0,
+            'replayed': 0,
+            'retries': 0,
+            'truncations': 0,
+        }
+
+    def _claim(self):
+        os.makedirs(self.directory, exist_ok=True)
+        number = 0
+        while True:
+            path = os.path.join(self.directory, f'rental_events.{number}.log')
+            f = open(path, 'a+b')
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                f.close()
+                number += 1
+                continue
+            return path, f
+
+    def _orphans(self):
+        # Logs of other processes that are no longer running (their lock is free)
+        for path in sorted(glob.glob(os.path.join(self.directory, 'rental_events.*.log'))):
+            if path == self.path:
+                continue
+            f = open(path, 'a+b')
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                f.close()
+                continue
+            yield path, f
+
+    def start(self):
+        self.path, self._file = self._claim()
+        events = _read_events(self._file)
+
+        adopted = []
+        for path, f in self._orphans():
+            orphan_events = _read_events(f)
+            if orphan_events:
+                # Copy into our own log first so the events stay durable if we crash mid-replay
+                self._file.write(b''.join(json.dumps(event).encode() + b'\n' for event in orphan_events))
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                events.extend(orphan_events)
+            adopted.append((path, f))
+        for path, f in adopted:
+            os.unlink(path)
+            f.close()
+
+        applied = {}
+        ids = [event['event_id'] for event in events]
+        for start in range(0, len(ids), 500):
+            applied.update(self.lookup_applied(ids[start:start + 500]))
+        with self._lock:
+            for event in events:
+                outcome = applied.get(event['event_id'])
+                if outcome is not None:
+                    self._set_status(event['event_id'], outcome)
+                    continue
+                self._track(event, 1)
+                self._queue.append(event)
+                self._set_status(event['event_id'], {'status': 'pending'})
+                self._stats['replayed'] += 1
+
+        for target, name in ((self._sync_loop, 'rental-log-fsync'), (self._commit_loop, 'rental-log-commit')):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=10):
+        # Lets the committer drain what is queued, then stops both threads
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while self._queue and time.monotonic() < deadline:
+                self._queued_cond.notify_all()
+                self._synced_cond.wait(0.05)
+            self._stopping = True
+            self._written_cond.notify_all()
+            self._queued_cond.notify_all()
+        for thread in self._threads:
+            thread.join(max(deadline - time.monotonic(), 0.1))
+        if self._file is not None:
+            self._file.close()
+
+    def _track(self, event, delta):
+        # Called with the lock held
+        self._outstanding += delta
+        if event['kind'] == 'rent':
+            count = self._pending_films.get(event['film_id'], 0) + delta
+            if count:
+                self._pending_films[event['film_id']] = count
+            else:
+                self._pending_films.pop(event['film_id'], None)
+        elif delta > 0:
+            self._pending_returns.add(event['rental_id'])
+        else:
+            self._pending_returns.discard(event['rental_id'])
+
+    def _set_status(self, event_id, outcome):
+        # Called with the lock held
+        self._statuses[event_id] = outcome
+        self._statuses.move_to_end(event_id)
+        while len(self._statuses) > self.max_statuses:
+            self._statuses.popitem(last=False)
+
+    def append(self, kind, **fields):
+        # Returns the event id once the event is durable in the log
+        event = {'event_id': uuid.uuid4().hex, 'kind': kind, 'logged_at': time.time(), **fields}
+        line = json.dumps(event).encode() + b'\n'
+        with self._lock:
+            if self._stopping:
+                raise RuntimeError('Rental event log is shut down')
+            self._file.write(line)
+            self._written += 1
+            sequence = self._written
+            self._track(event, 1)
+            self._set_status(event['event_id'], {'status': 'pending'})
+            self._stats['appended'] += 1
+            self._written_cond.notify()
+            while self._synced < sequence:
+                self._synced_cond.wait()
+            self._queue.append(event)
+            self._queued_cond.notify()
+        return event['event_id']
+
+    def _sync_loop(self):
+        while True:
+            with self._lock:
+                while self._synced >= self._written and not self._stopping:
+                    self._written_cond.wait()
+                if self._stopping and self._synced >= self._written:
+                    return
+                target = self._written
+                self._file.flush()
+            os.fsync(self._file.fileno())
+            with self._lock:
+                self._synced = target
+                self._stats['fsyncs'] += 1
+                self._synced_cond.notify_all()
+
+    def _commit_loop(self):
+        while True:
+            with self._lock:
+                while not self._queue and not self._stopping:
+                    self._queued_cond.wait()
+                if not self._queue and self._stopping:
+                    return
+            # Give concurrent counters a moment to fill the batch
+            time.sleep(self.flush_interval)
+            with self._lock:
+                batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+            self._apply(batch)
+            self._maybe_truncate()
+
+    def _apply(self, batch):
+        try:
+            outcomes = self.apply_batch(batch)
+        except RETRYABLE:
+            # Database unreachable or overloaded: acknowledged events are never dropped
+            self._requeue(batch)
+            return
+        except Exception:
+            # One bad event must not hold up the rest, so apply them one by one
+            outcomes = {}
+            retry = []
+            for event in batch:
+                try:
+                    outcomes.update(self.apply_batch([event]))
+                except RETRYABLE:
+                    retry.append(event)
+                except Exception as e:
+                    outcomes[event['event_id']] = {'status': 'failed', 'error': str(e)[:255]}
+                    try:
+                        self.record_failure(event, outcomes[event['event_id']]['error'])
+                    except Exception:
+                        pass
+            if retry:
+                self._requeue(retry)
+        self._backoff = 0.0
+        with self._lock:
+            self._stats['batches'] += 1
+            for event in batch:
+                outcome = outcomes.get(event['event_id'])
+                if outcome is None:
+                    continue
+                self._set_status(event['event_id'], outcome)
+                self._track(event, -1)
+                self._stats['applied' if outcome.get('status') == 'applied' else 'failed'] += 1
+            self._synced_cond.notify_all()
+
+    def _requeue(self, events):
+        with self._lock:
+            self._queue.extendleft(reversed(events))
+            self._stats['retries'] += 1
+        self._backoff = min(self._backoff * 2 or 0.1, 5.0)
+        time.sleep(self._backoff)
+
+    def _log_bytes(self):
+        return os.fstat(self._file.fileno()).st_size
+
+    def _maybe_truncate(self):
+        with self._lock:
+            if self._outstanding or self._written != self._synced:
+                return
+            if self._log_bytes() < self.max_log_bytes:
+                return
+            self._file.truncate(0)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._stats['truncations'] += 1
+
+    def pending_rentals(self, film_id):
+        with self._lock:
+            return self._pending_films.get(film_id, 0)
+
+    def return_pending(self, rental_id):
+        with self._lock:
+            return rental_id in self._pending_returns
+
+    def status(self, event_id):
+        with self._lock:
+            outcome = self._statuses.get(event_id)
+        if outcome is None:
+            outcome = self.lookup_applied([event_id]).get(event_id)
+        return outcome
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                'queued': len(self._queue),
+                'outstanding': self._outstanding,
+                'log': self.path,
+                'log_bytes': self._log_bytes() if self._file is not None else 0,
+            })
+        return stats